@@ -0,0 +1,143 @@
+# interaxi -- interactive AxiDraw frontend.
+# Batch previews: time estimates for many files at once.
+
+# NOTES:
+# * Previews are CPU-bound and independent of each other, so they are run
+#   in a process pool, with one AxiDraw object per worker process.
+# * Options are passed to the workers as two plain dictionaries --
+#   one for ad.options and one for ad.params -- because plot_setup()
+#   resets them for each file.
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import glob
+import json
+import os
+import sys
+
+from .estcache import estimateFromAD
+
+# Fields in each result, in the order they're output
+resultFields = ["file", "time", "pendown", "total", "lifts", "rc"]
+
+# Expand a list of glob patterns and/or directories into a sorted list of SVG files
+def findFiles (patterns):
+    files = set()
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        for name in glob.glob(pattern):
+            if os.path.isfile(name) and name.lower().endswith(".svg"):
+                files.add(name)
+    return sorted(files)
+
+# True if the argument is something that previewBatch() should handle
+def isBatch (arg):
+    arg = os.path.expanduser(arg)
+    return os.path.isdir(arg) or glob.has_magic(arg)
+
+workerAD = None     # The AxiDraw object for this worker process
+
+def initWorker ():
+    global workerAD
+    from pyaxidraw import axidraw
+    workerAD = axidraw.AxiDraw()
+
+# Preview one file.  Runs in a worker process.
+def previewOne (filename, adOptions, adParams):
+    if workerAD is None:
+        initWorker()
+    ad = workerAD
+    result = dict.fromkeys(resultFields)
+    result["file"] = filename
+    try:
+        ad.plot_setup(filename)
+        ad.options.__dict__.update(adOptions)
+        ad.params.__dict__.update(adParams)
+        ad.options.mode = "plot"
+        ad.options.preview = True
+        ad.options.report_time = False
+        ad.options.report_lifts = False
+        ad.plot_run()
+        result["rc"] = ad.errors.code
+        result.update(estimateFromAD(ad))
+    except Exception as err:    # one bad file mustn't stop the batch
+        print(f"preview: {filename}: {err}", file=sys.stderr)
+        result["rc"] = -1
+    return result
+
+# Preview the files in parallel, returning a list of results sorted
+# with the longest first.  jobs=None means one worker per CPU.
+# If a cache (see estcache.py) is given, files with cached estimates aren't
+# previewed again, and new estimates are saved in it; opts is the full set
+# of options, for the cache key.
+def previewBatch (files, adOptions, adParams, jobs=None, progress=True, cache=None, opts={}):
+    results = []
+    if cache:
+        toPreview = []
+        for f in files:
+            estimate = cache.get(f, opts)
+            if estimate is None:
+                toPreview.append(f)
+            else:
+                results.append(dict(estimate, file=f, rc=0))
+        if progress and results:
+            print(f"{len(results)} estimates found in cache", file=sys.stderr)
+        files = toPreview
+    if not files:
+        return sortResults(results)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initWorker) as pool:
+        futures = [pool.submit(previewOne, f, adOptions, adParams) for f in files]
+        for n, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results.append(result)
+            if cache and result["rc"] == 0:
+                cache.put(result["file"], opts, None, result)
+            if progress:
+                print(f"\rpreviewed {n} of {len(files)}", end="", flush=True, file=sys.stderr)
+    if progress and files:
+        print(file=sys.stderr)
+    return sortResults(results)
+
+def sortResults (results):
+    return sorted(results, key=lambda r: (r["time"] is None, -(r["time"] or 0), r["file"]))
+
+def fmtTime (seconds):
+    if seconds is None:
+        return "-"
+    m, s = divmod(round(seconds), 60)
+    h, m = divmod(m, 60)
+    return f"{h}:{m:02d}:{s:02d}"
+
+def fmtMetres (m):
+    return "-" if m is None else f"{m:.2f}"
+
+def printTable (results, out=sys.stdout):
+    print(f"{'time':>9}  {'pen down m':>10}  {'total m':>8}  {'lifts':>6}  file", file=out)
+    totalTime = 0
+    for r in results:
+        lifts = "-" if r["lifts"] is None else r["lifts"]
+        failed = "" if r["rc"] == 0 else f"  (rc={r['rc']})"
+        print(f"{fmtTime(r['time']):>9}  {fmtMetres(r['pendown']):>10}  {fmtMetres(r['total']):>8}  {lifts:>6}  {r['file']}{failed}", file=out)
+        totalTime += r["time"] or 0
+    print(f"{fmtTime(totalTime):>9}  total for {len(results)} files", file=out)
+
+def writeJSON (results, out):
+    json.dump(results, out, indent=1)
+    out.write("\n")
+
+def writeCSV (results, out):
+    writer = csv.DictWriter(out, fieldnames=resultFields)
+    writer.writeheader()
+    writer.writerows(results)
+
+formats = {"table": printTable, "json": writeJSON, "csv": writeCSV}
+
+# Write results in the given format to the given file name, or stdout if it's None or '-'
+def writeResults (results, fmt, filename=None):
+    if filename in (None, "-"):
+        formats[fmt](results, sys.stdout)
+        return
+    with open(filename, "w", newline="") as f:
+        formats[fmt](results, f)
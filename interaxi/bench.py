@@ -0,0 +1,284 @@
+# interaxi -- interactive AxiDraw frontend.
+# Benchmarks of interaxi's own overhead, using a fake AxiDraw.
+
+# NOTES:
+# * Run with 'python -m interaxi.bench' from the directory above the
+#   interaxi package.  See --help for the options.
+# * pyaxidraw is replaced by fakeaxidraw.py, so what's measured is the
+#   time interaxi itself takes for each operation: option handling,
+#   parsing, caches, printing etc. -- not the plotter or pyaxidraw.
+# * Each operation is timed over a number of iterations (median and 95th
+#   percentile), then run once more to count the memory blocks it leaves
+#   allocated, and once more under tracemalloc for its peak memory use.
+# * Caches, config and output files all go in a temporary directory, so
+#   the user's own caches aren't touched.  Output is thrown away while
+#   measuring (but the cost of formatting it is included).
+# * Results can be saved as a baseline, and later runs compared with it:
+#   an operation whose median time has grown by more than the tolerance
+#   is reported as a regression, and the exit status is 1.
+# * With --port, the real pyaxidraw is used instead, talking to that port
+#   -- normally the virtual plotter (virtualebb.py) -- so the times are
+#   end-to-end, including pyaxidraw and the serial traffic.  Only the
+#   benchmarks that use the plotter are run.  Use a separate baseline
+#   file for these.
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from . import fakeaxidraw
+
+sampleSVG = """<svg xmlns="http://www.w3.org/2000/svg" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"
+ width="210mm" height="148mm" viewBox="0 0 210 148">
+<g inkscape:groupmode="layer" inkscape:label="1 frame"><rect x="10" y="10" width="190" height="128"/></g>
+<g inkscape:groupmode="layer" inkscape:label="2 lines">
+<path d="M 20 20 L 100 20 L 100 60"/><path d="M 20 70 C 40 50 60 90 80 70"/><polyline points="120,20 150,60 180,20"/>
+</g>
+</svg>
+"""
+
+sampleConfig = """speed_pendown = 30
+speed_penup = 80
+accel = 70
+pen_pos_down = 35
+pen_pos_up = 65
+min_gap = 0.01
+"""
+
+class NullWriter:
+    def write (self, text):
+        return len(text)
+    def flush (self):
+        pass
+
+nullWriter = NullWriter()
+
+# Time fn over a number of iterations, then count its allocations.
+# setup (if given) is run before each call, outside the timing.
+def measure (name, fn, iterations, setup=None, fake=True):
+    def run ():
+        if setup:
+            setup()
+        with contextlib.redirect_stdout(nullWriter):
+            start = time.perf_counter()
+            fn()
+            return time.perf_counter() - start
+    times = sorted(run() for _ in range(iterations))
+    # Blocks left allocated by one call
+    if setup:
+        setup()
+    gc.collect()
+    callsBefore = len(fakeaxidraw.calls) if fake else None
+    blocksBefore = sys.getallocatedblocks()
+    with contextlib.redirect_stdout(nullWriter):
+        fn()
+    blocks = sys.getallocatedblocks() - blocksBefore
+    calls = len(fakeaxidraw.calls) - callsBefore if fake else None
+    # Peak memory of one call
+    if setup:
+        setup()
+    tracemalloc.start()
+    with contextlib.redirect_stdout(nullWriter):
+        fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    fakeaxidraw.calls.clear()
+    return {"name": name,
+            "iterations": iterations,
+            "median_ms": 1000 * statistics.median(times),
+            "p95_ms": 1000 * times[min(len(times) - 1, int(0.95 * len(times)))],
+            "peak_kb": peak / 1024,
+            "blocks": blocks,
+            "axidraw_calls": calls}
+
+# Time a cold start: a new Python process importing interaxi and reading its options
+def measureStartup (iterations, workDir):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                      env.get("PYTHONPATH")]))
+    env["XDG_CACHE_HOME"] = os.path.join(workDir, "cache")
+    command = [sys.executable, "-m", "interaxi.bench", "--startup-child", os.path.join(workDir, "conf.py")]
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {"name": "startup", "iterations": iterations,
+            "median_ms": 1000 * statistics.median(times),
+            "p95_ms": 1000 * times[min(len(times) - 1, int(0.95 * len(times)))],
+            "peak_kb": None, "blocks": None, "axidraw_calls": None}
+
+# What the child process does for measureStartup()
+def startupChild (configFile):
+    fakeaxidraw.install()
+    from . import interaxi as ix
+    ix.startupStep("import interaxi modules")
+    ix.initOptions([configFile])
+
+def runBenchmarks (iterations, workDir, only=None, port=None):
+    if port is None:
+        fakeaxidraw.install()
+    os.environ["XDG_CACHE_HOME"] = os.path.join(workDir, "cache")
+    from . import interaxi as ix
+
+    svgFile = os.path.join(workDir, "sample.svg")
+    with open(svgFile, "w") as f:
+        f.write(sampleSVG)
+    configFile = os.path.join(workDir, "conf.py")
+    with open(configFile, "w") as f:
+        f.write(sampleConfig)
+    listDir = os.path.join(workDir, "files")
+    os.makedirs(listDir, exist_ok=True)
+    for n in range(200):
+        with open(os.path.join(listDir, f"drawing{n:03d}.svg"), "w") as f:
+            f.write(sampleSVG)
+    ix.scriptPolicy = {"assume_aligned": True, "on_pause": "resume", "between_copies": "delay"}
+    ix.options.page_delay = 0
+    if port is not None:
+        ix.options.port = port
+        ix.options.session = True
+        ix.startSession()
+        if ix.session.port is None:
+            return []       # openPort() has said why
+    words = ["pl", "plot", "speed_pendown", "sd", "walkx", "x", "posi", "queue", "ls", "up"]
+    # Each word must mean one command, or 'match' would be timing an error message
+    unmatched = [w for w in words if ix.commands.match(w)[0] is None]
+    if unmatched:
+        raise SystemExit(f"bench: command words {unmatched} don't match a command")
+
+    def touchConfig ():
+        # Make the config file look edited, so it's parsed again
+        st = os.stat(configFile)
+        os.utime(configFile, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+
+    def forgetIndex ():
+        # Make ls read all the files again, as on the first listing of a directory
+        ix.dirIndex.indexes.clear()
+        shutil.rmtree(ix.dirIndex.directory, ignore_errors=True)
+
+    def pauseThenComplete ():
+        fakeaxidraw.codes[:] = [102, 0]
+
+    def threeCopies ():
+        ix.options.copies = 3
+
+    walked = [0]
+    def walkThere ():
+        # Alternate directions, so a real plotter doesn't run out of room
+        walked[0] ^= 1
+        ix.walk("x", ["1" if walked[0] else "-1"])
+
+    cwd = os.getcwd()
+    benchmarks = [
+        ("match", lambda: [ix.commands.match(w) for w in words], None, len(words)),
+        ("runLine", lambda: ix.runLine("units in"), None, 1),
+        ("plotRun", lambda: ix.plotRun(cmdOpts={"mode": "manual", "manual_cmd": "raise_pen"}), None, 1),
+        ("walk", walkThere, None, 1),
+        ("plotFile", lambda: ix.plotFile([svgFile]), None, 1),
+        ("plotFile resume", lambda: ix.plotFile([svgFile]), pauseThenComplete, 1),
+        ("plotCopies", lambda: ix.plotCopies([svgFile]), threeCopies, 1),
+        ("preview cached", lambda: ix.plotFile([svgFile], preview=True), None, 1),
+        ("layers", lambda: ix.showLayers([svgFile]), None, 1),
+        ("ls", lambda: (os.chdir(listDir), ix.ls([]), os.chdir(cwd)), None, 1),
+        ("ls -l", lambda: (os.chdir(listDir), ix.ls(["-l"]), os.chdir(cwd)), None, 1),
+        ("ls -l new files", lambda: (os.chdir(listDir), ix.ls(["-l"]), os.chdir(cwd)), forgetIndex, 1),
+        ("loadConfig", lambda: ix.loadConfig([configFile]), None, 1),
+        ("loadConfig edited", lambda: ix.loadConfig([configFile]), touchConfig, 1),
+        ]
+    if port is not None:
+        benchmarks = [b for b in benchmarks if b[0] in plotterBenchmarks]
+    results = []
+    for name, fn, setup, perCall in benchmarks:
+        if only and name not in only:
+            continue
+        # ls and loadConfig are slower per call, so need fewer goes
+        n = max(5, iterations // 10) if name.startswith(("ls", "loadConfig", "plotCopies")) else iterations
+        result = measure(name, fn, n, setup, fake=port is None)
+        if perCall > 1:
+            result["name"] = f"{name} (x{perCall})"
+        results.append(result)
+    if port is None and (not only or "startup" in only):
+        results.append(measureStartup(max(3, iterations // 50), workDir))
+    return results
+
+# The benchmarks that are run against a real (or virtual) plotter with --port
+plotterBenchmarks = {"plotRun", "walk", "plotFile", "plotCopies"}
+
+def loadBaseline (filename):
+    try:
+        with open(filename) as f:
+            return {r["name"]: r for r in json.load(f)["results"]}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+def saveBaseline (filename, results):
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump({"python": sys.version.split()[0], "saved": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   "results": results}, f, indent=1)
+
+# Print the results, compared with the baseline.  Returns the names of the regressions.
+def report (results, baseline, tolerance, noise=0.05):
+    regressions = []
+    print(f"{'operation':<22} {'runs':>5} {'median ms':>10} {'p95 ms':>9} {'peak KB':>8} {'blocks':>7} {'AD calls':>8}  vs baseline")
+    for r in results:
+        peak = "-" if r["peak_kb"] is None else f"{r['peak_kb']:.1f}"
+        blocks = "-" if r["blocks"] is None else str(r["blocks"])
+        calls = "-" if r["axidraw_calls"] is None else str(r["axidraw_calls"])
+        compare = ""
+        base = baseline.get(r["name"])
+        if base:
+            change = r["median_ms"] / base["median_ms"] - 1 if base["median_ms"] else 0
+            compare = f"{100 * change:+.0f}%"
+            if change > tolerance and r["median_ms"] - base["median_ms"] > noise:
+                compare += "  ** REGRESSION **"
+                regressions.append(r["name"])
+        print(f"{r['name']:<22} {r['iterations']:5d} {r['median_ms']:10.3f} {r['p95_ms']:9.3f} "
+              f"{peak:>8} {blocks:>7} {calls:>8}  {compare}")
+    return regressions
+
+def main ():
+    from .estcache import defaultCacheDir
+    parser = argparse.ArgumentParser(description="Benchmarks of interaxi's own overhead, using a fake AxiDraw")
+    parser.add_argument("--iterations", type=int, default=200,
+            help="number of times to run each operation (default 200)")
+    parser.add_argument("--only", nargs="+", metavar="NAME",
+            help="run only these benchmarks")
+    parser.add_argument("--baseline", metavar="FILE",
+            default=os.path.join(defaultCacheDir(), "bench-baseline.json"),
+            help="baseline results to compare with (default %(default)s)")
+    parser.add_argument("--save", action="store_true",
+            help="save these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+            help="slowdown (as a fraction) that counts as a regression (default 0.25)")
+    parser.add_argument("--port", metavar="DEVICE",
+            help="use the real pyaxidraw with this port (e.g. the virtual plotter's) instead of the fake")
+    parser.add_argument("--startup-child", metavar="CONFIG", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup_child:
+        startupChild(args.startup_child)
+        return 0
+    with tempfile.TemporaryDirectory(prefix="interaxi-bench-") as workDir:
+        results = runBenchmarks(args.iterations, workDir, args.only, args.port)
+    regressions = report(results, loadBaseline(args.baseline), args.tolerance)
+    if args.save:
+        saveBaseline(args.baseline, results)
+        print(f"Baseline saved as '{args.baseline}'")
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
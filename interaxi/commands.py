@@ -0,0 +1,137 @@
+# interaxi -- interactive AxiDraw frontend.
+# Table of REPL commands: matching abbreviations, help and tab completion.
+
+# NOTES:
+# * Each command has one or more names (the first is the main one), a
+#   handler that's called with the list of arguments, a usage string
+#   such as '<filename> [<layer>]', and a line of help.  Handlers check
+#   their own arguments, and say what's wrong with them.
+# * Every name goes into a trie when the command is added, and each node
+#   remembers which command its prefix means (if it only means one), so
+#   matching an abbreviation takes one step per character typed.  An
+#   abbreviation is only ambiguous if it could mean more than one command:
+#   'speedd' and 'speed_pend' both mean the same thing.
+# * Arguments of commands whose usage mentions <filename>, <directory> or
+#   <glob> are completed as file names.
+
+import glob
+import os
+import shutil
+import textwrap
+
+class Command:
+    def __init__ (self, names, handler, usage="", help=""):
+        self.names = names      # first is the main name
+        self.handler = handler  # function(args)
+        self.usage = usage
+        self.help = help
+
+    def name (self):
+        return self.names[0]
+
+    def synopsis (self):
+        return f"{'|'.join(self.names)} {self.usage}".strip()
+
+    def wantsFiles (self):
+        return any(arg in self.usage for arg in ("<filename>", "<directory>", "<glob>"))
+
+ambiguous = object()    # trie node prefix that could mean several commands
+
+class TrieNode:
+    __slots__ = ("children", "exact", "command", "names")
+    def __init__ (self):
+        self.children = {}
+        self.exact = None       # command with exactly this name
+        self.command = None     # the command this prefix means, or ambiguous
+        self.names = []         # all the names starting with this prefix
+
+class CommandTable:
+    def __init__ (self):
+        self.commands = []
+        self.root = TrieNode()
+
+    # Add a command.  names is a list, or a string of names separated by '|'.
+    def add (self, names, handler, usage="", help=""):
+        if isinstance(names, str):
+            names = names.split("|")
+        command = Command(names, handler, usage, help)
+        self.commands.append(command)
+        for name in names:
+            node = self.root
+            for char in name:
+                node = node.children.setdefault(char, TrieNode())
+                node.names.append(name)
+                if node.command is None:
+                    node.command = command
+                elif node.command is not command:
+                    node.command = ambiguous
+            if node.exact is not None:
+                raise ValueError(f"command name '{name}' is already used")
+            node.exact = command
+        return command
+
+    def node (self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    # Match a possibly abbreviated command name.
+    # Returns (command, "") or (None, message).
+    def match (self, word):
+        if word == "":
+            return None, "Type a command, or try 'help'"
+        node = self.node(word)
+        if node is None:
+            return None, f"Command '{word}' is not known.  Try typing 'help'."
+        # Full match succeeds immediately
+        # (otherwise would fail if both 'foo' and 'foo_bar' are valid)
+        if node.exact is not None:
+            return node.exact, ""
+        if node.command is ambiguous:
+            return None, f"Command '{word}' is ambiguous -- it could match any of {sorted(node.names)}"
+        return node.command, ""
+
+    # Completions for text, the word being typed, given what comes before it on the line
+    def completions (self, before, text):
+        words = before.split()
+        if not words:
+            node = self.node(text)
+            return sorted(node.names) if node else []
+        command, _ = self.match(words[0].lower())
+        if command is None or not command.wantsFiles():
+            return []
+        matches = []
+        for name in sorted(glob.glob(os.path.expanduser(text) + "*")):
+            if os.path.isdir(name):
+                matches.append(name + os.sep)
+            elif "<filename>" in command.usage or "<glob>" in command.usage:
+                matches.append(name)
+        if text.startswith("~"):
+            # Keep the ~ the user typed
+            home = os.path.expanduser("~")
+            matches = ["~" + m[len(home):] if m.startswith(home) else m for m in matches]
+        return matches
+
+    # Brief list of all the commands, or the usage of one
+    def printHelp (self, args=[]):
+        if args:
+            command, err = self.match(args[0].lower())
+            if command is None:
+                print(err)
+                return
+            print(command.synopsis())
+            if command.help:
+                print(f"  {command.help}")
+            return
+        # Non-breaking spaces inside each entry, so entries aren't split across lines
+        entries = [c.synopsis().replace(" ", "\u00a0")
+                   for c in sorted(self.commands, key=lambda c: c.name())]
+        width = max(40, shutil.get_terminal_size().columns - 1)
+        print("Available commands:")
+        print(textwrap.fill(", ".join(entries), width=width, break_long_words=False,
+                            break_on_hyphens=False).replace("\u00a0", " "))
+        print("Commands can be abbreviated as long as what you type is unambiguous.")
+        print("Type 'help <command>' for more about a command.")
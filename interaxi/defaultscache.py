@@ -0,0 +1,95 @@
+# interaxi -- interactive AxiDraw frontend.
+# On-disk snapshot of pyaxidraw's default options.
+
+# NOTES:
+# * Reading the defaults means importing pyaxidraw and running plot_setup(),
+#   which is slow on a Pi, but they only change when pyaxidraw does.  So the
+#   values we use are saved, and read back on later launches.
+# * The snapshot is stamped with the path, mtime and size of pyaxidraw's
+#   main module (which holds its version) and its config module
+#   (axidraw_conf.py), found without importing pyaxidraw.  If either has
+#   changed, or the set of options we keep has changed, the snapshot is
+#   stale and the defaults are read from pyaxidraw again.
+# * Only the options interaxi uses are kept, so the snapshot is small, plain JSON.
+
+import importlib.util
+import json
+import os
+import tempfile
+
+from .stats import counters
+
+pyaxidrawFiles = ["axidraw.py", "axidraw_conf.py"]
+
+# The stamp for the installed pyaxidraw, or None if it can't be found
+def pyaxidrawStamp ():
+    try:
+        spec = importlib.util.find_spec("pyaxidraw")
+    except (ImportError, ValueError):
+        return None
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    directory = list(spec.submodule_search_locations)[0]
+    stamp = []
+    for name in pyaxidrawFiles:
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp.append([path, st.st_mtime_ns, st.st_size])
+    return stamp
+
+class DefaultsCache:
+    def __init__ (self, directory, optionNames, paramNames):
+        self.filename = os.path.join(directory, "defaults.json")
+        self.optionNames = sorted(optionNames)  # names to keep from ad.options
+        self.paramNames = sorted(paramNames)    # names to keep from ad.params
+
+    # The saved defaults, as a dict with 'options', 'params' and 'version'
+    # (pyaxidraw's version), or None if there are none or they're stale.
+    def load (self):
+        stamp = pyaxidrawStamp()
+        if stamp is None:
+            return None
+        try:
+            with open(self.filename) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (snapshot.get("stamp") != stamp or snapshot.get("optionNames") != self.optionNames
+                or snapshot.get("paramNames") != self.paramNames):
+            return None
+        return snapshot
+
+    # Save the defaults from an AxiDraw object just after plot_setup()
+    def save (self, ad, version):
+        stamp = pyaxidrawStamp()
+        if stamp is None:
+            return
+        snapshot = {
+            "stamp": stamp,
+            "optionNames": self.optionNames,
+            "paramNames": self.paramNames,
+            "version": version,
+            "options": {k: ad.options.__dict__[k] for k in self.optionNames if k in ad.options.__dict__},
+            "params": {k: getattr(ad.params, k) for k in self.paramNames if hasattr(ad.params, k)},
+            }
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            fd, tempName = tempfile.mkstemp(dir=os.path.dirname(self.filename), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(snapshot, f)
+                counters.wroteFile(os.path.getsize(tempName))
+                os.replace(tempName, self.filename)
+            except (OSError, TypeError, ValueError):
+                os.unlink(tempName)
+        except OSError:
+            pass    # no cache this time -- not worth bothering the user
+
+    def clear (self):
+        try:
+            os.unlink(self.filename)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,207 @@
+# interaxi -- interactive AxiDraw frontend.
+# Several plotters, with jobs from the queue sent to whichever is free.
+
+# NOTES:
+# * interaxi's own state (options, session, head position, output file
+#   etc.) is for one plotter, so each copy plotted on a device runs in a
+#   child interaxi in batch mode, given the device's port, a snapshot of
+#   the options and then the device's own profile (if it has one).  Each
+#   child has its own session on its own port, so the devices can't get
+#   in each other's way, and a crash only loses one copy.
+# * A device is only given work while it's ready: the operator says so
+#   ('device ready') once its head is at the origin and there's paper in
+#   it.  After a copy the device is held for fresh paper, unless the job is
+#   an automatic one ('queue auto'), when it waits page_delay seconds and
+#   carries on.  A copy that doesn't finish cleanly goes back to the front
+#   of the queue, and the device is held -- its head could be anywhere.
+# * The scheduler runs on asyncio: in the REPL it's a task in the event
+#   loop, so the console stays free; in a script it's run to completion.
+#   Each child's output is shown with the device's name in front.
+# * 'python -m interaxi.devices --check' runs the scheduler on two devices
+#   whose children are stand-ins (through the prepare hook), one of which
+#   fails, and checks where every copy and device ends up.
+
+import argparse
+import asyncio
+import sys
+import time
+
+class Device:
+    def __init__ (self, name, port, profile=None):
+        self.name = name
+        self.port = port        # port or nickname, or None for the first found
+        self.profile = profile  # profile name, or None
+        self.ready = False      # head at the origin, paper loaded
+        self.job = None         # job being plotted
+        self.started = None
+        self.done = 0           # copies completed
+        self.failed = 0         # copies that went back in the queue
+        self.lastRC = None
+
+    def state (self):
+        if self.job:
+            return f"plotting '{self.job.filename}' for {time.monotonic() - self.started:.0f} s"
+        return "ready" if self.ready else "held"
+
+    def __repr__ (self):
+        profile = f", profile {self.profile}" if self.profile else ""
+        return (f"{self.name}: port {self.port or '(first found)'}{profile} -- {self.state()}; "
+                f"{self.done} done, {self.failed} failed")
+
+class Scheduler:
+    # prepare(device, job) gives (argv, env, script, cleanup) for a child to plot one copy.
+    # release(device) is asked before a device is used, and returns False if it's busy elsewhere.
+    def __init__ (self, jobQueue, prepare, release):
+        self.devices = {}       # name -> Device, in the order added
+        self.jobQueue = jobQueue
+        self.prepare = prepare
+        self.release = release
+        self.running = False
+        self.wake = None        # asyncio.Event set when there may be new work, while running
+
+    def add (self, device):
+        self.devices[device.name] = device
+        self.poke()
+
+    # Look for work for any newly ready devices (or newly queued jobs)
+    def poke (self):
+        if self.wake is not None:
+            self.wake.set()
+
+    def busy (self):
+        return any(d.job for d in self.devices.values())
+
+    def list (self):
+        if not self.devices:
+            print("no devices -- 'device add <name> <port>' to add one")
+            return
+        for device in self.devices.values():
+            print(f"  {device}")
+
+    # Send jobs to ready devices until the queue is empty or paused, or no device is ready
+    async def run (self, pageDelay):
+        if self.running:
+            print("queue: already running")
+            return
+        self.running = True
+        self.jobQueue.running = True
+        self.jobQueue.paused = False
+        self.wake = asyncio.Event()
+        active = set()
+        try:
+            while True:
+                if not self.jobQueue.paused:
+                    for device in self.devices.values():
+                        if device.ready and device.job is None and self.jobQueue.jobs and self.release(device):
+                            job = self.jobQueue.take()
+                            device.job = job
+                            active.add(asyncio.create_task(self.plot(device, job, pageDelay)))
+                if not active:
+                    break
+                waker = asyncio.create_task(self.wake.wait())
+                done, _ = await asyncio.wait(active | {waker}, return_when=asyncio.FIRST_COMPLETED)
+                waker.cancel()
+                self.wake.clear()
+                active -= done
+        finally:
+            self.running = False
+            self.jobQueue.running = False
+            self.wake = None
+        if not self.jobQueue.jobs:
+            print("Queue finished")
+        elif self.jobQueue.paused:
+            print(f"Queue paused with {len(self.jobQueue)} job(s) left -- 'queue run' to continue")
+        else:
+            print(f"Queue stopped with {len(self.jobQueue)} job(s) left: no device is ready -- "
+                  "'device ready <name>' and then 'queue run'")
+
+    # Plot one copy of a job on a device, in a child interaxi
+    async def plot (self, device, job, pageDelay):
+        device.started = time.monotonic()
+        layer = "" if job.layer is None else f" layer {job.layer}"
+        print(f"[{device.name}] plotting '{job.filename}'{layer}")
+        cleanup = None
+        try:
+            # Preparing writes the options snapshot, which can fail too
+            argv, env, script, cleanup = self.prepare(device, job)
+            child = await asyncio.create_subprocess_exec(*argv, env=env, stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+            child.stdin.write(script.encode())
+            child.stdin.close()
+            async for line in child.stdout:
+                print(f"[{device.name}] {line.decode(errors='replace').rstrip()}")
+            rc = await child.wait()
+        except OSError as err:
+            print(f"[{device.name}] unable to start interaxi: {err}")
+            rc = 1
+        finally:
+            if cleanup:
+                cleanup()
+        device.lastRC = rc
+        seconds = time.monotonic() - device.started
+        if rc == 0:
+            job.done += 1
+            device.done += 1
+            print(f"[{device.name}] copy {job.done} of '{job.filename}' done in {seconds:.0f} s")
+            if job.auto:
+                await asyncio.sleep(pageDelay)
+            else:
+                device.ready = False
+                print(f"[{device.name}] held for fresh paper -- 'device ready {device.name}' to carry on")
+        else:
+            self.jobQueue.putBack(job)
+            device.failed += 1
+            device.ready = False
+            print(f"[{device.name}] stopped (rc={rc}) -- the copy is back in the queue; "
+                  f"'device ready {device.name}' once the head is at the origin")
+        device.job = None
+
+# A stand-in for a child interaxi: print the job's file name, take a while,
+# and exit with the given code
+def checkChild (seconds, rc):
+    return [sys.executable, "-c", f"import sys, time; print('plotted', sys.stdin.read()); time.sleep({seconds}); sys.exit({rc})"]
+
+# Run the scheduler on two devices: 'one' plots slowly and 'two' fails its
+# first copy.  The failed copy must go back in the queue and be plotted by
+# 'one', 'two' must be held, and 'one' must carry on through the auto job
+# and stop, held, after the other.  Returns 0 if all that happens, else 1.
+def selfCheck ():
+    from .jobqueue import Job, JobQueue
+    jobQueue = JobQueue()
+    auto = Job("auto.svg", copies=2, auto=True)
+    prompt = Job("prompt.svg", copies=1)
+    jobQueue.add(auto)
+    jobQueue.add(prompt)
+    children = {"one": (0.5, 0), "two": (0.0, 1)}
+    def prepare (device, job):
+        return checkChild(*children[device.name]), None, job.filename, lambda: None
+    scheduler = Scheduler(jobQueue, prepare, lambda device: True)
+    for name in children:
+        device = Device(name, None)
+        device.ready = True
+        scheduler.add(device)
+    asyncio.run(scheduler.run(0))
+    one, two = scheduler.devices["one"], scheduler.devices["two"]
+    checks = [("the queue is empty", not jobQueue.jobs),
+              ("'one' did all three copies", (one.done, one.failed) == (3, 0)),
+              ("'two' failed its copy", (two.done, two.failed, two.lastRC) == (0, 1, 1)),
+              ("both devices are held", not one.ready and not two.ready),
+              ("no device is still plotting", not scheduler.busy()),
+              ("every copy was done once", (auto.done, auto.copies, prompt.done, prompt.copies) == (2, 0, 1, 0))]
+    failures = [what for what, ok in checks if not ok]
+    for what in failures:
+        print(f"check: expected {what}")
+    print(f"check: {len(checks) - len(failures)} of {len(checks)} checks passed")
+    return 1 if failures else 0
+
+def main ():
+    parser = argparse.ArgumentParser(description="Check the device scheduler with stand-in plotters")
+    parser.add_argument("--check", action="store_true", help="run the check, and exit")
+    args = parser.parse_args()
+    if not args.check:
+        parser.print_help()
+        return 2
+    return selfCheck()
+
+if __name__ == '__main__':
+    sys.exit(main())
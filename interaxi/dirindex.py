@@ -0,0 +1,140 @@
+# interaxi -- interactive AxiDraw frontend.
+# Index of the SVG files in a directory, for ls.
+
+# NOTES:
+# * For each .svg file, the index keeps what takes reading the file: its
+#   page size, its layers, paths and the bounding box of the drawing (from a
+#   layer index scan -- see layerindex.py), and a hash of its contents (to
+#   look up estimates with -- see estcache.py).
+# * Given a model (see refresh()), a file's entry also gets the estimate
+#   model's time for the strokes the scan found (see estimate.py), so new
+#   files have an estimate without a plan or a preview.  The time is stamped
+#   with the model's key, so changing a speed or pen setting reads the files
+#   again on the next refresh.
+# * Entries are stamped with the file's mtime and size.  A refresh stats
+#   each file once, and only reads files that are new or have changed.
+#   (A plain 'ls' doesn't need the index at all, and only stats the files.)  Those
+#   are read on a thread pool: hashing and parsing are mostly done in C
+#   (hashlib, expat), and a big folder is often mostly waiting for the disk,
+#   so threads get through them several at a time.
+# * Each directory's index is saved (in ~/.cache/interaxi/dirindex/) when
+#   it changes, so the next session starts from it too.  Like the other
+#   caches, it's written to a temporary file and renamed.
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import tempfile
+
+from .estcache import hashFile
+from .layerindex import scanFile
+from . import svginfo
+from .stats import counters
+
+# Read a file for the index.  Runs on the thread pool.
+def scanEntry (path, model=None):
+    entry = {"mtime": None, "size": None, "hash": None, "page": None, "layers": 0, "paths": 0,
+             "bbox": None, "model": None, "error": None}
+    try:
+        # Stamped before reading, so a change while reading is seen next time
+        st = os.stat(path)
+        entry["mtime"] = st.st_mtime_ns
+        entry["size"] = st.st_size
+        entry["hash"] = hashFile(path)
+        index = scanFile(path, model is not None)
+    except OSError as err:
+        entry["error"] = err.strerror
+        return entry
+    except svginfo.ET.ParseError:
+        entry["error"] = "not valid SVG"
+        return entry
+    plotted = [l for l in index.layers if l.plotted()]
+    entry["page"] = index.size
+    entry["layers"] = len(plotted)
+    entry["paths"] = sum(l.paths for l in plotted) + index.loose.paths
+    entry["bbox"] = index.bbox()
+    if model is not None:
+        key, timeParts = model
+        entry["model"] = {"key": key, "parts": timeParts(index.strokes)}
+    return entry
+
+# The .svg files and the subdirectories in a directory, as (name, stat),
+# without reading the files
+def listDir (path):
+    files = []
+    subdirs = []
+    with os.scandir(path) as it:
+        for dirEntry in it:
+            try:
+                if dirEntry.is_dir():
+                    subdirs.append((dirEntry.name, dirEntry.stat()))
+                elif dirEntry.is_file() and dirEntry.name.lower().endswith(".svg"):
+                    files.append((dirEntry.name, dirEntry.stat()))
+            except OSError:
+                continue    # gone since it was listed
+    return files, subdirs
+
+class DirIndex:
+    def __init__ (self, cacheDir, workers=None):
+        self.directory = os.path.join(cacheDir, "dirindex")
+        self.workers = workers      # threads for reading files; None for the default
+        self.indexes = {}           # directory -> {file name: entry}
+        self.scanned = 0            # files read, in total
+        self.error = ""
+
+    def indexPath (self, path):
+        return os.path.join(self.directory, hashlib.sha256(path.encode()).hexdigest()[:24] + ".json")
+
+    def load (self, path):
+        try:
+            with open(self.indexPath(path)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data.get("files", {}) if data.get("path") == path else {}
+
+    def save (self, path, entries):
+        text = json.dumps({"path": path, "files": entries})
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmpPath = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            os.replace(tmpPath, self.indexPath(path))
+        except OSError as err:
+            self.error = f"unable to save the directory index: {err}"
+            return
+        self.error = ""
+        counters.wroteFile(len(text))
+
+    # The entries for the .svg files in a directory, reading only the files
+    # that are new or have changed, and the subdirectories as (name, stat).
+    # model is None, or (key, function) where the function gives the parts of
+    # the estimated time for a file's strokes; files whose time has another
+    # key are read again.  Returns (entries, subdirectories, number of files read).
+    def refresh (self, path, model=None):
+        path = os.path.abspath(path)
+        old = self.indexes.get(path)
+        if old is None:
+            old = self.load(path)
+        entries = {}
+        stale = []
+        files, subdirs = listDir(path)
+        for name, st in files:
+            known = old.get(name)
+            if (known and known["mtime"] == st.st_mtime_ns and known["size"] == st.st_size
+                    and (model is None or known.get("error") or (known.get("model") or {}).get("key") == model[0])):
+                entries[name] = known
+            else:
+                stale.append(name)
+        if stale:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                scanned = pool.map(scanEntry, [os.path.join(path, name) for name in stale],
+                                   [model] * len(stale))
+                entries.update(zip(stale, scanned))
+            self.scanned += len(stale)
+        self.indexes[path] = entries
+        if stale or len(entries) != len(old):
+            self.save(path, entries)
+        return entries, subdirs, len(stale)
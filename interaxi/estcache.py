@@ -0,0 +1,148 @@
+# interaxi -- interactive AxiDraw frontend.
+# On-disk cache of preview estimates.
+
+# NOTES:
+# * Entries are keyed by a hash of the SVG's contents plus the options
+#   that affect the plot time, so they become invalid by themselves when
+#   the file or the options change -- stale entries are simply never read.
+# * Each entry is a small JSON file, written atomically, so several
+#   interaxi processes (or batch workers) can share the cache.
+# * File hashes are remembered by path, mtime and size, so looking up
+#   an unchanged file doesn't mean reading it again.
+
+import hashlib
+import json
+import os
+import tempfile
+
+from .stats import counters
+
+# Options that affect the time estimate (and so are part of the key).
+estimateOpts = [
+        "accel",
+        "auto_rotate",
+        "const_speed",
+        "hiding",
+        "min_gap",
+        "model",
+        "optimise",         # plots and previews use the optimised plan
+        "pen_delay_down",
+        "pen_delay_up",
+        "pen_pos_down",
+        "pen_pos_up",
+        "pen_rate_lower",
+        "pen_rate_raise",
+        "random_start",
+        "reordering",
+        "speed_pendown",
+        "speed_penup",
+        ]
+
+# Fields in an estimate
+estimateFields = ["time", "pendown", "total", "lifts"]
+
+# The estimate from an AxiDraw object after a preview.
+# Times are in seconds, distances in metres.
+def estimateFromAD (ad):
+    return {"time": getattr(ad, "time_estimate", None),
+            "pendown": getattr(ad, "distance_pendown", None),
+            "total": getattr(ad, "distance_total", None),
+            "lifts": getattr(ad, "pen_lifts", None)}
+
+# Hash of a file's contents.  Raises OSError if it can't be read.
+def hashFile (path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def defaultCacheDir ():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "interaxi")
+
+class EstimateCache:
+    def __init__ (self, directory, version=""):
+        self.directory = os.path.join(directory, "estimates")
+        self.version = version      # pyaxidraw version -- estimates may change with it
+        self.hashes = {}            # (path, mtime, size) -> content hash
+        self.hits = 0
+        self.misses = 0
+
+    # Hash of the file's contents, or None if it can't be read
+    def fileHash (self, filename):
+        try:
+            path = os.path.abspath(filename)
+            st = os.stat(path)
+            stamp = (path, st.st_mtime_ns, st.st_size)
+            if stamp not in self.hashes:
+                self.hashes[stamp] = hashFile(path)
+            return self.hashes[stamp]
+        except OSError:
+            return None
+
+    # Note the hash of a file worked out elsewhere (see dirindex.py)
+    def remember (self, path, mtimeNs, size, contentHash):
+        self.hashes[(path, mtimeNs, size)] = contentHash
+
+    def key (self, filename, opts, layer):
+        contentHash = self.fileHash(filename)
+        if contentHash is None:
+            return None
+        settings = {o: opts.get(o) for o in estimateOpts}
+        settings["layer"] = layer
+        settings["version"] = self.version
+        text = contentHash + json.dumps(settings, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def entryPath (self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    # The stored estimate (a dict with estimateFields) or None
+    def get (self, filename, opts, layer=None):
+        key = self.key(filename, opts, layer)
+        if key is not None:
+            try:
+                with open(self.entryPath(key)) as f:
+                    estimate = json.load(f)
+                self.hits += 1
+                return estimate
+            except (OSError, ValueError):
+                pass
+        self.misses += 1
+        return None
+
+    def put (self, filename, opts, layer, estimate):
+        key = self.key(filename, opts, layer)
+        if key is None or estimate.get("time") is None:
+            return
+        path = self.entryPath(key)
+        entry = {f: estimate.get(f) for f in estimateFields}
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            counters.wroteFile(os.path.getsize(tmpPath))
+            os.replace(tmpPath, path)
+        except OSError as err:
+            print(f"Unable to save estimate in cache: {err}")
+
+    def clear (self):
+        count = 0
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for name in filenames:
+                if name.endswith(".json"):
+                    try:
+                        os.unlink(os.path.join(dirpath, name))
+                        count += 1
+                    except OSError:
+                        pass
+        return count
+
+    def report (self):
+        entries = 0
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            entries += sum(1 for name in filenames if name.endswith(".json"))
+        print(f"estimate cache: {entries} estimates in '{self.directory}'")
+        print(f"  hits: {self.hits}  misses: {self.misses}")
@@ -0,0 +1,248 @@
+# interaxi -- interactive AxiDraw frontend.
+# Quick plot time estimates from a plan, without a preview.
+
+# NOTES:
+# * A preview runs pyaxidraw's motion planner in Python, one move at a
+#   time.  This works on a plan (see plancache.py), where the drawing is
+#   already flattened into polylines, and times all the segments at once
+#   with NumPy: each segment gets a trapezoidal speed profile (speed up,
+#   cruise, slow down) between speeds at its ends that depend on how
+#   sharply the path turns there.  Pen-up moves start and end at rest.
+#   Each path costs a lower and a lift: the servo's travel at
+#   pen_rate_lower/raise, plus pen_delay_down/up.
+# * It's a model, not pyaxidraw's planner (which looks further ahead, works
+#   in motor steps, and so on), so the time is kept in three parts -- pen-down
+#   motion, pen-up motion and the pen going up and down -- and 'estimate
+#   calibrate' fits a factor for each against real previews.  The factors
+#   are saved, and used from then on.
+# * Speed, acceleration and servo timings are pyaxidraw's own params, read
+#   at startup or from the defaults snapshot (which keeps them -- see
+#   defaultscache.py).  The ones below are for a pyaxidraw without them.
+# * 'ls -l' uses the same model on the strokes the directory index keeps
+#   from each file's layer scan (see layerindex.py), for files that haven't
+#   had a plan made.  That skips pyaxidraw's processing (reordering, hidden
+#   lines), so it's rougher still.
+# * Needs NumPy (see optimise.available()).
+
+import hashlib
+import json
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+
+from .batch import fmtTime
+from . import optimise
+from .stats import counters
+
+# pyaxidraw's params (as of 3.9), for when its own aren't known
+defaultParams = {
+        "speed_lim_xy_hr": 8.6979,  # inches/s, reached at speed 110
+        "accel_rate": 40.0,         # inches/s^2, pen down, at accel 100
+        "accel_rate_pu": 60.0,      # inches/s^2, pen up
+        "servo_sweep_time": 200,    # ms for the servo's full range at rate 100
+        }
+metresPerInch = 0.0254
+
+# The parts of the time that are calibrated separately
+parts = ["pen down", "pen up", "lifts"]
+
+# interaxi's options that the model uses
+modelOpts = [
+        "accel",
+        "const_speed",
+        "pen_delay_down",
+        "pen_delay_up",
+        "pen_pos_down",
+        "pen_pos_up",
+        "pen_rate_lower",
+        "pen_rate_raise",
+        "speed_pendown",
+        "speed_penup",
+        ]
+
+# A key for the model's settings, to tell whether a time worked out earlier still holds
+def modelKey (opts, params):
+    settings = {o: opts.get(o) for o in modelOpts}
+    settings.update({p: param(params, p) for p in defaultParams})
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()[:24]
+
+def param (params, name):
+    value = params.get(name)
+    return float(defaultParams[name] if value is None else value)
+
+# The paths in a plan in plotting order, as arrays of points in inches
+def planPaths (plan):
+    root = ET.fromstring(plan)
+    scale = optimise.planScale(root, plan)
+    paths = []
+    for elem in root.iter():
+        points = optimise.elementPoints(elem)
+        if points is not None:
+            paths.append(points * scale)
+    return paths
+
+# Times to cover segments of the given lengths, starting at speed v0 and
+# ending at v1 (all arrays), with top speed vmax and acceleration accel.
+def segmentTimes (lengths, v0, v1, vmax, accel):
+    np = optimise.np
+    # There's only so much speeding up or slowing down a segment has room for
+    v1 = np.minimum(v1, np.sqrt(v0 ** 2 + 2 * accel * lengths))
+    v0 = np.minimum(v0, np.sqrt(v1 ** 2 + 2 * accel * lengths))
+    peak = np.minimum(vmax, np.sqrt((2 * accel * lengths + v0 ** 2 + v1 ** 2) / 2))
+    rampLength = (2 * peak ** 2 - v0 ** 2 - v1 ** 2) / (2 * accel)
+    return (2 * peak - v0 - v1) / accel + np.maximum(lengths - rampLength, 0) / vmax
+
+# Pen-down time and distance for all the paths
+def penDown (paths, speed, accel, constSpeed):
+    np = optimise.np
+    points = np.vstack(paths)
+    segs = np.diff(points, axis=0)
+    if len(segs) == 0:
+        return 0.0, 0.0
+    lengths = np.hypot(segs[:, 0], segs[:, 1])
+    # The segments that join one path to the next aren't drawn
+    inPath = np.ones(len(segs), dtype=bool)
+    inPath[np.cumsum([len(p) for p in paths])[:-1] - 1] = False
+    if constSpeed:
+        return float(lengths[inPath].sum() / speed), float(lengths[inPath].sum())
+    # Speed at each join between segments, from how far the path turns there:
+    # full speed straight on, stopped for a U-turn
+    dirs = segs / np.where(lengths > 0, lengths, 1)[:, None]
+    cosTurn = (dirs[:-1] * dirs[1:]).sum(axis=1)
+    joined = inPath[:-1] & inPath[1:]
+    joinSpeed = np.where(joined, speed * (1 + cosTurn) / 2, 0.0)
+    v0 = np.concatenate([[0.0], joinSpeed])
+    v1 = np.concatenate([joinSpeed, [0.0]])
+    times = segmentTimes(lengths, v0, v1, speed, accel)
+    return float(times[inPath].sum()), float(lengths[inPath].sum())
+
+# Pen-up time and distance: from the origin to the first path, between paths, and back
+def penUp (paths, speed, accel):
+    np = optimise.np
+    origin = np.zeros((1, 2))
+    starts = np.vstack([[p[0] for p in paths], origin])
+    ends = np.vstack([origin, [p[-1] for p in paths]])
+    legs = starts - ends
+    lengths = np.hypot(legs[:, 0], legs[:, 1])
+    zeros = np.zeros(len(lengths))
+    return float(segmentTimes(lengths, zeros, zeros, speed, accel).sum()), float(lengths.sum())
+
+# Estimate for a plan.  opts are interaxi's options, params pyaxidraw's, and
+# factors scale the parts of the time (see Calibration).  Times are in
+# seconds and distances in metres, as in a preview's estimate; 'penup' is
+# the pen-up distance and 'parts' the uncalibrated times of the parts.
+def estimatePlan (plan, opts, params={}, factors=(1.0, 1.0, 1.0)):
+    return estimatePaths(planPaths(plan), opts, params, factors)
+
+# Estimate for paths (arrays of points in inches, in plotting order), as for estimatePlan()
+def estimatePaths (paths, opts, params={}, factors=(1.0, 1.0, 1.0)):
+    paths = [p for p in paths if len(p) > 0]
+    if not paths:
+        return {"time": 0.0, "pendown": 0.0, "penup": 0.0, "total": 0.0, "lifts": 0, "parts": [0.0, 0.0, 0.0]}
+    topSpeed = param(params, "speed_lim_xy_hr") / 110
+    accel = opts["accel"] / 100
+    downTime, downDist = penDown(paths, topSpeed * opts["speed_pendown"],
+                                 param(params, "accel_rate") * accel, opts["const_speed"])
+    upTime, upDist = penUp(paths, topSpeed * opts["speed_penup"], param(params, "accel_rate_pu") * accel)
+    sweep = param(params, "servo_sweep_time") * abs(opts["pen_pos_up"] - opts["pen_pos_down"]) / 100
+    liftMs = (sweep * 100 / max(opts["pen_rate_raise"], 1) + opts["pen_delay_up"]
+              + sweep * 100 / max(opts["pen_rate_lower"], 1) + opts["pen_delay_down"])
+    liftTime = len(paths) * liftMs / 1000
+    times = [downTime, upTime, liftTime]
+    return {"time": sum(f * t for f, t in zip(factors, times)),
+            "pendown": downDist * metresPerInch,
+            "penup": upDist * metresPerInch,
+            "total": (downDist + upDist) * metresPerInch,
+            "lifts": len(paths),
+            "parts": times}
+
+# Factors for the parts of the time that make the model's times best match
+# the previews'.  samples is a list of (parts, preview time).  With fewer
+# files than parts, or if the parts can't be told apart, all the parts get
+# the same factor.
+def fitFactors (samples):
+    np = optimise.np
+    a = np.array([p for p, t in samples], dtype=float)
+    b = np.array([t for p, t in samples], dtype=float)
+    if len(samples) >= len(parts):
+        factors = np.linalg.lstsq(a, b, rcond=None)[0]
+        if (factors > 0).all():
+            return [float(f) for f in factors]
+    total = a.sum()
+    return [float(b.sum() / total) if total > 0 else 1.0] * len(parts)
+
+# Show how the model's times compare with the previews', before and after
+# calibrating.  samples are (file, parts, preview time).  Returns the mean
+# error after calibrating, as a percentage.
+def compare (samples, factors):
+    print(f"{'preview':>9}  {'model':>9}  {'error':>7}  {'calibrated':>10}  {'error':>7}  file")
+    errors = ([], [])
+    for name, times, previewTime in samples:
+        model = sum(times)
+        calibrated = sum(f * t for f, t in zip(factors, times))
+        errors[0].append(100 * (model - previewTime) / previewTime)
+        errors[1].append(100 * (calibrated - previewTime) / previewTime)
+        print(f"{fmtTime(previewTime):>9}  {fmtTime(model):>9}  {errors[0][-1]:+6.1f}%  "
+              f"{fmtTime(calibrated):>10}  {errors[1][-1]:+6.1f}%  {name}")
+    before, after = (sum(abs(e) for e in errs) / len(errs) for errs in errors)
+    print(f"mean error: {before:.1f}% from the model, {after:.1f}% calibrated")
+    return after
+
+# Calibration factors, kept in a small JSON file
+class Calibration:
+    def __init__ (self, filename):
+        self.filename = filename
+        self.factors = [1.0] * len(parts)
+        self.files = 0          # number of previews they were fitted to
+        self.error = None       # mean error against those previews, percent
+        self.version = ""       # pyaxidraw version of the previews
+        self.load()
+
+    def load (self):
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+            factors = [float(x) for x in data["factors"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        if len(factors) == len(parts):
+            self.factors = factors
+            self.files = data.get("files", 0)
+            self.error = data.get("error")
+            self.version = data.get("version", "")
+
+    # Returns "" if OK, else what went wrong
+    def save (self):
+        text = json.dumps({"factors": self.factors, "files": self.files,
+                           "error": self.error, "version": self.version}, indent=1)
+        directory = os.path.dirname(self.filename)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmpPath = tempfile.mkstemp(dir=directory, prefix=".calibration-")
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            os.replace(tmpPath, self.filename)
+        except OSError as err:
+            return f"unable to save the calibration: {err}"
+        counters.wroteFile(len(text))
+        return ""
+
+    def reset (self):
+        self.factors = [1.0] * len(parts)
+        self.files = 0
+        self.error = None
+        self.version = ""
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+    def report (self, version=""):
+        if not self.files:
+            print("estimates are not calibrated -- 'estimate calibrate <files>' to calibrate them against previews")
+            return
+        factors = ", ".join(f"{name} {f:.3f}" for name, f in zip(parts, self.factors))
+        print(f"calibrated against {self.files} previews (mean error {self.error:.1f}%): {factors}")
+        if version and self.version != version:
+            print(f"  the previews were by pyaxidraw {self.version or '(unknown)'}, now {version} -- "
+                  "it may be worth calibrating again")
@@ -0,0 +1,137 @@
+# interaxi -- interactive AxiDraw frontend.
+# Stand-in for pyaxidraw's AxiDraw class, for measuring interaxi on its own.
+
+# NOTES:
+# * install() puts this module in sys.modules as pyaxidraw.axidraw (and a
+#   minimal axicli.utils), so interaxi's lazy imports pick it up.  It must be
+#   called before anything imports the real ones.
+# * Nothing is drawn and no USB port is opened.  Each AxiDraw records the
+#   calls made on it in the module-level 'calls' list, and plot_run() takes
+#   its error code from 'codes' (e.g. [102, 0] for a pause and then a
+#   completed resume), defaulting to 0.
+# * plot_run(True) gives back the SVG it was given, which is enough for
+#   interaxi's resume loop, plans and output files.
+
+import runpy
+import sys
+import types
+
+__version__ = "fake"
+
+calls = []      # (method name, args) for every call on any AxiDraw
+codes = []      # error codes for the next plot_run() calls
+
+defaultOptions = {
+    "accel": 75, "auto_rotate": True, "const_speed": False, "copies": 1, "digest": 0,
+    "dist": 0.0, "hiding": False, "layer": 1, "manual_cmd": "fw_version", "mode": "plot",
+    "model": 1, "page_delay": 15, "pen_delay_down": 0, "pen_delay_up": 0, "pen_pos_down": 40,
+    "pen_pos_up": 60, "pen_rate_lower": 50, "pen_rate_raise": 75, "port": None, "preview": False,
+    "random_start": False, "rendering": 3, "reordering": 0, "report_time": False,
+    "speed_pendown": 25, "speed_penup": 75, "units": 0, "walk_dist": 0.0,
+    }
+defaultParams = {"min_gap": 0.008, "report_lifts": False}
+
+class Errors:
+    def __init__ (self):
+        self.code = 0
+
+class AxiDraw:
+    def __init__ (self):
+        self.options = types.SimpleNamespace(**defaultOptions)
+        self.params = types.SimpleNamespace(**defaultParams)
+        self.errors = Errors()
+        self.svg = None
+        self.bounds = [[0, 0], [11.81, 8.58]]
+        self.time_estimate = 0.0
+        self.distance_pendown = 0.0
+        self.distance_total = 0.0
+        self.pen_lifts = 0
+        self.pen_up = True
+
+    def record (self, name, *args):
+        calls.append((name, args))
+
+    # Plot API
+    def plot_setup (self, svg_input=None):
+        self.record("plot_setup", svg_input)
+        self.options = types.SimpleNamespace(**defaultOptions)
+        self.params = types.SimpleNamespace(**defaultParams)
+        self.svg = svg_input
+
+    def plot_run (self, output=False):
+        self.record("plot_run", self.options.mode)
+        self.errors.code = codes.pop(0) if codes else 0
+        if self.options.preview:
+            self.time_estimate = 1.0
+            self.distance_pendown = 0.1
+            self.distance_total = 0.2
+            self.pen_lifts = 1
+        if not output:
+            return None
+        svg = self.svg or ""
+        if not svg.lstrip().startswith("<"):
+            try:
+                with open(svg) as f:
+                    svg = f.read()
+            except OSError:
+                self.errors.code = 1
+                return ""
+        return svg
+
+    # Interactive API
+    def interactive (self):
+        self.record("interactive")
+
+    def connect (self):
+        self.record("connect")
+        return True
+
+    def disconnect (self):
+        self.record("disconnect")
+
+    def update (self):
+        self.record("update")
+
+    def go (self, x, y):
+        self.record("go", x, y)
+
+    def goto (self, x, y):
+        self.record("goto", x, y)
+
+    def penup (self):
+        self.record("penup")
+        self.pen_up = True
+
+    def pendown (self):
+        self.record("pendown")
+        self.pen_up = False
+
+    def current_pen (self):
+        return self.pen_up  # like pyaxidraw: True when the pen is up
+
+    def usb_command (self, command):
+        self.record("usb_command", command)
+
+    def usb_query (self, query):
+        self.record("usb_query", query)
+        return "1\r\n" if query.startswith("QB") else "OK\r\n"
+
+# axicli.utils.load_config(), which runs a Python config file
+def load_config (filename):
+    try:
+        config = runpy.run_path(filename)
+    except (OSError, SyntaxError) as err:
+        print(f"Unable to load config file '{filename}': {err}")
+        sys.exit(1)
+    return {key: val for key, val in config.items() if not key.startswith("__")}
+
+def install ():
+    this = sys.modules[__name__]
+    pyaxidraw = types.ModuleType("pyaxidraw")
+    pyaxidraw.axidraw = this
+    axicli = types.ModuleType("axicli")
+    utils = types.ModuleType("axicli.utils")
+    utils.load_config = load_config
+    axicli.utils = utils
+    sys.modules.update({"pyaxidraw": pyaxidraw, "pyaxidraw.axidraw": this,
+                        "axicli": axicli, "axicli.utils": utils})
@@ -8,6 +8,12 @@
 #   this code only reads both from config files -- dist overrides walk_dist
 
 # NOTES:
+# * The REPL runs on asyncio (see repl()).  Commands that use the plotter
+#   run one at a time on a worker thread (see PlotterWorker), so the console
+#   stays free for status, stats, queue and option commands while they run.
+#   Scripts (--batch) run commands one after another, as before.
+# * Several plotters can share the queue (see devices.py and deviceCmd()):
+#   each copy runs in a child interaxi on the device's own port.
 # * options get reset by plot_setup: the docs says they can be set 
 #   between plot_setup and plot run.  So we need to keep an options 
 #   object, and apply them all before each plot_run (or after plot_setup).
@@ -19,6 +25,9 @@
 #   for display and input if required.
 # * paper/margin settings -- started coding, but couldn't find a way to 
 #   tell AxiDraw to limit the plot range, so commented it all out.
+# * pyaxidraw, axicli, curtsies (and NumPy, in optimise.py) are slow to
+#   import on a Pi, so they're imported where they're used, the first time
+#   they're needed, rather than here.  See --profile-startup.
 
 # FIXME
 # * needs tidying
@@ -38,33 +47,58 @@
 # * set margin/paper/plot-size -- can override limits derived from model (but without going beyond the model capabilities)
 #   adjusting for margin and previously set registration -- so the calcs done at plot time.  
 #   Tell user not to worry about AD's warning re part of image being off the edge
-# MAYBE
-# * delay between copies instead of waiting for user input
 
+import argparse
+import asyncio
 import atexit
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
 from datetime import datetime
 import os
+import functools
+import gc
 import pathlib
+import queue
 import signal
 import sys
 import tempfile
+import threading
+import time
+import traceback
 # Use readline if available:
 try:
     import readline
 except ImportError:
     readline = None
-from curtsies  import Input
-from pyaxidraw import axidraw
-from axicli    import utils as acutils
+startupStart = time.perf_counter()  # for --profile-startup
+from .         import batch
+from .commands import CommandTable
+from .defaultscache import DefaultsCache
+from .devices  import Device, Scheduler
+from .dirindex import DirIndex, listDir
+from .         import estimate
+from .jobqueue import Job, JobQueue
+from .layerindex import LayerIndexCache, boxFits
+from .estcache import EstimateCache, defaultCacheDir, estimateFromAD
+from .plancache import PlanCache
+from .profiles import ProfileStore
+from .prepare  import Preparer, preparePlans
+from .         import optimise
+from .         import svginfo
+from .serialstats import SerialMeter
+from .session  import Session
+from .stats    import Dumper, counters
 
 # 'Constants'
 version = "0.2.3"   # interaxi version
 configDir = "~/.config/interaxi/"
 configFile = "axidraw_conf.py"
 defaultConfigFile = os.path.expanduser(os.path.join(configDir, configFile))
+profileDir = os.path.expanduser(os.path.join(configDir, "profiles"))
 histFile = "history.txt"
 defaultHistFile = os.path.expanduser(os.path.join(configDir, histFile))
 histFileSize = 1000
+calibrationFile = os.path.expanduser(os.path.join(configDir, "calibration.json"))
 origDir = os.getcwd()
 # max values depend on model -- these numbers from standard axidraw_conf.py:
 # model 1:
@@ -99,33 +133,57 @@ regDistances = {"mm": {"f": 0.1  , "m": 1   , "c": 10  },
                 "in": {"f": 0.005, "m": 0.05, "c":  0.5}}
 noOutputFile = 'none'
 autoOutputFile = 'auto'
+firstPort = 'none'  # port name meaning the first plotter found
 userOpts = [     # Options the the user sees
         "accel",
         "auto_rotate",
         "const_speed",
         "copies",
+        "copies_auto",
         "digest",
         "hiding",
         "layer",
         "min_gap",
         "model",
+        "optimise",
+        "page_delay",
         "pen_delay_down",
         "pen_delay_up",
         "pen_pos_down",
         "pen_pos_up",
         "pen_rate_lower",
         "pen_rate_raise",
+        "plan_cache_mb",
+        "port",
+        "queue_auto",
         "random_start",
         "rendering",
         "reordering",
+        "serial_stats",
+        "session",
         "speed_pendown",
         "speed_penup",
+        "stats_file",
+        "stats_interval",
+        "stream_mb",
         "units",
         ]
 addlOpts = [    # options that go in ad.params rather than ad.options
         "min_gap",
         #"report_lifts",
         ]
+localOpts = [   # interaxi-only options that aren't passed on to the AxiDraw
+        "copies_auto",
+        "optimise",
+        "plan_cache_mb",
+        "queue_auto",
+        "serial_stats",
+        "session",
+        "stats_file",
+        "stats_interval",
+        "stream_mb",
+        "units",
+        ]
 distOpts = [    # options that use a distance in mm or inches
         #"margin",
         "min_gap",
@@ -136,6 +194,13 @@ alignX = None       # Head position if aligned in inches.
 alignY = None
 outputFilename = noOutputFile
 plotRunning = False # True while plotting a file -- used for sigint trap
+copiesRunning = False   # True while plotting copies, and copiesStopping once Ctrl-C has been pressed
+copiesStopping = False
+scriptPolicy = None # Answers to prompts when running a script (see runScript()), else None
+worstRC = 0         # Worst error code seen, for the exit status of a script
+session = None      # Persistent plotter session, if the session option is on
+lastEstimate = None # Estimate from the last preview run (see estcache.py)
+motionParams = {}   # pyaxidraw's params, for the estimate model (see estimate.py)
 
 def maxX ():  # inches
     try:
@@ -151,6 +216,18 @@ def maxY ():  # inches
         model = 1
     return yTravel[model]
 
+# Format a dictionary of options for printing
+def fmtOptions (opts):
+    # sort the keys for easier reading
+    r = "{"
+    for key in sorted(opts):
+        val = opts[key]
+        if key in distOpts:
+            # distances -- need to adjust for current units
+            val = fmtDist(val) + ' ' + options.units
+        r += f"'{key}': {val}, "
+    return r + "}"
+
 # Local store for options - just the ones that the user can set
 class Options:
     def __init__ (self):
@@ -164,13 +241,16 @@ class Options:
             "auto_rotate": True,
             "const_speed": False,
             "copies": 1,
+            "copies_auto": False, # interaxi only
             "digest": 0,
             "hiding": False,
             "layer": 1,
             #"margin": 0,      # distance; interaxi only
             "min_gap": 0.006,   # distance; additional
             "model": 1,
+            "optimise": 0,      # seconds; interaxi only
             #"paper": 'A4L',     # interaxi only
+            "page_delay": 15,   # seconds
             "pen_delay_down": 0,
             "pen_delay_up": 0,
             "pen_pos_down": 30,
@@ -178,29 +258,31 @@ class Options:
             "pen_rate_lower": 50,
             "pen_rate_raise": 75,
             #"penlift": 1,
+            "plan_cache_mb": 64,  # interaxi only
+            "port": None,       # USB port or nickname; None for first found
+            "queue_auto": False, # interaxi only
             "random_start": False,
             "rendering": 1,
             "reordering": 0,
             #"report_time": True,
             #"report_lifts": True,   # additional
+            "serial_stats": False, # interaxi only
+            "session": False,   # interaxi only
             "speed_pendown": 25,
             "speed_penup": 75,
+            "stats_file": None, # interaxi only
+            "stats_interval": 60, # seconds; interaxi only
+            "stream_mb": 300,   # interaxi only
             "units": 'in',      # interaxi only
         }
         pass
     def __repr__ (self):
-        # sort the keys for easier reading
         #return "repr:" + repr(vars(self))
-        r = "{"
-        keys = list(self.__dict__)
-        keys.sort()
-        for key in keys:
-            val = self.__dict__[key]
-            if key in distOpts: 
-                # distances -- need to adjust for current units
-                val = fmtDist(val) + ' ' + options.units
-            r += f"'{key}': {val}, "
-        return r + "}"
+        return fmtOptions(self.__dict__)
+    def delta (self, sourceDict):
+        # the user options in a dictionary that differ from the current ones
+        return {key: val for key, val in sourceDict.items()
+                    if key in userOpts and self.__dict__.get(key) != val}
     def setFromOptions (self, sourceDict):
         # set options from a dictionary
         for key, val in sourceDict.items():
@@ -213,168 +295,24 @@ class Options:
             self.__dict__[key] = paramsDict[key]
             #print(f"setFromParams {key}={paramsDict[key]}")
 options = Options()
+profiles = ProfileStore(profileDir, defaultCacheDir(), userOpts)
+currentProfile = None   # name of the last profile loaded
+jobQueue = JobQueue()
+preparer = Preparer()
+planCache = PlanCache(options.plan_cache_mb * 1000000)
+estimateCache = EstimateCache(defaultCacheDir())  # version is set by initOptions()
+calibration = estimate.Calibration(calibrationFile)
+layerIndex = LayerIndexCache()
+dirIndex = DirIndex(defaultCacheDir())     # what ls shows about each file (see dirindex.py)
+serialMeter = SerialMeter()     # counts serial traffic if serial_stats is on (see serialstats.py)
+scheduler = Scheduler(jobQueue, lambda device, job: deviceJob(device, job),
+                      lambda device: releaseDevice(device))   # plotters sharing the queue (see devices.py)
+backgroundTasks = set()         # asyncio tasks running in the REPL (see repl())
+deviceSkipOpts = ["port", "session", "stats_file", "stats_interval"]  # options that devices don't get from us
+statsDumper = Dumper(counters)  # writes the stats (see stats.py) to options.stats_file
 
 ##############################################################
 
-def printHelp ():
-    print("""Available commands: 
-accel, \
-align, \
-auto_rotate <y/n>, \
-cd <directory>, \
-config, \
-const_speed <y/n>, \
-copies <0-9999>, \
-cycle, \
-delaydown|pen_delay_down <ms>, \
-delaypage|page_delay <s>, \
-delayup|pen_delay_up <ms>, \
-digest <0|1|2>, \
-down|lower_pen, \
-fw_version, \
-help, \
-hiding <y/n>, \
-home|walk_home, \
-ls, \
-min_gap [<dist>], \
-model [<num>], \
-off|disable_xy, \
-on|enable_xy, \
-options|config [<filename>], \
-output [<filename>], \
-plot <filename> [<layer>], \
-posdown|pen_pos_down <0-100>, \
-position, \
-posup|pen_pos_up <0-100>, \
-preview <filename> [<layer>], \
-quit, \
-random_start <y/n>, \
-ratedown|pen_rate_lower <1-100>, \
-rateup|pen_rate_raise <1-100>, \
-register, \
-rendering <0-3>, \
-reordering <0-4>, \
-report_time <y/n>, \
-report_lifts <y/n>, \
-save [<filename>], \
-speeddown|speed_pendown|sd <1-100>, \
-speedup|speed_penup|su <1-100>, \
-sysinfo, \
-toggle, \
-units <mm>|<inches>, \
-up|raise_pen, \
-version, \
-walkx|x <distance>, \
-walky|y <distance> \
-""")
-#margin [<dist>], \
-#paper [<papersize>], \
-#report_time <y/n>, \
-#report_lifts <y/n>, \
-    print("Commands can be abbreviated as long as what you type is unambiguous.")
-
-# List of commands with the associated short internal command name
-cmdList = [
-    ("accel", "ac"),
-    ("align", "al"),
-    ("auto_rotate", "au"),
-    ("cd", "cd"),
-    ("config", "op"),
-    ("const_speed", "cs"),
-    ("copies", "cp"),
-    ("cycle", "cy"),
-    ("delaydown", "dd"),
-    ("delaypage", "dp"),
-    ("delayup", "du"),
-    ("digest", "dg"),
-    ("disable_xy", "of"),
-    ("down", "do"),
-    ("enable_xy", "on"),
-    ("fw_version", "fw"),
-    ("help", "he"),
-    ("hiding", "hi"),
-    ("home", "wh"),
-    ("lower_pen", "do"),
-    ("ls", "ls"),
-    #("margin", "ma"),
-    ("min_gap", "mg"),
-    ("model", "mo"),
-    ("off", "of"),
-    ("on", "on"),
-    ("options", "op"),
-    ("output", "ou"),
-    #("paper", "pa"),
-    ("page_delay", "dp"),
-    ("pen_delay_down", "dd"),
-    ("pen_delay_up", "du"),
-    ("pen_pos_down", "pd"),
-    ("pen_pos_up", "pu"),
-    ("pen_rate_lower", "pl"),
-    ("pen_rate_raise", "pr"),
-    ("plot", "pt"),
-    ("posdown", "pd"),
-    ("position", "po"),
-    ("posup", "pu"),
-    ("preview", "pv"),
-    ("quit", "qu"),
-    ("raise_pen", "up"),
-    ("random_start", "rd"),
-    ("ratedown", "pl"),
-    ("rateup", "pr"),
-    ("register", "rg"),
-    ("rendering", "rn"),
-    ("reordering", "ro"),
-    #("report_time", "rp"),
-    #("report_lifts", "rl"),
-    ("save", "sc"),
-    ("sethome", "sh"),
-    ("speed_pendown", "sd"),
-    ("speed_penup", "su"),
-    ("speeddown", "sd"),
-    ("speedup", "su"),
-    ("sd", "sd"),
-    ("su", "su"),
-    ("sysinfo", "sy"),
-    ("toggle", "tg"),
-    ("units", "un"),
-    ("up", "up"),
-    ("version", "vr"),
-    ("walk_home", "wh"),
-    ("walkx", "wx"),
-    ("walky", "wy"),
-    ("x", "wx"),
-    ("y", "wy"),
-    ("walk", "wh"),
-]
-
-# Match the abbreviated command against the list,
-# returning short-command or "" or None
-def miniMatch (cmd):
-    if cmd == "":
-        print("Type a command, or try 'help'")
-        return ""
-    #global cmdList
-    matched = []
-    short = None
-    for pair in cmdList:
-        # Full match succeeds immediately
-        # (otherwise would fail if both 'foo' and 'foo_bar' are valid)
-        if cmd == pair[0]:
-            return pair[1]
-        # Else try to match as abbreviation
-        if pair[0].startswith(cmd):
-            matched.append(pair[0])
-            short = pair[1]
-    n = len(matched)
-    #print(f"{matched=}")
-    if n == 0:
-        print(f"Command '{cmd}' is not known.  Try typing 'help'.")
-        return None
-    if n == 1:
-        return short
-    print(f"Command '{cmd}' is ambiguous -- it could match any of {matched}")
-    return None
-
 # Print the current config
 def printConfig():
     #for opt in options:
@@ -383,27 +321,82 @@ def printConfig():
 # Code for loading configuration file provided by Windell Oskay, 22 April 2023.
 # Adapted to work here.
 # Overwrites existing options if new values are in the file.
+# Returns the options that changed.
 def loadConfig (args, showOutput=True):
-    global options
     #print(f"loadConfig: {args=} {showOutput=}")
     if len(args) == 0:
         # just print the current config
         print("options:", options)
-        return
-    optionsChanged = False
+        return {}
     # Gather the rest of the args into a single string
     filename = argsToFileName(args)
-    if filename:
+    if not filename:
+        return {}
+    delta = applyConfig(filename)
+    if delta is None:
+        return {}
+    print(f"config file '{filename}' loaded")
+    if showOutput:
+        print(f"changed options: {fmtOptions(delta)}" if delta else "no options changed")
+    return delta
+
+# Load a config file (parsed once, then kept -- see profiles.py) and set
+# the options that differ from the current ones.
+# Returns the changed options, or None if the file couldn't be loaded.
+def applyConfig (filename):
+    newOpts = profiles.load(filename)
+    if newOpts is None:
+        return None
+    delta = options.delta(newOpts)
+    options.setFromOptions(delta)
+    return delta
+
+# Bring the session and plan cache into line with changed options.  The
+# plotter may be busy, so anything that touches the session waits for it.
+def optionsChanged (delta):
+    if "port" in delta:
+        reopenSession()
+    startSession()
+    planCache.setLimit(options.plan_cache_mb * 1000000)
+    def sync ():
+        if session and session.ad:
+            session.sync(options.__dict__)
+    plotterWorker.whenFree("(send the changed options)", sync)
+    if "stats_file" in delta or "stats_interval" in delta:
+        startStatsDump()
+    if "serial_stats" in delta:
+        startSerialStats()
+
+# Switch to a profile, save the current options as one, or list them
+def profileCmd (args):
+    global currentProfile
+    if len(args) == 0:
+        print(f"profile {currentProfile or '(none)'}")
+        profiles.report()
+        return
+    if args[0].lower() == "save":
+        if len(args) == 1:
+            print("profile save: need a profile name")
+            return
+        name = argsToFileName(args[1:])
         try:
-            config_dict = acutils.load_config(filename)
-            options.setFromOptions(config_dict)
-            optionsChanged = True
-            print(f"config file '{filename}' loaded")
-        except SystemExit as err:
-            #print("SE error:", err, "done")
-            pass
-    if optionsChanged and showOutput:
-        print(f"new options: {options}")
+            os.makedirs(profileDir, exist_ok=True)
+        except OSError as err:
+            print("Unable to save profile:", err)
+            return
+        saveConfig([profiles.path(name)])
+        currentProfile = name
+        return
+    name = argsToFileName(args)
+    if not os.path.isfile(profiles.path(name)):
+        print(f"profile: no profile '{name}' -- profiles are: {', '.join(profiles.names()) or 'none'}")
+        return
+    delta = applyConfig(profiles.path(name))
+    if delta is None:
+        return
+    optionsChanged(delta)
+    currentProfile = name
+    print(f"profile '{name}': " + (f"changed {fmtOptions(delta)}" if delta else "no options changed"))
 
 def setOutputFilename (args):
     global outputFilename
@@ -433,22 +426,73 @@ def saveConfig (args):
     try:
         with open(filename, 'w') as f:
             print(f"Saving configuration to {filename!r}")
-            keys = list(options.__dict__)
-            keys.sort()
-            for key in keys:
-                #print(f"{key} = {options.__dict__[key]!r}")
-                f.write(f"{key} = {options.__dict__[key]!r}\n")
+            f.write(configText(options.__dict__))
     except PermissionError as err:
         print("Unable to save configuration:", err)
 
+# The text of a config file setting the given options
+def configText (opts):
+    return "".join(f"{key} = {opts[key]!r}\n" for key in sorted(opts))
+
 def handleSigint (*args):
     if plotRunning:
         # Just stop the plot
         print("\nPlot running -- to pause or cancel it, press the button on the plotter")
+    elif copiesRunning:
+        # Between copies: stop after this one
+        global copiesStopping
+        copiesStopping = True
+        print("\nCopies will stop")
+    elif jobQueue.running:
+        # Between jobs (or with devices, any time): stop the queue
+        jobQueue.paused = True
+        print("\nQueue will pause" + (" once the devices' current copies are done" if scheduler.busy() else ""))
+    elif plotterWorker.busy():
+        print(f"\nPlotter busy with '{plotterWorker.jobs[0]}' -- type 'status' to see what it's doing")
     else:
         # Quit from the REPL
         print("\ndone (Ctrl-C pressed)")
-        quit()
+        sys.exit(130 if scriptPolicy else 0)
+
+# Remember the worst error code seen
+def noteRC (rc):
+    global worstRC
+    worstRC = max(worstRC, rc)
+
+# Ask the user a question, or when running a script, give the policy's answer
+def ask (prompt, scripted):
+    if scriptPolicy is None:
+        return timedInput(prompt)
+    print(f"{prompt}{scripted}")
+    return scripted
+
+# input(), timed as waiting for the user.  poll is as for consoleInput().
+def timedInput (prompt, poll=None):
+    with counters.timer("phase", "prompt"):
+        return consoleInput(prompt, poll)
+
+# Read an answer from the console.  Commands running in the background
+# (see PlotterWorker) get the next line typed at the REPL instead, or ""
+# if poll (e.g. buttonPoll()) says so first.
+def consoleInput (prompt, poll=None):
+    if plotterWorker.onWorker():
+        return plotterWorker.ask(prompt, poll)
+    return input(prompt)
+
+# For questions asked in the background: a function that says whether the
+# plotter's button has been pressed, or None.  Only with a session, so that
+# polling doesn't open and close the port every time.
+def buttonPoll ():
+    if session is None or not plotterWorker.onWorker():
+        return None
+    session.buttonPressed(options.__dict__)     # forget any earlier press
+    return lambda: session is not None and bool(session.buttonPressed(options.__dict__))
+
+# Wait until the button on the plotter is pressed.
+# Returns False if the plotter couldn't be reached.
+def waitForButton ():
+    with heldSession() as s:
+        return s is not None and s.waitForButton(options.__dict__)
 
 def applyOptionsToAD (ad, opts = {}):
     #print(f"aOTAD: {opts=} {type(opts)}")
@@ -457,6 +501,8 @@ def applyOptionsToAD (ad, opts = {}):
     else:
         o = opts.__dict__.items()
     for key, value in o:    # pts.__dict__.items():
+        if key in localOpts:
+            continue
         if key in addlOpts:
             # 'additional' option -- see https://axidraw.com/doc/py_api/#additional-parameters
             ad.params.__dict__[key] = value
@@ -465,11 +511,21 @@ def applyOptionsToAD (ad, opts = {}):
             ad.options.__dict__[key] = value
 
 # Apply local options, and then call plot_run()
-# Returns 0 if OK, else an error code
-def plotRun (inputFn = None, outputFn = None, cmdOpts = {}):
-
+# inputFn may be a file name or the SVG itself as a string.
+# Returns the error code (0 if OK) and the output SVG (if wantOutput, else None)
+def runAD (inputFn = None, cmdOpts = {}, wantOutput = False):
+
+    usesPort = not cmdOpts.get("preview") and cmdOpts.get("digest", 0) < 2
+    if session is None and usesPort and portIsDevice():
+        # pyaxidraw only finds USB ports, so open a device path
+        # (such as the virtual plotter) for it
+        with heldSession() as s:
+            if s is not None:
+                return runAD(inputFn, cmdOpts, wantOutput)
+    from pyaxidraw import axidraw
     ad = axidraw.AxiDraw()
-    ad.plot_setup(inputFn)     # inputFn may be None
+    with counters.timer("phase", "setup"):
+        ad.plot_setup(inputFn)     # inputFn may be None
     # Apply all the user options
     #for key, value in options.__dict__.items():
     #    if key in addlOpts:
@@ -478,40 +534,112 @@ def plotRun (inputFn = None, outputFn = None, cmdOpts = {}):
     #    elif key in mainOpts:
     #        # 'normal' option
     #        ad.options.__dict__[key] = value
-    applyOptionsToAD(ad, options)
-    # And then apply the command options
-    applyOptionsToAD(ad, cmdOpts)
-    #print(f"plotRun: {inputFn=}  {outputFn=}  {ad.options=}")
+    with counters.timer("phase", "options"):
+        applyOptionsToAD(ad, options)
+        # And then apply the command options
+        applyOptionsToAD(ad, cmdOpts)
+    if session and usesPort:
+        # Share the session's open port, and rebuild its interactive
+        # connection afterwards because this run may move the head.
+        ad.options.port = session.portOption(options.port)
+        session.invalidate()
+    #print(f"plotRun: {inputFn=}  {ad.options=}")
 
     ## Apply paper/margin limits
     #xLimit = paperSizes[options.paper]["w"] - options.margin
     #yLimit = paperSizes[options.paper]["h"] - options.margin
     #print(f"plotRun: {ad.bounds=}")
 
-    if not outputFn:
+    if not wantOutput:
         # not plotting a file
         #try:
-        ad.plot_run()
-        return ad.errors.code
+        with counters.timer("phase", "run"):
+            ad.plot_run()
+        noteRC(ad.errors.code)
+        return ad.errors.code, None
         # what exceptions can occur here?
         #except lxml.etree.XMLSyntaxError as err:
         #    print(f"Nasty SVG 3: {err}")
         #    return 3
+    before = serialMeter.snapshot()
+    with counters.timer("phase", "run"):
+        output = ad.plot_run(True)
+    if serialMeter.installed() and cmdOpts.get("report_time"):
+        # Below pyaxidraw's "Elapsed time" report
+        traffic = serialMeter.since(before)
+        if traffic.trips():
+            print(f"Serial traffic: {traffic}")
+    if ad.errors.code != 102:  # a pause isn't an error
+        noteRC(ad.errors.code)
+    if cmdOpts.get("preview"):
+        global lastEstimate
+        lastEstimate = estimateFromAD(ad)
+    return ad.errors.code, output
 
-    # Plotting or previewing an SVG file:
-    try:
-        with open(outputFn, "w") as outputFile:
-            outputFile.write(ad.plot_run(True))
-        return ad.errors.code
-    except PermissionError as err:
-        print(f"plotRun: unable to create output file {ofn}: {err}")
-        return 1
-    #except lxml.etree.XMLSyntaxError as err:
-    #    print(f"Nasty SVG 2: {err}")
-    #    return 2
-    # maybe: except RuntimeError as err:
-
-    return 0
+# Returns 0 if OK, else an error code
+@counters.timed("operation")
+def plotRun (inputFn = None, cmdOpts = {}):
+    rc, _ = runAD(inputFn, cmdOpts)
+    return rc
+
+# Get the processed plan for a file (see plancache.py), from the cache if possible.
+# Returns the plan (a plob, as a string), or None if it couldn't be made.
+def getPlan (filename, layer):
+    key = planCache.key(filename, options.__dict__, layer)
+    plan = planCache.get(key)
+    if plan is not None:
+        return plan
+    start = time.perf_counter()
+    cmdOpts = {"mode": "plot" if layer is None else "layers",
+               "layer": layer,
+               "digest": 2,         # plob only -- no plotting
+               "preview": False,
+               "report_time": False,
+               "report_lifts": False}
+    rc, plan = runAD(filename, cmdOpts, True)
+    if rc != 0 or not plan:
+        print(f"Unable to prepare plan for '{filename}' (rc={rc})")
+        return None
+    if options.optimise > 0:
+        if optimise.available():
+            plan, before, after = optimise.optimisePlan(plan, options.optimise)
+            printOptimised(before, after)
+        else:
+            print("optimise: NumPy is needed to optimise the path order -- skipped")
+    planCache.put(key, plan)
+    print(f"Plan prepared in {time.perf_counter() - start:.1f} seconds")
+    return plan
+
+def printOptimised (before, after):
+    saved = 100 * (before - after) / before if before else 0
+    print(f"Pen-up travel {fmtDist(before)} {options.units} before optimising, "
+          f"{fmtDist(after)} {options.units} after ({saved:.0f}% less)")
+
+def setOptimise (args):
+    setRangeInt("optimise", 0, 3600, args)
+    if options.optimise > 0 and not optimise.available():
+        print("optimise: NumPy is needed to optimise the path order -- please install it")
+
+# Plans are only used if the output file (if any) would be a plob anyway,
+# because plotting a plan gives a plob as output, not the original SVG.
+def usePlans ():
+    return planCache.maxBytes > 0 and (outputFilename == noOutputFile or options.digest > 0)
+
+# The options to key an estimate on (see estcache.py).  Only runs from a
+# plan are optimised, so other previews are of the file as it is, whatever
+# optimise says.
+def estimateKeyOpts (fromPlan):
+    return options.__dict__ if fromPlan else dict(options.__dict__, optimise=0)
+
+def setPlanCache (args):
+    if len(args) > 0:
+        if "clear".startswith(args[0].lower()):
+            planCache.clear()
+            print("plan cache cleared")
+        else:
+            setRangeInt("plan_cache_mb", 0, 100000, args)
+            planCache.setLimit(options.plan_cache_mb * 1000000)
+    planCache.report()
 
 def parse (line):
     tokens = line.split()
@@ -651,8 +779,127 @@ def setMinGap (args):
 #    else:
 #        print(f"Paper size must be one of {list(paperSizes.keys())}, not '{p}'")
 
+# Runs the moves for registerXY() on a worker thread, so that keys can be
+# read while the head is moving.  Moves that are waiting when the worker
+# gets to them are merged into one, so a burst of key repeats becomes a
+# single move instead of a backlog that carries on after the key is released.
+class Jogger:
+    def __init__ (self):
+        self.actions = queue.Queue()
+        self.latencies = [] # seconds from keypress to the start of the move
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+    def move (self, dx, dy, stamp):
+        self.actions.put(("move", dx, dy, stamp))
+    def call (self, fn):
+        self.actions.put(("call", fn))
+    # Wait for everything queued so far to be done, and stop the worker
+    def finish (self):
+        self.actions.put(("stop",))
+        self.thread.join()
+    def worker (self):
+        carried = None
+        while True:
+            item = carried if carried else self.actions.get()
+            carried = None
+            if item[0] == "stop":
+                return
+            if item[0] == "call":
+                item[1]()
+                continue
+            _, dx, dy, stamp = item
+            while True:
+                try:
+                    nextItem = self.actions.get_nowait()
+                except queue.Empty:
+                    break
+                if nextItem[0] != "move":
+                    carried = nextItem
+                    break
+                dx += nextItem[1]
+                dy += nextItem[2]
+            self.latencies.append(time.perf_counter() - stamp)
+            if dx:
+                walkDist('x', dx)
+            if dy:
+                walkDist('y', dy)
+    def report (self):
+        if self.latencies:
+            avg = 1000 * sum(self.latencies) / len(self.latencies)
+            worst = 1000 * max(self.latencies)
+            print(f"{len(self.latencies)} moves; keypress to motion {avg:.0f} ms average, {worst:.0f} ms worst")
+
+# Runs commands that use the plotter on a worker thread, one at a time in
+# the order they were typed, so the console stays free while they run.
+# Questions they ask (see consoleInput()) are answered by the next line
+# typed at the console, or by the plotter's button where that makes sense.
+class PlotterWorker:
+    def __init__ (self):
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plotter")
+        self.jobs = []          # command lines waiting or running, oldest first
+        self.started = None     # when the running one started
+        self.thread = None      # the worker thread, once it has started
+        self.question = None    # prompt of a question waiting for an answer
+        self.answers = queue.Queue()
+    def busy (self):
+        return bool(self.jobs)
+    def onWorker (self):
+        return self.thread is not None and threading.current_thread() is self.thread
+    # Queue fn() to run on the worker.  Returns an asyncio future.
+    def submit (self, line, fn):
+        self.jobs.append(line)
+        return asyncio.get_running_loop().run_in_executor(self.pool, self.run, fn)
+    # Returns the time it took
+    def run (self, fn):
+        self.thread = threading.current_thread()
+        self.started = time.monotonic()
+        try:
+            fn()
+        finally:
+            self.jobs.pop(0)
+        return time.monotonic() - self.started
+    # Ask a question from the worker, waiting for answer() (or for poll() to return True, meaning "")
+    def ask (self, prompt, poll=None):
+        self.question = prompt
+        print(prompt if prompt.startswith("\n") else f"\n{prompt}", end="", flush=True)
+        try:
+            while True:
+                try:
+                    return self.answers.get(timeout=0.2)
+                except queue.Empty:
+                    if poll and poll():
+                        print()
+                        return ""
+        finally:
+            self.question = None
+    def answer (self, line):
+        self.answers.put(line)
+    # Run fn() now if nothing is running on the worker (or this is the
+    # worker), else queue it to run after the commands already waiting.
+    # For changes to what the worker uses, e.g. the session.
+    def whenFree (self, line, fn):
+        if not self.busy() or self.onWorker():
+            fn()
+            return
+        self.jobs.append(line)
+        self.pool.submit(self.run, fn)
+    def report (self):
+        if not self.jobs:
+            print("plotter: idle")
+            return
+        print(f"plotter: running '{self.jobs[0]}' for {batch.fmtTime(time.monotonic() - self.started)}")
+        for line in self.jobs[1:]:
+            print(f"  then '{line}'")
+        if self.question:
+            print(f"  waiting for an answer to: {self.question.strip()}")
+
+plotterWorker = PlotterWorker()
 # Allow fine tuning of position using arrow keys.
 def registerXY():
+    if scriptPolicy:
+        print("register: needs the keyboard, so can't be used in a script")
+        noteRC(1)
+        return
     nl = ""
     def showMove (m):
         nonlocal nl
@@ -662,51 +909,108 @@ def registerXY():
         nonlocal nl
         print(f"{nl}{msg}")
         nl = ""
+    # Unit vectors for the arrow keys, and what to show for them
+    arrows = {'<UP>': (0, -1, "\u2191"), '<DOWN>': (0, 1, "\u2193"),
+              '<LEFT>': (-1, 0, "\u2190"), '<RIGHT>': (1, 0, "\u2192")}
     # Start with medium jumps
     regDist = regDistances[options.units]["m"]
+    step, _ = getDist([regDist])    # in inches
     print("registering: press arrow keys to move.")
     print("press f for fine, m for medium, c for coarse; u/d for pen up/down; q or ESC to stop.")
     print(f"medium {regDist}{options.units} steps")
-    with Input(keynames='curtsies') as input_generator:
-        for e in Input():   # e is a keypress or other event
-            if e in ('<ESC>', '<SPACE>', 'q'):
-                break
-            # print(e)
-            if e == '<UP>':
-                showMove("\u2191")
-                walk('y', [-regDist])
-            elif e == '<DOWN>':
-                showMove("\u2193")
-                walk('y', [regDist])
-            elif e == '<LEFT>':
-                showMove("\u2190")
-                walk('x', [-regDist])
-            elif e == '<RIGHT>':
-                showMove("\u2192")
-                walk('x', [regDist])
-            elif e in ('f', 'F'):
-                regDist = regDistances[options.units]["f"]
-                printMsg(f"fine {regDist}{options.units} steps")
-            elif e in ('m', 'M'):
-                regDist = regDistances[options.units]["m"]
-                printMsg(f"medium {regDist}{options.units} steps")
-            elif e in ('c', 'C'):
-                regDist = regDistances[options.units]["c"]
-                printMsg(f"coarse {regDist}{options.units} steps")
-            elif e in ('u', 'U'):
-                manual("raise_pen")
-                showMove("u")
-            elif e in ('d', 'D'):
-                manual("lower_pen")
-                showMove("d")
-            elif e in ('r', 'R'):
-                walkHome()
-                showMove("r")
+    # Moves need a persistent connection to keep up with the keyboard
+    from curtsies import Input
+    with heldSession() as s, Input(keynames='curtsies') as input_generator:
+        # Jogs only go through the connection if it was made with the head at home (see session.py)
+        if s is not None and (s.ad is None or not s.homeOrigin):
+            if aligned:
+                connectAtHome()
+            else:
+                print("Head position is unknown, so each move is a separate walk -- use 'align' first for quicker moves")
+        jogger = Jogger()
+        try:
+            for e in input_generator:   # e is a keypress or other event
+                stamp = time.perf_counter()
+                # Collect any other keypresses that are already waiting
+                events = [e]
+                while True:
+                    e = input_generator.send(0)
+                    if e is None:
+                        break
+                    events.append(e)
+                # Merge consecutive arrow keys into one move
+                dx = dy = 0
+                done = False
+                for e in events:
+                    if e in arrows:
+                        ax, ay, symbol = arrows[e]
+                        dx += ax
+                        dy += ay
+                        showMove(symbol)
+                        continue
+                    if dx or dy:
+                        jogger.move(dx * step, dy * step, stamp)
+                        dx = dy = 0
+                    if e in ('<ESC>', '<SPACE>', 'q'):
+                        done = True
+                        break
+                    elif e in ('f', 'F'):
+                        regDist = regDistances[options.units]["f"]
+                        step, _ = getDist([regDist])
+                        printMsg(f"fine {regDist}{options.units} steps")
+                    elif e in ('m', 'M'):
+                        regDist = regDistances[options.units]["m"]
+                        step, _ = getDist([regDist])
+                        printMsg(f"medium {regDist}{options.units} steps")
+                    elif e in ('c', 'C'):
+                        regDist = regDistances[options.units]["c"]
+                        step, _ = getDist([regDist])
+                        printMsg(f"coarse {regDist}{options.units} steps")
+                    elif e in ('u', 'U'):
+                        jogger.call(lambda: manual("raise_pen"))
+                        showMove("u")
+                    elif e in ('d', 'D'):
+                        jogger.call(lambda: manual("lower_pen"))
+                        showMove("d")
+                    elif e in ('r', 'R'):
+                        jogger.call(walkHome)
+                        showMove("r")
+                if dx or dy:
+                    jogger.move(dx * step, dy * step, stamp)
+                if done:
+                    break
+        finally:
+            jogger.finish()
     printMsg("Done registering")
-    reply = input("Set home? y/n: ")
+    jogger.report()
+    reply = timedInput("Set home? y/n: ")
     if getBool(False, reply):
         setHome()
 
+# Make sure there's a session (see session.py) for the duration, using a
+# temporary one if session mode is off.  If the port can't be opened for a
+# temporary one, there's no session (None) -- commands then work without.
+@contextlib.contextmanager
+def heldSession ():
+    global session
+    temporary = session is None
+    if temporary:
+        session = Session(applyOptionsToAD)
+        if not session.openPort(options.port):
+            session = None
+            yield None
+            return
+    try:
+        yield session
+    finally:
+        if temporary:
+            session.close()
+            session = None
+
+# Is the port option a device file (e.g. /dev/ttyACM0, or the virtual plotter's pty)?
+def portIsDevice ():
+    return isinstance(options.port, str) and os.path.isabs(options.port) and os.path.exists(options.port)
+
 def setHome ():
     manual("disable_xy")
     manual("enable_xy")
@@ -731,11 +1035,16 @@ def fmtDist (d):
     return f"{d:{format}}"
 
 def walk (xy, args):
-    global aligned, alignX, alignY
     dist, err = getDist(args) # in inches
     if err:
         print(f"walk{xy}: {err}")
         return
+    walkDist(xy, dist)
+
+# Move dist inches along one axis, limited to the plotter's range if we know where the head is
+@counters.timed("operation", "walk")
+def walkDist (xy, dist):
+    global aligned, alignX, alignY
     #print(f"walk{xy} {dist=} {aligned=} {alignX=} {alignY=} {maxX()=} {maxY()=}")
     cmdOpts = {}
     cmdOpts["mode"] = "manual"
@@ -770,16 +1079,36 @@ def walk (xy, args):
             if abs(dist) > maxY():
                 print("Too far")
                 return
+    if session and session.walk(options.__dict__, xy, dist):
+        return
     cmdOpts["walk_dist"] = dist     # for pre-3.8 software
     cmdOpts["dist"] = dist
     rc = plotRun(cmdOpts = cmdOpts)
     #print(f"NOT RUNNING -- would have walked {dist} {xy}")
 
 def walkHome ():
+    global alignX, alignY
     manual("walk_home")
     if aligned:
         alignX = 0.0
         alignY = 0.0
+    # The walk home was a plot-mode run, so the session reconnects -- here,
+    # at home, so that walks can go through it again
+    if session and session.isOpen():
+        manual("enable_xy")
+
+# Connect the session with the head at home, so that walks go through it.
+# The head is taken home first if it isn't there, and brought back.
+def connectAtHome ():
+    x, y = alignX, alignY
+    if x or y:
+        walkHome()
+    else:
+        manual("enable_xy")
+    if x:
+        walkDist('x', x)
+    if y:
+        walkDist('y', y)
 
 def showPos ():
     if aligned: 
@@ -814,131 +1143,918 @@ def getFilenameAndLayer (cmdName, args):
     return argsToFileName(args), layer
 
 # Plot a number of copies
+# The file is checked and its plan prepared once (unless the output file is
+# wanted as SVG, which needs a full run each time), and each copy replays it.
+# 0 copies means keep going until stopped.
+@counters.timed("operation")
 def plotCopies (args):
+    global copiesRunning, copiesStopping
+    inputFilename, layer = getFilenameAndLayer("plot", args)
+    start = time.perf_counter()
+    if not inputFilename or not checkLayout("plot", inputFilename, layer):
+        noteRC(1)
+        return
+    plan = None
+    if outputFilename == noOutputFile or options.digest > 0:
+        plan = getPlan(inputFilename, layer)
+        if plan is None:
+            noteRC(1)
+            return
+    prepSeconds = time.perf_counter() - start
+    counters.observe("phase", "prepare", prepSeconds)
     storedCopies = options.copies
     options.copies = 1  # Don't need AxiDraw to handle the copies
     copies = 99999 if storedCopies == 0 else storedCopies
-    for copy in range(1, storedCopies+1):
-        print(f"Copy {copy} of {copies}:")
-        plotFile(args)
-        if copy < storedCopies:
-            reply = input("Press Enter to start next copy (or type 'c' to cancel): ")
-            if reply and reply.lower()[0] == 'c':
+    of = "" if storedCopies == 0 else f" of {copies}"
+    plotSeconds = []
+    copiesRunning = True
+    copiesStopping = False
+    try:
+        for copy in range(1, copies+1):
+            print(f"Copy {copy}{of}:")
+            start = time.perf_counter()
+            rc = plotSVG(inputFilename, layer, plan=plan)
+            plotSeconds.append(time.perf_counter() - start)
+            if rc != 0:
+                print(f"Stopping after copy {copy}")
+                break
+            print(f"Copy {copy}{of} plotted in {batch.fmtTime(plotSeconds[-1])}")
+            if copy < copies and (copiesStopping or not waitForNext(options.copies_auto, 'c', "cancel")):
                 print(f"Stopping after {copy} copies")
                 break
-    else:
-        print(f"{copy} copies completed")
-    options.copies = storedCopies
-
-# Plot or preview an SVG file, with loop to deal with pause/resume
+    finally:
+        copiesRunning = False
+        options.copies = storedCopies
+    done = len(plotSeconds)
+    print(f"{done} copies: preparation {prepSeconds:.1f} seconds, plotting {batch.fmtTime(sum(plotSeconds))} "
+          f"(average {batch.fmtTime(sum(plotSeconds) / done)} per copy)")
+
+# Plot or preview an SVG file
+@counters.timed("operation")
 def plotFile (args, preview=False):
     cmdName = "preview" if preview else "plot"
-    participle = "Previewing" if preview else "Plotting"
     inputFilename, layer = getFilenameAndLayer(cmdName, args)
+    if not inputFilename or not checkLayout(cmdName, inputFilename, layer):
+        noteRC(1)
+        return 1
+    return plotSVG(inputFilename, layer, preview)
+
+# Check that the file has the layer (if given), using the file's layer index
+# (see layerindex.py).  The index doesn't see clones, text and so on, so an
+# empty drawing or one outside the plotter's travel is only warned about, and
+# pyaxidraw has the last word.  Returns True if it's OK to go ahead.
+def checkLayout (cmdName, filename, layer):
+    try:
+        index = layerIndex.get(filename)
+    except OSError as err:
+        print(f"{cmdName}: unable to read '{filename}': {err.strerror}")
+        return False
+    except svginfo.ET.ParseError as err:
+        print(f"{cmdName}: '{filename}' is not a valid SVG file: {err}")
+        return False
+    if layer is not None and layer not in index.numbers():
+        numbers = ", ".join(str(n) for n in index.numbers()) or "none"
+        print(f"{cmdName}: '{filename}' has no layer {layer} -- its layers are: {numbers}")
+        return False
+    box = index.bbox(layer)
+    if box is None:
+        print(f"{cmdName}: warning: found no paths to plot in '{filename}'"
+              + ("" if layer is None else f" layer {layer}"))
+    elif not boxFits(box, index.size, maxX(), maxY(), options.auto_rotate):
+        print(f"{cmdName}: warning: the drawing seems to go from {fmtDist(box[0])}, {fmtDist(box[1])} to "
+              f"{fmtDist(box[2])}, {fmtDist(box[3])} {options.units}, outside the plotter's "
+              f"{fmtDist(maxX())} by {fmtDist(maxY())} {options.units}")
+    return True
+
+# Show the layers in a file, with their contents and sizes
+def showLayers (args):
+    if len(args) == 0:
+        print("layers: need a filename")
+        return
+    filename = argsToFileName(args)
+    try:
+        index = layerIndex.get(filename)
+    except OSError as err:
+        print(f"layers: unable to read '{filename}': {err.strerror}")
+        return
+    except svginfo.ET.ParseError as err:
+        print(f"layers: '{filename}' is not a valid SVG file: {err}")
+        return
+    if index.size:
+        print(f"'{filename}': {fmtDist(index.size[0])} by {fmtDist(index.size[1])} {options.units} "
+              f"(scanned in {index.seconds * 1000:.0f} ms)")
+    print(f"{'layer':>5}  {'paths':>7}  {'segments':>9}  {'from (' + options.units + ')':>18}  {'to':>18}  name")
+    for l in index.layers + ([index.loose] if index.loose.paths else []):
+        if l.bbox:
+            fits = "" if boxFits(l.bbox, index.size, maxX(), maxY(), options.auto_rotate) else "  ** outside travel **"
+            corners = f"{fmtDist(l.bbox[0]) + ', ' + fmtDist(l.bbox[1]):>18}  {fmtDist(l.bbox[2]) + ', ' + fmtDist(l.bbox[3]):>18}"
+        else:
+            fits = ""
+            corners = f"{'-':>18}  {'-':>18}"
+        number = "-" if l.number is None else str(l.number)
+        notes = " (documentation)" if l.documentation else " (hidden)" if l.hidden else " (pause)" if l.pause else ""
+        print(f"{number:>5}  {l.paths:7d}  {l.segments:9d}  {corners}  {l.name}{notes}{fits}")
+    if not index.layers:
+        print("no layers -- use 'plot' without a layer number")
+
+# Time each plot or preview done by plotSVG(), and count how plots end
+def timedPlot (fn):
+    @functools.wraps(fn)
+    def wrapper (inputFilename, layer, preview=False, svg=None, plan=None):
+        counters.set("plotting", 0 if preview else 1)
+        start = time.perf_counter()
+        try:
+            rc = fn(inputFilename, layer, preview, svg, plan)
+        finally:
+            counters.set("plotting", 0)
+        counters.observe("plot", "preview" if preview else "plot", time.perf_counter() - start)
+        if preview:
+            counters.count("previews")
+        else:
+            counters.count("plots_completed" if rc == 0 else "plots_cancelled" if rc == 102 else "plots_failed")
+        return rc
+    return wrapper
+
+# Plot or preview an SVG file, with loop to deal with pause/resume.
+# If svg is given, it's the document to plot (e.g. part of the file -- see
+# streamFile()), and inputFilename is just for messages.  If plan is
+# given, it's the file's plan, already prepared (see plotCopies()).
+# Returns 0 if completed, 102 if cancelled after a pause, else the error code.
+@timedPlot
+def plotSVG (inputFilename, layer, preview=False, svg=None, plan=None):
+    cmdName = "preview" if preview else "plot"
+    participle = "Previewing" if preview else "Plotting"
 
     global plotRunning
     plotRunning = True
 
     # NOTE: The input file name has already been set via ad.plot_setup(filename).
     # It's only need here to generate an automatic outpuf file name.
-    # That seems to mean that it doesn't matter if we resume
-    # ...but how does it work if I'm not changing the input file?
-    # Plotting a file: if there's an outputFilename, output will go that.
-    # Else, send output to a temp file in case restart is required.
-    # via the with.. just below.
+    # The output of each run is kept in memory: it's the input for
+    # the next run if the plot is paused and resumed (it contains the
+    # restart position), and it's only written to a file if the user
+    # asked for one with 'output'.
     #print(f"{inputFilename=}  {outputFilename=}")
 
-    infn = inputFilename
-    outfn = None
-    prevOutfn = None
+    fromPlan = plan is not None or usePlans() and svg is None
+    if preview and outputFilename == noOutputFile and svg is None:
+        # No output wanted, so the numbers are all that matter
+        estimate = estimateCache.get(inputFilename, estimateKeyOpts(fromPlan), layer)
+        if estimate:
+            print(f"Previewing file '{inputFilename}' (cached estimate)")
+            printEstimate(estimate)
+            plotRunning = False
+            return 0
+
+    global lastEstimate
+    lastEstimate = None
+    svgIn = svg or inputFilename    # file name for the first run, then the SVG itself
+    output = None
     plotCancelled = False
     while True:     # until completed or cancelled
-        prevOutfn = outfn
         cmdOpts = {}
         # Set up for the input file, and apply options
-        if outfn != None:
-            #print(f"Time to delete previous {outfn=} ?  NO!!!! outfn=infn")
+        if output != None:
             # Not the first time round the loop, so we're resuming
             cmdOpts["mode"] = "res_plot"
-            print(f"Resuming file '{infn}' layer {layer}")
+            print(f"Resuming file '{inputFilename}' layer {layer}")
         elif layer is not None:
             cmdOpts["mode"] = "layers"
-            print(f"{participle} file '{infn}' layer {layer}")
+            print(f"{participle} file '{inputFilename}' layer {layer}")
         else:
             cmdOpts["mode"] = "plot"
-            print(f"{participle} file '{infn}'")
+            print(f"{participle} file '{inputFilename}'")
         cmdOpts["layer"] = layer   # even if it's None
-        # now in plotRun   ad.plot_setup(infn)     # This changes ad.options
-        #oldRT = options.report_time
-        #oldRL = options.report_lifts
+        if output is None and (plan is not None or usePlans() and svg is None):
+            # Plot from the processed plan, which only has the chosen layer in it
+            plan = plan or getPlan(inputFilename, layer)
+            if plan is None:
+                plotRunning = False
+                noteRC(1)
+                return 1
+            svgIn = plan
+            cmdOpts["mode"] = "plot"
+            cmdOpts["layer"] = None
         if preview:
             cmdOpts["preview"] = True
         # Always do these
         cmdOpts["report_time"] = True
         cmdOpts["report_lifts"] = True
-        # Always send output to temp file (see below re saving it)
-        ofh, outfn = tempfile.mkstemp(suffix='.svg', text=True)
-        # ?? ofh.close() # just need the name
-        rc = plotRun(infn, outfn, cmdOpts)
-        #if preview:
-        #    options.preview = False
-        #options.report_time = False
-        #options.report_lifts = False
-        #del options.report_time
-        #del options.report_lifts
-        if infn != inputFilename:
-            # input was a temporary file -- delete it
-            pathlib.Path(infn).unlink(missing_ok = True)
+        rc, output = runAD(svgIn, cmdOpts, True)
         if rc == 102:
             # user pressed the button -- may want to restart
-            cmd = ''
-            while not cmd in ['r', 'c']:
-                reply = input("\nType 'r' to resume or 'c' to cancel: ").lower()
-                if reply:
-                    cmd = reply[0]
-            if cmd == 'c':
+            if pauseAction() == 'c':
                 plotCancelled = True
                 walkHome()
                 break
-            # previous outputfile is the input for the next go (it contains the restart position)
-            infn = outfn
+            # this output is the input for the next go (it contains the restart position)
+            svgIn = output
         elif rc > 0:
-            print(f"{cmdName}: giving up -- got {rc=}   temp files not deleted")
+            print(f"{cmdName}: giving up -- got {rc=}")
             plotRunning = False
-            return 
+            return rc
         else:
             # no pause -- plot is complete
             break
     # end of while True
 
-    if plotCancelled or outputFilename == noOutputFile:
-        # Cancelled, or user didn't ask for an output file -- delete it
-        pathlib.Path(outfn).unlink(missing_ok = True)
-    else:
-        # Rename / move the temp output to a permanent file
-        if outputFilename == autoOutputFile:
-            infix = '.plob' if options.digest > 0 else '.out'
-            ofn = f"{pathlib.Path(inputFilename).stem}{infix}.svg"
+    if preview and not plotCancelled and lastEstimate:
+        estimateCache.put(inputFilename, estimateKeyOpts(fromPlan), layer, lastEstimate)
+
+    if not plotCancelled and outputFilename != noOutputFile and svg is None:
+        saveOutput(cmdName, inputFilename, output)
+
+    plotRunning = False
+    if plotCancelled:
+        noteRC(102)
+        return 102
+    return 0
+
+# What to do about a paused plot: 'r' to resume or 'c' to cancel
+@counters.timed("phase", "pause")
+def pauseAction ():
+    if scriptPolicy:
+        onPause = scriptPolicy["on_pause"]
+        if onPause == "wait-button":
+            print("\nPaused -- press the button on the plotter to resume")
+            return 'r' if waitForButton() else 'c'
+        print(f"\nPaused -- will {onPause} (--on-pause)")
+        return onPause[0]
+    poll = buttonPoll()
+    hint = " (or press the button to resume)" if poll else ""
+    cmd = ''
+    while not cmd in ['r', 'c']:
+        reply = consoleInput(f"\nType 'r' to resume or 'c' to cancel{hint}: ", poll)
+        if poll and reply == "":
+            return 'r'
+        if reply:
+            cmd = reply.lower()[0]
+    return cmd
+
+# The queue command and its subcommands
+def queueCmd (args):
+    if len(args) == 0:
+        jobQueue.list()
+        return
+    sub = args[0].lower()
+    if "add".startswith(sub):
+        queueAdd(args[1:])
+    elif "auto".startswith(sub):
+        setBool("queue_auto", args[1:])
+    elif "list".startswith(sub):
+        jobQueue.list()
+    elif "run".startswith(sub):
+        if scheduler.devices:
+            runDevices()
         else:
-            ofn = outputFilename
+            runQueue()
+    elif "pause".startswith(sub):
+        jobQueue.paused = True
+        print("queue paused")
+    elif "drop".startswith(sub):
+        queueDrop(args[1:])
+    else:
+        print("queue: need one of add <filename> [<layer>|all] [<copies>], list, run, pause, drop [<n>|all], auto <y/n>")
+
+def queueAdd (args):
+    # Up to two numbers at the end: layer (or 'all') and copies
+    nums = []
+    while len(args) > 1 and len(nums) < 2 and (getInt(args[-1])[1] == "" or args[-1].lower() == "all"):
+        nums.insert(0, args.pop())
+    layer = None
+    copies = 1
+    if len(nums) >= 1 and nums[0].lower() != "all":
+        layer = int(nums[0])
+        if layer < 0 or layer > 1000:
+            print("queue add: layer must be a whole number between 0 and 1000")
+            return
+    if len(nums) == 2:
+        copies = int(nums[1])
+        if copies < 1 or copies > 9999:
+            print("queue add: copies must be between 1 and 9999")
+            return
+    if len(args) == 0:
+        print("queue add: need a filename (and optional layer and copies)")
+        return
+    filename = argsToFileName(args)
+    if not os.path.isfile(filename):
+        print(f"queue add: no such file '{filename}'")
+        return
+    n = jobQueue.add(Job(os.path.abspath(filename), layer, copies, options.queue_auto))
+    print(f"job {n}: {jobQueue.jobs[-1]}")
+    scheduler.poke()
+
+def queueDrop (args):
+    if len(args) == 0 or args[0].lower() == "all":
+        jobQueue.clear()
+        print("queue is empty")
+        return
+    n, err = get1Int(args)
+    if err or jobQueue.drop(n) is None:
+        print(f"queue drop: no job '{' '.join(args)}' -- see 'queue list'")
+        return
+    jobQueue.list()
+
+# Plot the jobs in the queue, one copy at a time, until it's empty or paused.
+def runQueue ():
+    if not jobQueue.jobs:
+        print("queue is empty")
+        return
+    jobQueue.paused = False
+    jobQueue.running = True
+    try:
+        while jobQueue.jobs and not jobQueue.paused:
+            job = jobQueue.next()
+            if not checkJobFits(job):
+                jobQueue.paused = True
+                break
+            if usePlans():
+                takePrepared(job)
+            print(f"Job: {job}")
+            if usePlans():
+                prepareNext()
+            rc = plotSVG(job.filename, job.layer)
+            if rc != 0:
+                # Cancelled or failed -- leave it for the user to sort out
+                jobQueue.paused = True
+                break
+            jobQueue.copyDone()
+            if jobQueue.jobs and not jobQueue.paused:
+                if not waitForNext(job.auto):
+                    jobQueue.paused = True
+    finally:
+        jobQueue.running = False
+        preparer.shutdown()
+    if jobQueue.paused:
+        print(f"Queue paused with {len(jobQueue)} job(s) left -- 'queue run' to continue")
+    else:
+        print("Queue finished")
+
+# Run the queue on the devices: as a task in the REPL's event loop, so the
+# console stays free, or to the end in a script.
+def runDevices ():
+    if not jobQueue.jobs:
+        print("queue is empty")
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(scheduler.run(options.page_delay))
+        return
+    task = loop.create_task(scheduler.run(options.page_delay))
+    backgroundTasks.add(task)
+    task.add_done_callback(backgroundTasks.discard)
+
+# The command line, environment and script for a child interaxi to plot
+# one copy of a job on a device, and a function to tidy up afterwards.
+# The child gets a snapshot of our options, then the device's profile.
+def deviceJob (device, job):
+    snapshot = {key: val for key, val in options.__dict__.items() if key not in deviceSkipOpts}
+    snapshot["copies"] = 1
+    text = configText(snapshot)
+    fd, snapshotFile = tempfile.mkstemp(prefix="interaxi-device-", suffix=".py")
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    counters.wroteFile(len(text))
+    configs = [snapshotFile]
+    if device.profile:
+        configs.append(profiles.path(device.profile))
+    # The port is given on the command line, so the child is on its own
+    # plotter from the start -- --assume-aligned sets home before the script runs
+    argv = [sys.executable, "-c", "from interaxi.interaxi import main; main()", *configs,
+            "--port", device.port or firstPort,
+            "--batch", "-", "--assume-aligned", "--on-pause", "wait-button"]
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                      env.get("PYTHONPATH")]))
+    env["PYTHONUNBUFFERED"] = "1"   # so its output is shown as it comes
+    layer = "" if job.layer is None else f" {job.layer}"
+    script = f"session y\nplot {job.filename}{layer}\n"
+    return argv, env, script, lambda: os.unlink(snapshotFile)
+
+# Before plotting on a device, let go of its port if we have it open.
+# Returns False if we're using it.
+def releaseDevice (device):
+    if device.port != options.port or not session:
+        return True
+    if plotterWorker.busy():
+        return False
+    session.close()
+    return True
+
+# The device command and its subcommands
+def deviceCmd (args):
+    if len(args) == 0:
+        scheduler.list()
+        return
+    sub = args[0].lower()
+    if "add".startswith(sub):
+        if len(args) not in (3, 4):
+            print("device add: need a name and a port (or 'none' for the first found), and optionally a profile")
+            return
+        name, port = args[1], args[2]
+        profile = args[3] if len(args) == 4 else None
+        if name in scheduler.devices and scheduler.devices[name].job:
+            print(f"device add: '{name}' is plotting -- wait for it to finish")
+            return
+        if profile and not os.path.isfile(profiles.path(profile)):
+            print(f"device add: no profile '{profile}' -- see 'profile'")
+            return
+        scheduler.add(Device(name, None if port.lower() == firstPort else port, profile))
+        print(f"  {scheduler.devices[name]}")
+        print(f"When its head is at the origin and it has paper, 'device ready {name}'")
+        return
+    if len(args) != 2 or not [s for s in ("drop", "ready", "hold", "use") if s.startswith(sub)]:
+        print("device: need one of add <name> <port> [<profile>], drop <name>, ready <name>|all, hold <name>|all, use <name>")
+        return
+    name = args[1]
+    if name.lower() == "all" and sub[0] in "rh":
+        chosen = list(scheduler.devices.values())
+    elif name in scheduler.devices:
+        chosen = [scheduler.devices[name]]
+    else:
+        print(f"device: no device '{name}' -- see 'device'")
+        return
+    device = chosen[0]
+    if "drop".startswith(sub):
+        if device.job:
+            print(f"device drop: '{name}' is plotting -- 'device hold {name}' to stop giving it work")
+            return
+        del scheduler.devices[name]
+    elif "ready".startswith(sub):
+        for device in chosen:
+            device.ready = True
+        scheduler.poke()
+    elif "hold".startswith(sub):
+        for device in chosen:
+            device.ready = False
+    else:
+        # use: point the interactive commands at the device
+        if device.job:
+            print(f"device use: '{name}' is plotting -- wait for it to finish")
+            return
+        setPort([device.port or firstPort])
+        if device.profile:
+            profileCmd([device.profile])
+        return
+    scheduler.list()
+
+# Start preparing the plan for the next job that hasn't got one, in the background
+def prepareNext ():
+    adOptions, adParams = adOptionDicts()
+    for job in jobQueue.jobs[1:]:
+        key = planCache.key(job.filename, options.__dict__, job.layer)
+        if key is not None and key not in planCache.plans and not preparer.isPending(key):
+            preparer.start(key, job.filename, job.layer, adOptions, adParams, options.optimise)
+            return
+
+# Collect the plan for a job if it was prepared in the background
+def takePrepared (job):
+    key = planCache.key(job.filename, options.__dict__, job.layer)
+    prepared = preparer.take(key)
+    if prepared is None:
+        return
+    if prepared["rc"] != 0 or not prepared["plan"]:
+        return      # try again in the foreground, to show the errors
+    planCache.put(key, prepared["plan"])
+    print(f"Plan for '{job.filename}' was prepared in the background in {prepared['seconds']:.1f} seconds")
+    if prepared["optimised"]:
+        printOptimised(*prepared["optimised"])
+
+# Check that a job's drawing fits the plotter, from its layer index (see
+# checkLayout()), the first time it comes up.  Returns False if the queue
+# should pause before the job; 'queue run' then plots it anyway.
+def checkJobFits (job):
+    if job.sizeChecked:
+        return True
+    job.sizeChecked = True
+    try:
+        index = layerIndex.get(job.filename)
+    except (OSError, svginfo.ET.ParseError):
+        return True     # the plot will say what's wrong
+    box = index.bbox(job.layer)
+    if boxFits(box, index.size, maxX(), maxY(), options.auto_rotate):
+        return True
+    print(f"WARNING: the drawing in '{job.filename}' seems to go from {fmtDist(box[0])}, {fmtDist(box[1])} to "
+          f"{fmtDist(box[2])}, {fmtDist(box[3])} {options.units}, outside the plotter's "
+          f"{fmtDist(maxX())} by {fmtDist(maxY())} {options.units}")
+    print("Queue paused -- 'queue run' to plot it anyway, or 'queue drop 1' to skip it")
+    return False
+
+# Wait between copies or jobs: page_delay seconds if auto, else until the user
+# presses Enter.  Scripts wait page_delay seconds, or for the plotter's button.
+# Returns False if the user typed stopKey (or the queue was paused).
+def waitForNext (auto, stopKey='p', stopWhat="pause the queue"):
+    if scriptPolicy and scriptPolicy["between_copies"] == "wait-button":
+        print("Press the button on the plotter to start the next copy")
+        return waitForButton()
+    if auto or scriptPolicy:
+        hint = " (Ctrl-C to pause the queue)" if jobQueue.running else ""
+        if not hint and copiesRunning:
+            hint = " (Ctrl-C to stop)"
+        print(f"Next copy in {options.page_delay} seconds{hint}")
+        end = time.monotonic() + options.page_delay
+        while time.monotonic() < end and not (jobQueue.running and jobQueue.paused) and not copiesStopping:
+            time.sleep(0.1)
+        return not (jobQueue.running and jobQueue.paused) and not copiesStopping
+    poll = buttonPoll()
+    hint = " or press the button" if poll else ""
+    reply = timedInput(f"Press Enter{hint} to start the next copy (or type '{stopKey}' to {stopWhat}): ", poll)
+    return not (reply and reply.lower()[0] == stopKey)
+
+# Current memory use (resident set size) in MB
+def memoryMB ():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        # Not Linux -- the best we can do is the peak so far (KB on Linux, bytes on macOS)
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+# Plot a file one top-level group (usually a layer) at a time, so that only
+# one part of it is in memory at once.  Each part is a plot on its own, so
+# can be paused and resumed as usual.  A part that looks too big for the
+# memory budget isn't plotted; and if a part turns out to take more than the
+# budget, the next might not fit at all, so it stops there.
+def streamFile (args):
+    if len(args) == 0:
+        print(f"stream: need a filename (memory budget is {options.stream_mb} MB)")
+        return
+    filename = argsToFileName(args)
+    if not os.path.isfile(filename):
+        print(f"stream: no such file '{filename}'")
+        noteRC(1)
+        return
+    start = time.perf_counter()
+    peak = memoryMB()
+    parts = 0
+    rc = 0
+    overBudget = False
+    refused = False
+    with heldSession():
         try:
-            os.replace(outfn, ofn)
-            print(f"{cmdName}: output file saved as '{ofn}")
-        except OSError as err:
-            print(f"{cmdName}: unable to rename '{ofn}' -- it has been kept as '{outfn}'")
+            for label, part in svginfo.splitDocument(filename):
+                parts += 1
+                print(f"Part {parts}: '{label}' ({len(part) / 1e6:.1f} MB)")
+                need = memoryMB() + streamMemoryFactor * len(part) / 1e6
+                if need > options.stream_mb:
+                    print(f"stream: plotting this part would take about {need:.0f} MB of memory, more than the "
+                          f"{options.stream_mb} MB budget -- split the file into smaller layers, or raise stream_mb")
+                    refused = True
+                    break
+                rc = plotSVG(filename, None, svg=part)
+                del part
+                gc.collect()
+                used = memoryMB()
+                peak = max(peak, used)
+                if rc != 0:
+                    break
+                if used > options.stream_mb:
+                    print(f"stream: using {used:.0f} MB of memory, more than the {options.stream_mb} MB budget -- "
+                          "split the file into smaller layers, or raise stream_mb")
+                    overBudget = True
+                    break
+        except svginfo.ET.ParseError as err:
+            print(f"stream: unable to read '{filename}': {err}")
+            noteRC(1)
+            return
+    if refused:
+        noteRC(1)
+        print(f"Stopped before part {parts}")
+    elif overBudget:
+        noteRC(1)
+        print(f"Stopped after part {parts}")
+    elif rc == 0:
+        print(f"Streamed {parts} parts in {time.perf_counter() - start:.1f} seconds, peak memory use {peak:.0f} MB")
+    else:
+        print(f"Stopped after part {parts}")
 
-    plotRunning = False
+# Memory needed to plot a part of a streamed file, as a multiple of the
+# length of its SVG: pyaxidraw holds the parsed document and the paths made
+# from it.  A cautious guess, as it depends on the drawing.
+streamMemoryFactor = 10
+
+def setStreamBudget (args):
+    setRangeInt("stream_mb", 10, 100000, args)
+
+# Write the output of a plot or preview to the file the user asked for
+def saveOutput (cmdName, inputFilename, output):
+    if outputFilename == autoOutputFile:
+        infix = '.plob' if options.digest > 0 else '.out'
+        ofn = f"{pathlib.Path(inputFilename).stem}{infix}.svg"
+    else:
+        ofn = outputFilename
+    try:
+        with open(ofn, "w") as f:
+            f.write(output)
+        counters.count("bytes_written", len(output))
+        print(f"{cmdName}: output file saved as '{ofn}'")
+    except OSError as err:
+        print(f"{cmdName}: unable to save output file '{ofn}': {err}")
+
+def printEstimate (estimate):
+    print(f"Estimated print time: {batch.fmtTime(estimate['time'])} (h:mm:ss)")
+    print(f"Length of path to draw: {batch.fmtMetres(estimate['pendown'])} m")
+    print(f"Total movement distance: {batch.fmtMetres(estimate['total'])} m")
+    print(f"Number of pen lifts: {estimate['lifts']}")
+
+def setEstimateCache (args):
+    if len(args) > 0:
+        if "clear".startswith(args[0].lower()):
+            print(f"{estimateCache.clear()} estimates removed")
+        else:
+            print("estcache: only 'clear' is allowed")
+    estimateCache.report()
+
+# The options to give to a separate AxiDraw object, as dictionaries for ad.options and ad.params
+def adOptionDicts ():
+    adOptions = {}
+    adParams = {}
+    for key, val in options.__dict__.items():
+        if key in localOpts:
+            continue
+        if key in addlOpts:
+            adParams[key] = val
+        else:
+            adOptions[key] = val
+    return adOptions, adParams
+
+# Preview many files in parallel, and output the estimates.
+# Returns 0 if all the previews worked, else 1.
+def previewMany (patterns, fmt="table", resultsFile=None, jobs=None):
+    files = batch.findFiles(patterns)
+    if not files:
+        print(f"preview: no .svg files found in {' '.join(patterns)}")
+        return 1
+    adOptions, adParams = adOptionDicts()
+    results = batch.previewBatch(files, adOptions, adParams, jobs, cache=estimateCache, opts=estimateKeyOpts(False))
+    try:
+        batch.writeResults(results, fmt, resultsFile)
+    except OSError as err:
+        print(f"preview: unable to write results: {err}")
+        return 1
+    if resultsFile:
+        print(f"preview: results for {len(results)} files saved as '{resultsFile}'")
+    return 0 if all(r["rc"] == 0 for r in results) else 1
+
+# Preview one file, or many if given a glob or directory (optionally followed
+# by 'json <file>' or 'csv <file>' to save the results)
+def preview (args):
+    fmt = "table"
+    resultsFile = None
+    if len(args) >= 3 and args[-2].lower() in batch.formats and batch.isBatch(argsToFileName(args[:-2])):
+        fmt = args[-2].lower()
+        resultsFile = os.path.expanduser(args[-1])
+        args = args[:-2]
+    if args and batch.isBatch(argsToFileName(args)):
+        previewMany([argsToFileName(args)], fmt, resultsFile)
+    else:
+        plotFile(args, preview=True)
+
+# Quick estimates from the plan, without a preview (see estimate.py): for a
+# file, or many (optionally followed by 'json <file>' or 'csv <file>').
+# 'calibrate' fits the model to previews, and 'calibration' shows or resets it.
+def estimateCmd (args):
+    if not optimise.available():
+        print("estimate: NumPy is needed for estimates -- 'preview' works without it")
+        return
+    sub = args[0].lower() if args else ""
+    if sub == "calibrate":
+        calibrate(args[1:])
+        return
+    if sub == "calibration":
+        if len(args) > 1 and args[1].lower() == "reset":
+            calibration.reset()
+            print("calibration reset")
+        calibration.report(estimateCache.version)
+        return
+    fmt = "table"
+    resultsFile = None
+    if len(args) >= 3 and args[-2].lower() in batch.formats and batch.isBatch(argsToFileName(args[:-2])):
+        fmt = args[-2].lower()
+        resultsFile = os.path.expanduser(args[-1])
+        args = args[:-2]
+    if args and batch.isBatch(argsToFileName(args)):
+        estimateMany([argsToFileName(args)], fmt, resultsFile)
+        return
+    filename, layer = getFilenameAndLayer("estimate", args)
+    if not filename or not checkLayout("estimate", filename, layer):
+        noteRC(1)
+        return
+    plan = getPlan(filename, layer)
+    if plan is None:
+        noteRC(1)
+        return
+    start = time.perf_counter()
+    result = estimate.estimatePlan(plan, options.__dict__, motionParams, calibration.factors)
+    seconds = time.perf_counter() - start
+    printEstimate(result)
+    print(f"Pen-up travel: {batch.fmtMetres(result['penup'])} m")
+    how = f"calibrated against {calibration.files} previews" if calibration.files else "not calibrated -- see 'estimate calibrate'"
+    print(f"(estimated in {1000 * seconds:.0f} ms; {how})")
+
+# Model estimates for many whole files, with factors for the parts of the
+# time.  Plans that aren't in the plan cache are made in parallel.  Returns
+# results as from batch.previewBatch(), plus the parts of each time.
+def estimateFiles (files, factors, jobs=None):
+    plans = {}
+    for filename in files:
+        key = planCache.key(filename, options.__dict__, None)
+        plan = planCache.get(key) if key is not None else None
+        if plan is not None:
+            plans[filename] = plan
+    toPrepare = [f for f in files if f not in plans]
+    if toPrepare:
+        adOptions, adParams = adOptionDicts()
+        budget = options.optimise if optimise.available() else 0
+        for n, (filename, prepared) in enumerate(preparePlans(toPrepare, adOptions, adParams, budget, jobs), 1):
+            if prepared["rc"] == 0 and prepared["plan"]:
+                plans[filename] = prepared["plan"]
+                planCache.put(planCache.key(filename, options.__dict__, None), prepared["plan"])
+            print(f"\rprepared {n} of {len(toPrepare)} plans", end="", flush=True, file=sys.stderr)
+        print(file=sys.stderr)
+    results = []
+    for filename in files:
+        if filename not in plans:
+            results.append(dict(dict.fromkeys(batch.resultFields), file=filename, rc=1, parts=None))
+            continue
+        result = estimate.estimatePlan(plans[filename], options.__dict__, motionParams, factors)
+        results.append({"file": filename, "time": result["time"], "pendown": result["pendown"],
+                        "total": result["total"], "lifts": result["lifts"], "rc": 0, "parts": result["parts"]})
+    return results
+
+# Estimate many files, and output the estimates as previewMany() does.
+# Returns 0 if all the estimates worked, else 1.
+def estimateMany (patterns, fmt="table", resultsFile=None, jobs=None):
+    if not optimise.available():
+        print("estimate: NumPy is needed for estimates -- use --preview instead")
+        return 1
+    files = batch.findFiles(patterns)
+    if not files:
+        print(f"estimate: no .svg files found in {' '.join(patterns)}")
+        return 1
+    start = time.perf_counter()
+    results = estimateFiles(files, calibration.factors, jobs)
+    print(f"estimated {len(files)} files in {time.perf_counter() - start:.1f} seconds", file=sys.stderr)
+    results = batch.sortResults([{key: r[key] for key in batch.resultFields} for r in results])
+    try:
+        batch.writeResults(results, fmt, resultsFile)
+    except OSError as err:
+        print(f"estimate: unable to write results: {err}")
+        return 1
+    if resultsFile:
+        print(f"estimate: results for {len(results)} files saved as '{resultsFile}'")
+    return 0 if all(r["rc"] == 0 for r in results) else 1
+
+# Fit the model to previews of some files (see estimate.fitFactors()), and save the factors
+def calibrate (args):
+    if not args:
+        print("estimate calibrate: need some files (a filename, directory or glob) to preview")
+        return
+    files = batch.findFiles([argsToFileName(args)])
+    if not files:
+        print(f"estimate calibrate: no .svg files found in {argsToFileName(args)}")
+        return
+    start = time.perf_counter()
+    results = estimateFiles(files, [1.0] * len(estimate.parts))
+    modelSeconds = time.perf_counter() - start
+    adOptions, adParams = adOptionDicts()
+    start = time.perf_counter()
+    previews = {r["file"]: r for r in batch.previewBatch(files, adOptions, adParams,
+                                                          cache=estimateCache, opts=estimateKeyOpts(False))}
+    previewSeconds = time.perf_counter() - start
+    samples = [(r["file"], r["parts"], previews[r["file"]]["time"]) for r in results
+               if r["rc"] == 0 and previews[r["file"]]["rc"] == 0 and previews[r["file"]]["time"]]
+    if not samples:
+        print("estimate calibrate: no previews to calibrate against")
+        return
+    factors = estimate.fitFactors([(parts, t) for name, parts, t in samples])
+    calibration.error = estimate.compare(samples, factors)
+    calibration.factors = factors
+    calibration.files = len(samples)
+    calibration.version = estimateCache.version
+    print(f"model {modelSeconds:.1f} seconds (including making plans), previews {previewSeconds:.1f} seconds"
+          f" (including cached ones)")
+    err = calibration.save()
+    if err:
+        print(f"estimate calibrate: {err}")
+    calibration.report()
 
 # simple manual commands
+@counters.timed("operation")
 def manual (cmd):
     #options.mode = "manual"
     #options.manual_cmd = cmd
+    if session and session.manual(options.__dict__, cmd):
+        return
     rc = plotRun(cmdOpts = {"mode": "manual", "manual_cmd": cmd})
 
 # Other special mode runs
 def runMode (m): 
+    if session and session.manual(options.__dict__, m):
+        return
     rc = plotRun(cmdOpts = {"mode": m})
 
+# Show the stats (see stats.py), reset them, or set where they're written
+def statsCmd (args):
+    if len(args) == 0:
+        counters.report()
+        statsDumper.report(options.stats_interval)
+        return
+    sub = args[0].lower()
+    if "reset".startswith(sub):
+        counters.reset()
+        print("stats reset")
+    elif "file".startswith(sub):
+        setStatsFile(args[1:])
+    elif "interval".startswith(sub):
+        setRangeInt("stats_interval", 5, 86400, args[1:])
+        startStatsDump()
+    elif "write".startswith(sub) and len(args) > 1:
+        filename = argsToFileName(args[1:])
+        err = counters.dump(filename)
+        print(err or f"stats written to '{filename}'")
+    else:
+        print("stats: need one of reset, file <filename>|none, interval <seconds>, write <filename>")
+
+def setStatsFile (args):
+    if len(args) > 0:
+        filename = argsToFileName(args)
+        options.stats_file = None if filename.lower() == noOutputFile else filename
+        startStatsDump()
+    print(f"stats_file {options.stats_file or noOutputFile}")
+
+# Start (or stop) writing the stats regularly, to match the options
+def startStatsDump ():
+    statsDumper.start(options.stats_file, options.stats_interval)
+
+# Turn counting the serial traffic on or off, or show what's been counted
+def setSerialStats (args):
+    if len(args) > 0 and "reset".startswith(args[0].lower()):
+        serialMeter.reset()
+        print("serial traffic counts reset")
+        return
+    if len(args) == 0:
+        print(f"serial_stats {options.serial_stats}")
+        if serialMeter.installed():
+            serialMeter.report()
+        return
+    setBool("serial_stats", args)
+    startSerialStats()
+
+# Start or stop counting the serial traffic, to match the serial_stats option
+def startSerialStats ():
+    if not options.serial_stats:
+        serialMeter.uninstall()
+        return
+    err = serialMeter.install()
+    if err:
+        print(f"serial_stats: unable to count serial traffic -- {err}")
+        options.serial_stats = False
+
+# Turn the persistent session on or off, or show its counters
+def setSession (args):
+    if len(args) == 0:
+        print(f"session {options.session}")
+        if session:
+            session.report()
+        return
+    setBool("session", args)
+    startSession()
+
+# Start or stop the session to match the session option, once the plotter is free
+def startSession ():
+    def start ():
+        global session
+        if options.session and not session:
+            session = Session(applyOptionsToAD)
+            session.openPort(options.port)
+        elif not options.session and session:
+            session.close()
+            session = None
+    plotterWorker.whenFree("(start or stop the session)", start)
+
+# Close the session's port once the plotter is free, so the next command
+# opens the one in the options
+def reopenSession ():
+    def close ():
+        if session:
+            session.close()
+    plotterWorker.whenFree("(reopen the port)", close)
+
+def setPort (args):
+    if len(args) > 0:
+        port = argsToFileName(args)
+        options.port = None if port.lower() == firstPort else port
+        reopenSession()
+    print(f"port {options.port}")
+
+def closeSession ():
+    if session:
+        session.close()
+
 def setModel(args):
     setRangeInt("model", 1, 7, args)
     print(f"Maximum plot size is {fmtDist(xTravel[options.model])} by {fmtDist(yTravel[options.model])} {options.units}")
@@ -949,7 +2065,7 @@ def align (showMsg = True):
     rc = plotRun(cmdOpts = {"mode": "align"})
     if showMsg:     # Don't show msg if running via the 'on' command
         print("Head can now be moved manually.")
-    reply = input("Is the head at the origin (0,0)? y/n: ")
+    reply = ask("Is the head at the origin (0,0)? y/n: ", "y" if scriptPolicy and scriptPolicy["assume_aligned"] else "n")
     aligned = getBool(False, reply)
     if aligned:
         alignX = 0.0
@@ -977,190 +2093,572 @@ def cd (args):
             print("Can't change to that directory:", err)
     print(os.getcwd())
 
-def ls ():
+# List the .svg files and directories.  'ls -l' adds the estimated time, page
+# size, layers, paths and whether the drawing fits the plotter.  What needs the files to
+# be read comes from the directory index, so only new or changed files are read;
+# a plain 'ls' only stats them.
+def ls (args):
+    long = args == ["-l"]
+    if args and not long:
+        print("ls: only '-l' is allowed")
+        return
     print(f"{os.getcwd()}:")
-    with os.scandir() as entries:
-        # build list of file details for sorting
-        l = []
-        for entry in entries:
-            if entry.is_file() and entry.name.lower().endswith(".svg"):
-                l.append({"name": entry.name, "size": entry.stat().st_size, "mtime": entry.stat().st_mtime, "dirchar": ""})
-            if entry.is_dir():
-                l.append({"name": entry.name, "size": entry.stat().st_size, "mtime": entry.stat().st_mtime, "dirchar": "/"})
-        if len(l) == 0:
-            print("No plottable (.svg) files in current directory")
-            return
-        l = sorted(l, key=lambda d: d['name']) # sort by 'name' field
-        for entry in l:
-            utcmtime  = datetime.utcfromtimestamp(entry['mtime'])
-            timestamp = utcmtime.strftime("%Y-%m-%d %H:%M:%S")
-            print(f"{entry['size']:11d}  {timestamp}  {entry['name']}{entry['dirchar']}")
+    if long:
+        files, subdirs, scanned = dirIndex.refresh(os.getcwd(), lsModel())
+        if dirIndex.error:
+            print(f"ls: {dirIndex.error}")
+    else:
+        stats, subdirs = listDir(os.getcwd())
+        files = {name: {"mtime": st.st_mtime_ns, "size": st.st_size} for name, st in stats}
+        scanned = 0
+    if not files and not subdirs:
+        print("No plottable (.svg) files in current directory")
+        return
+    # build list of file details for sorting
+    l = [{"name": name, "size": st.st_size, "mtime": st.st_mtime, "dirchar": "/"} for name, st in subdirs]
+    l += [dict(entry, name=name, mtimeNs=entry["mtime"], mtime=entry["mtime"] / 1e9, dirchar="")
+          for name, entry in files.items() if entry["mtime"] is not None]
+    l = sorted(l, key=lambda d: d['name']) # sort by 'name' field
+    if long:
+        print(f"{'size':>11}  {'modified':19}  {'est time':>8}  {'page (' + options.units + ')':>17}  "
+              f"{'layers':>6}  {'paths':>6}  {'fits':4}  name")
+    for entry in l:
+        utcmtime  = datetime.utcfromtimestamp(entry['mtime'])
+        timestamp = utcmtime.strftime("%Y-%m-%d %H:%M:%S")
+        details = ""
+        if long and not entry['dirchar']:
+            details = f"{lsEstimate(entry):>8}  {lsDetails(entry)}"
+        elif long:
+            details = f"{'':8}  {'':17}  {'':6}  {'':6}  {'':4}  "
+        print(f"{entry['size']:11d}  {timestamp}  {details}{entry['name']}{entry['dirchar']}")
+    if scanned >= 1:
+        print(f"({scanned} new or changed files read)")
+
+# The estimate model for the directory index (see dirindex.py's refresh()),
+# or None without NumPy
+def lsModel ():
+    if not optimise.available():
+        return None
+    def timeParts (strokes):
+        paths = [optimise.np.array(s, dtype=float) for s in strokes]
+        return estimate.estimatePaths(paths, options.__dict__, motionParams)["parts"]
+    return estimate.modelKey(options.__dict__, motionParams), timeParts
+
+# The est time column of 'ls -l' for a file: a preview's estimate if there's
+# one for the current settings, else (marked '~') the model's estimate -- from
+# the file's plan if that's in the plan cache, else from the strokes the
+# directory index found.  Plans aren't made just for a listing -- that's as
+# slow as 'estimate' on the whole folder.
+def lsEstimate (entry):
+    path = os.path.abspath(entry['name'])
+    # The index has the file's hash, so the estimate cache needn't read it
+    if entry['hash']:
+        estimateCache.remember(path, entry['mtimeNs'], entry['size'], entry['hash'])
+    previewed = estimateCache.get(path, estimateKeyOpts(usePlans()))
+    if previewed:
+        return batch.fmtTime(previewed['time'])
+    if not optimise.available():
+        return "-"
+    plan = planCache.peek(planCache.key(path, options.__dict__, None))
+    if plan is not None:
+        return "~" + batch.fmtTime(estimate.estimatePlan(plan, options.__dict__, motionParams, calibration.factors)["time"])
+    if entry.get('model'):
+        return "~" + batch.fmtTime(sum(f * t for f, t in zip(calibration.factors, entry['model']['parts'])))
+    return "-"
+
+# The page size, layers, paths and fit columns of 'ls -l' for a file
+def lsDetails (entry):
+    if entry['error']:
+        return f"{'(' + entry['error'] + ')':>17}  {'':6}  {'':6}  {'':4}  "
+    page = f"{fmtDist(entry['page'][0])} x {fmtDist(entry['page'][1])}" if entry['page'] else "-"
+    if entry['bbox'] is None:
+        fits = "-"
+    else:
+        fits = "yes" if boxFits(entry['bbox'], entry['page'], maxX(), maxY(), options.auto_rotate) else "NO"
+    return f"{page:>17}  {entry['layers']:6d}  {entry['paths']:6d}  {fits:4}  "
 
 def restoreCWD ():
     os.chdir(origDir)
 
-def initOptions ():
-    # Setup options from AD's default config and our own config files
-    ad = axidraw.AxiDraw()
-    ad.plot_setup()                 # Go into plot mode and create ad.options
-    print(f"initOptions: {ad.bounds=}")
+def initOptions (configFiles):
+    # Setup options from AD's default config and our own config files.
+    # AD's defaults come from the snapshot if it's up to date (see defaultscache.py).
+    # The snapshot also keeps the params the estimate model uses
+    defaultsCache = DefaultsCache(defaultCacheDir(), userOpts, addlOpts + list(estimate.defaultParams))
+    defaults = defaultsCache.load()
+    if defaults is None:
+        from pyaxidraw import axidraw
+        startupStep("import pyaxidraw")
+        ad = axidraw.AxiDraw()
+        ad.plot_setup()                 # Go into plot mode and create ad.options
+        defaultsCache.save(ad, getattr(axidraw, "__version__", ""))
+        defaults = {"options": ad.options.__dict__,
+                    "params": ad.params.__dict__,
+                    "version": getattr(axidraw, "__version__", "")}
+        startupStep("read default options")
+    else:
+        startupStep("read saved default options")
     # Copy initial ad.options into local options
-    options.setFromParams(ad.params.__dict__)
-    # User options override params:
-    options.setFromOptions(ad.options.__dict__)
-
-    if len(sys.argv[1:]) == 0:
+    options.setFromParams(defaults["params"])
+    # User options override params.  Options that mean something else to
+    # interaxi (e.g. units) are left alone.
+    options.setFromOptions({key: val for key, val in defaults["options"].items() if key not in localOpts})
+    estimateCache.version = defaults["version"]
+    motionParams.update(defaults["params"])
+
+    if len(configFiles) == 0:
         # Load default config file
         loadConfig([defaultConfigFile], True)
     else:
         # Load config files from command line 
-        for arg in sys.argv[1:]:
-            loadConfig(arg, True)
+        for arg in configFiles:
+            loadConfig([arg], True)
     # Make sure preview option is not set -- it interferes with some modes,
     # and we use it a bit differently (see plotFile()).
     options.preview = False
+    startupStep("load config files")
+
+# Times taken by each step of starting up, for --profile-startup
+startupSteps = []
+startupLast = startupStart
+
+def startupStep (label):
+    global startupLast
+    now = time.perf_counter()
+    startupSteps.append((label, now - startupLast))
+    startupLast = now
+
+# Seconds since the process started (including the Python interpreter's own
+# startup), or None if that can't be found.
+def processAge ():
+    try:
+        with open("/proc/self/stat") as f:
+            # starttime is field 22; fields after the command name start at 3
+            started = int(f.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as f:
+            return float(f.read().split()[0]) - started
+    except (OSError, ValueError, IndexError):
+        return None
+
+def printStartupProfile ():
+    print("Startup profile:")
+    for label, seconds in startupSteps:
+        print(f"  {label:<24} {seconds * 1000:8.1f} ms")
+    print(f"  {'total (from import)':<24} {(startupLast - startupStart) * 1000:8.1f} ms")
+    age = processAge()
+    if age is not None:
+        print(f"  {'total (from launch)':<24} {age * 1000:8.0f} ms")
+    print(f"  {len(sys.modules)} modules loaded; pyaxidraw {'is' if 'pyaxidraw' in sys.modules else 'not'} loaded, "
+          f"curtsies {'is' if 'curtsies' in sys.modules else 'not'} loaded")
+
+def parseArgs ():
+    parser = argparse.ArgumentParser(description="interaxi -- interactive AxiDraw frontend")
+    parser.add_argument("config", nargs="*",
+            help=f"configuration file(s) to load (default {defaultConfigFile})")
+    parser.add_argument("--preview", nargs="+", metavar="FILES",
+            help="preview the given files, globs or directories, print the estimates, and exit")
+    parser.add_argument("--estimate", nargs="+", metavar="FILES",
+            help="estimate the times for the given files, globs or directories without previewing them "
+                 "(see the estimate command), print the estimates, and exit")
+    parser.add_argument("--format", choices=list(batch.formats), default="table",
+            help="format for --preview or --estimate results (default table)")
+    parser.add_argument("--results", metavar="FILE",
+            help="write --preview or --estimate results to FILE instead of the console")
+    parser.add_argument("--jobs", type=int, metavar="N",
+            help="number of previews (or plans) to make in parallel (default: one per CPU)")
+    parser.add_argument("--profile-startup", action="store_true",
+            help="show how long each step of starting up took")
+    parser.add_argument("--batch", metavar="SCRIPT",
+            help="run the commands in SCRIPT ('-' for standard input) without prompting, and exit; "
+                 "the exit status is the worst error code seen.  Also used if standard input isn't a terminal")
+    parser.add_argument("--port", metavar="NAME",
+            help="use the plotter on this port or nickname ('none' for the first found), "
+                 "whatever the config files say")
+    parser.add_argument("--assume-aligned", action="store_true",
+            help="in a script, answer yes when asked if the head is at the origin")
+    parser.add_argument("--on-pause", choices=["resume", "cancel", "wait-button"], default="cancel",
+            help="in a script, what to do when a plot is paused (default cancel)")
+    parser.add_argument("--between-copies", choices=["delay", "wait-button"], default="delay",
+            help="in a script, wait page_delay seconds between copies, or for the plotter's button (default delay)")
+    return parser.parse_args()
+
+# Raised by the quit command to leave the REPL
+class QuitREPL (Exception):
+    pass
+
+def quitREPL (args):
+    raise QuitREPL()
+
+# Run one command line.  where is the script and line number, for messages.
+# Returns False if it was the quit command.
+def runLine (line, where=""):
+    cmd, args = parse(line)
+    command, err = commands.match(cmd)
+    if command is None:
+        print(f"{where}{err}")
+        if scriptPolicy:
+            noteRC(2)
+        return True
+    return dispatch(command, args)
+
+# Run a command's handler, timing it and (unless countSerial is False,
+# because something else is using the plotter) counting its serial traffic.
+# Returns False if it was the quit command.
+def dispatch (command, args, countSerial=True):
+    before = serialMeter.snapshot()
+    try:
+        with counters.timer("command", command.name()):
+            command.handler(args)
+    except QuitREPL:
+        return False
+    finally:
+        if serialMeter.installed() and countSerial:
+            noteSerial(command.name(), serialMeter.since(before))
+    return True
+
+# Add an interaxi command's serial traffic to the totals, and the stats
+def noteSerial (name, traffic):
+    if not traffic.trips():
+        return
+    serialMeter.note(name, traffic)
+    counters.count("serial_commands", traffic.commands)
+    counters.count("serial_queries", traffic.queries)
+    counters.count("serial_bytes_out", traffic.bytesOut)
+    counters.count("serial_bytes_in", traffic.bytesIn)
+
+# Run the commands in a script file (or standard input if '-'), answering
+# any questions as the policy says rather than asking.  Blank lines and lines
+# starting with '#' are skipped.  Returns the worst error code seen.
+def runScript (filename, policy):
+    global scriptPolicy
+    scriptPolicy = policy
+    try:
+        f = sys.stdin if filename == "-" else open(os.path.expanduser(filename))
+    except OSError as err:
+        print(f"Unable to read script '{filename}': {err.strerror}")
+        return 2
+    name = "stdin" if filename == "-" else filename
+    # The head isn't moved to check where it is -- the policy says
+    global aligned, alignX, alignY
+    if policy["assume_aligned"]:
+        aligned = True
+        alignX = 0.0
+        alignY = 0.0
+        setHome()
+    with f:
+        for lineNo, line in enumerate(f, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            if not runLine(line, f"{name}:{lineNo}: "):
+                break
+    print(f"done (exit status {worstRC})")
+    return worstRC
+
+# Commands that use the plotter, which the REPL runs in the background (see PlotterWorker).
+# Previews, estimates and listings go there too: they share the plot state,
+# the plan cache and the layer index with plots, which aren't thread-safe.
+# Option commands (including port, session and profile) stay on the console;
+# what they do to the session waits for the worker (see whenFree()).
+plotterCmds = {"align", "cycle", "down", "estimate", "fw_version", "home", "layers", "ls", "off", "on",
+               "plancache", "plot", "preview", "sethome", "stream", "sysinfo", "toggle", "up", "version",
+               "walkx", "walky"}
+# Commands that can't be used while the plotter is busy: register needs the
+# keyboard, and cd would change what queued commands' file names mean
+consoleCmds = {"cd", "register"}
+
+def runsOnPlotter (command, args):
+    if command.name() == "queue":
+        # With devices, the queue runs in the event loop (see runDevices())
+        return len(args) > 0 and "run".startswith(args[0].lower()) and not scheduler.devices
+    if command.name() == "device":
+        return len(args) > 0 and "use".startswith(args[0].lower())
+    return command.name() in plotterCmds
+
+# Read lines from the console on a thread of its own, passing them to the
+# event loop (None for Ctrl-D).  The next line isn't read until the last one
+# has been dealt with, so that the prompt comes after the output, and so
+# that foreground commands can use input() themselves.
+def consoleReader (loop, lines, ready):
+    while True:
+        ready.wait()
+        ready.clear()
+        try:
+            line = input("> ")
+        except EOFError:
+            line = None
+        loop.call_soon_threadsafe(lines.put_nowait, line)
+
+# Wait for a background command to finish, and say so if it took a while
+async def background (line, future):
+    try:
+        seconds = await future
+    except Exception:
+        print(f"\n'{line}' failed:")
+        traceback.print_exc()
+        return
+    if seconds > 5:
+        print(f"\n'{line}' finished after {batch.fmtTime(seconds)}")
+
+# The REPL.  Commands that use the plotter are queued on the worker, and the
+# rest are run straight away.  While a background command is waiting for an
+# answer, the next line typed is the answer.
+async def repl ():
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue()
+    ready = threading.Event()
+    ready.set()
+    threading.Thread(target=consoleReader, args=(loop, lines, ready), daemon=True).start()
+    while True:
+        line = await lines.get()
+        if line is None:
+            # Ctrl-D pressed
+            if not plotterWorker.busy() and not scheduler.running:
+                print("\ndone (Ctrl-D pressed)")
+                break
+            print("\nThe plotter is busy -- wait for it to finish (see 'status')")
+            ready.set()
+            continue
+        if plotterWorker.question is not None:
+            plotterWorker.answer(line)
+            ready.set()
+            continue
+        cmd, args = parse(line)
+        command, err = commands.match(cmd)
+        if command is None:
+            print(err)
+        elif runsOnPlotter(command, args):
+            if plotterWorker.busy():
+                print(f"(after '{plotterWorker.jobs[-1]}')")
+            future = plotterWorker.submit(line.strip(), lambda: dispatch(command, args))
+            task = asyncio.create_task(background(line.strip(), future))
+            backgroundTasks.add(task)
+            task.add_done_callback(backgroundTasks.discard)
+        elif plotterWorker.busy() and (command.name() in consoleCmds or command.name() == "quit"):
+            print(f"{command.name()}: the plotter is busy -- wait for it to finish (see 'status')")
+        elif scheduler.running and command.name() == "quit":
+            print("quit: the devices are plotting -- 'queue pause' and wait for them to finish (see 'status')")
+        elif not dispatch(command, args, countSerial=not plotterWorker.busy()):
+            print("done")
+            break
+        ready.set()
+
+def showStatus ():
+    plotterWorker.report()
+    if jobQueue.jobs or jobQueue.running:
+        state = "running" if jobQueue.running else "paused" if jobQueue.paused else "waiting"
+        print(f"queue: {len(jobQueue)} job(s), {state}")
+    if scheduler.devices:
+        print("devices:")
+        scheduler.list()
+    showPos()
+
+def motorsOn ():
+    align(False)
+    print("motors are on")
+
+def motorsOff ():
+    manual("disable_xy")
+    print("motors are off")
+
+# Tab completion of command names and file names (see commands.py)
+completions = []
+def completer (text, state):
+    global completions
+    if state == 0:
+        before = readline.get_line_buffer()[:readline.get_begidx()]
+        completions = commands.completions(before, text)
+    return completions[state] if state < len(completions) else None
+
+def setupCompletion ():
+    if not readline:
+        return
+    readline.set_completer(completer)
+    readline.set_completer_delims(" \t\n")
+    if "libedit" in (readline.__doc__ or ""):
+        readline.parse_and_bind("bind ^I rl_complete")  # macOS
+    else:
+        readline.parse_and_bind("tab: complete")
+
+# All the commands.  The first name is the main one; the rest are alternatives.
+commands = CommandTable()
+add = commands.add
+add("accel", lambda args: setRangeInt("accel", 1, 100, args), "<1-100>",
+    "Set the acceleration, as a percentage of the maximum.")
+add("align", lambda args: align(), "",
+    "Turn the motors off so the head can be moved to the origin by hand.")
+add("auto_rotate", lambda args: setBool("auto_rotate", args), "<y/n>",
+    "Rotate portrait drawings to fit the plotter.")
+add("cd", cd, "<directory>",
+    "Change the current directory.")
+add("const_speed", lambda args: setBool("const_speed", args), "<y/n>",
+    "Draw at a constant speed rather than accelerating.")
+add("copies|cop|copi|copie", lambda args: setRangeInt("copies", 0, 9999, args), "<0-9999>",
+    "Set the number of copies that plot makes.")
+add("copies_auto", lambda args: setBool("copies_auto", args), "<y/n>",
+    "Start each copy after page_delay seconds instead of waiting for Enter.")
+add("cycle", lambda args: runMode("cycle"), "",
+    "Lower and then raise the pen.")
+add("delaydown|pen_delay_down", lambda args: setRangeInt("pen_delay_down", 0, 10000, args), "<ms>",
+    "Set the extra delay after lowering the pen.")
+add("delaypage|page_delay", lambda args: setRangeInt("page_delay", 0, 10000, args), "<s>",
+    "Set the delay between copies in an automatic queue.")
+add("delayup|pen_delay_up", lambda args: setRangeInt("pen_delay_up", 0, 10000, args), "<ms>",
+    "Set the extra delay after raising the pen.")
+add("device", deviceCmd, "[add <name> <port> [<profile>]|drop <name>|ready <name>|all|hold <name>|all|use <name>]",
+    "Add plotters to share the queue, and say when each is ready.")
+add("digest", lambda args: setRangeInt("digest", 0, 2, args), "<0|1|2>",
+    "Set the output file format: 0 SVG, 1 plob, 2 plob without plotting.")
+add("down|lower_pen", lambda args: manual("lower_pen"), "",
+    "Lower the pen.")
+add("estcache", setEstimateCache, "[clear]",
+    "Show or clear the saved preview estimates.")
+add("estimate", estimateCmd, "<filename> [<layer>] | <directory>|<glob> [json|csv <filename>] | calibrate <files> | calibration [reset]",
+    "Estimate the plot time quickly from the plan, without a preview.")
+add("fw_version", lambda args: manual("fw_version"), "",
+    "Display the plotter's firmware version.")
+add("help", commands.printHelp, "[<command>]",
+    "List the commands, or show how to use one.")
+add("hiding", lambda args: setBool("hiding", args), "<y/n>",
+    "Turn hidden line removal on or off.")
+add("home|walk_home|walk", lambda args: walkHome(), "",
+    "Move the head to the home position.")
+add("layers", showLayers, "<filename>",
+    "List the layers in a file, with their sizes.")
+add("ls", ls, "[-l]",
+    "List the .svg files in the current directory.")
+add("min_gap", setMinGap, "[<dist>]",
+    "Set the largest gap between paths that's drawn without lifting the pen.")
+add("model", setModel, "[<num>]",
+    "Set the AxiDraw model number.")
+add("off|disable_xy", lambda args: motorsOff(), "",
+    "Turn the motors off.")
+add("on|enable_xy|e", lambda args: motorsOn(), "",
+    "Turn the motors on, with the head's position as home.")
+add("optimise", setOptimise, "[<seconds>]",
+    "Set the time spent reordering paths to cut pen-up travel (0 for none).")
+add("options|config|op|opt|opti", lambda args: optionsChanged(loadConfig(args)), "[<filename>]",
+    "Load a configuration file, or display the current options.")
+add("output", setOutputFilename, "[<filename>]",
+    "Set the file the output of plot or preview is saved in (none, auto, or a file name).")
+add("plancache", setPlanCache, "[<MB>|clear]",
+    "Set the memory kept for processed plans, or clear them.")
+add("plot|pl", lambda args: plotCopies(args), "<filename> [<layer>]",
+    "Plot a file, or one layer of it.")
+add("port", setPort, "[<name>|none]",
+    "Set the USB port or nickname of the plotter to use.")
+add("posdown|pen_pos_down", lambda args: setRangeInt("pen_pos_down", 0, 100, args), "<0-100>",
+    "Set the pen-down height.")
+add("position", lambda args: showPos(), "",
+    "Display the head's position.")
+add("posup|pen_pos_up", lambda args: setRangeInt("pen_pos_up", 0, 100, args), "<0-100>",
+    "Set the pen-up height.")
+add("preview|pr", preview, "<filename> [<layer>] | <directory>|<glob> [json|csv <filename>]",
+    "Estimate the plot time for a file, or for many files at once.")
+add("profile", profileCmd, "[<name>|save <name>]",
+    "Switch to a saved profile, or save the current options as one.")
+add("queue", queueCmd, "[add <filename> [<layer>|all] [<copies>]|list|run|pause|drop [<n>|all]|auto <y/n>]",
+    "Manage the queue of plot jobs.")
+add("quit|q|qu", quitREPL, "",
+    "Leave interaxi.")
+add("random_start", lambda args: setBool("random_start", args), "<y/n>",
+    "Start closed paths at random points.")
+add("ratedown|pen_rate_lower", lambda args: setRangeInt("pen_rate_lower", 1, 100, args), "<1-100>",
+    "Set how fast the pen is lowered.")
+add("rateup|pen_rate_raise", lambda args: setRangeInt("pen_rate_raise", 1, 100, args), "<1-100>",
+    "Set how fast the pen is raised.")
+add("register", lambda args: registerXY(), "",
+    "Move the head with the arrow keys.")
+add("rendering", lambda args: setRangeInt("rendering", 0, 3, args), "<0-3>",
+    "Set what the preview draws in the output file.")
+add("reordering", lambda args: setRangeInt("reordering", 0, 4, args), "<0-4>",
+    "Set how pyaxidraw reorders paths.")
+add("save", saveConfig, "[<filename>]",
+    "Save the current options as a configuration file.")
+add("serial_stats", setSerialStats, "[<y/n>|reset]",
+    "Count the serial commands, queries, bytes and waiting for each command and plot.")
+add("session", setSession, "[<y/n>]",
+    "Keep the plotter connection open between commands.")
+add("sethome|se", lambda args: setHome(), "",
+    "Make the head's position the home position.")
+add("speeddown|speed_pendown|sd", lambda args: setRangeInt("speed_pendown", 1, 100, args), "<1-100>",
+    "Set the pen-down speed.")
+add("speedup|speed_penup|su", lambda args: setRangeInt("speed_penup", 1, 100, args), "<1-100>",
+    "Set the pen-up speed.")
+add("status", lambda args: showStatus(), "",
+    "Show what the plotter is doing, the queue, and the head's position.")
+add("stats", statsCmd, "[reset|file <filename>|none|interval <seconds>|write <filename>]",
+    "Show counts and timings of commands and plots, or write them to a file regularly.")
+add("stream", streamFile, "<filename>",
+    "Plot a very large file a layer at a time.")
+add("stream_mb", setStreamBudget, "[<MB>]",
+    "Set the memory budget for stream.")
+add("sysinfo", lambda args: runMode("sysinfo"), "",
+    "Display information about the plotter and software.")
+add("toggle", lambda args: runMode("toggle"), "",
+    "Raise the pen if it's down, or lower it if it's up.")
+add("units", setUnits, "<mm>|<inches>",
+    "Set the units for distances.")
+add("up|raise_pen", lambda args: manual("raise_pen"), "",
+    "Raise the pen.")
+add("version", lambda args: runMode("version"), "",
+    "Display the pyaxidraw version.")
+add("walkx|x", lambda args: walk("x", args), "<distance>",
+    "Move the head along the x axis.")
+add("walky|y", lambda args: walk("y", args), "<distance>",
+    "Move the head along the y axis.")
+#add("margin", setMargin, "[<dist>]")
+#add("paper", setPaper, "[<papersize>]")
+#add("report_time", lambda args: setBool("report_time", args), "<y/n>")
+#add("report_lifts", lambda args: setBool("report_lifts", args), "<y/n>")
+del add
 
 ##########################################################################################
 
 def main():
 
+    startupStep("import interaxi modules")
+    args = parseArgs()
+
     signal.signal(signal.SIGINT, handleSigint)
 
-    initOptions()
+    initOptions(args.config)
+    if args.port is not None:
+        options.port = None if args.port.lower() == firstPort else args.port
+
+    if args.preview:
+        # Headless batch preview
+        sys.exit(previewMany(args.preview, args.format, args.results, args.jobs))
+    if args.estimate:
+        sys.exit(estimateMany(args.estimate, args.format, args.results, args.jobs))
+
+    startSession()
+    planCache.setLimit(options.plan_cache_mb * 1000000)
+    startupStep("start session")
+    startStatsDump()
+    atexit.register(statsDumper.stop)
+    startSerialStats()
+
+    if args.profile_startup:
+        printStartupProfile()
+
+    if args.batch or not sys.stdin.isatty():
+        atexit.register(restoreCWD)
+        atexit.register(closeSession)
+        sys.exit(runScript(args.batch or "-", {
+            "assume_aligned": args.assume_aligned,
+            "on_pause": args.on_pause,
+            "between_copies": args.between_copies}))
 
     # Get user to check position of pen
     align()
 
     loadHistory()
+    setupCompletion()
     atexit.register(saveHistory)
     atexit.register(restoreCWD)
+    atexit.register(closeSession)
 
-    # REPL
-    while True:
-        try:
-            line = input("> ")  # .decode('utf-8').strip()
-        except EOFError:
-            # Ctrl-D pressed
-            print("\ndone (Ctrl-D pressed)")
-            break
-        cmd, args = parse(line)
-        shortCmd = miniMatch(cmd)
-        if not shortCmd:
-            continue
-        if shortCmd == "he":
-            printHelp()
-        elif shortCmd == "qu":
-            print("done")
-            break   # out of the while loop
-        elif shortCmd == "cy":
-            #options.mode = "cycle"
-            #rc = plotRun()
-            runMode("cycle")
-        elif shortCmd == "al":
-            align()
-        elif shortCmd == "vr":
-            #options.mode = "version"
-            #rc = plotRun()
-            runMode("version")
-        elif shortCmd == "sy":
-            #options.mode = "sysinfo"
-            #rc = plotRun()
-            runMode("sysinfo")
-        elif shortCmd == "tg":
-            #options.mode = "toggle"
-            #rc = plotRun()
-            runMode("toggle")
-        elif shortCmd == "un":
-            setUnits(args)
-        elif shortCmd == "wx":
-            walk("x", args)
-        elif shortCmd == "wy":
-            walk("y", args)
-        elif shortCmd == "wh":
-            walkHome()
-        elif shortCmd == "fw":
-            manual("fw_version")
-        elif shortCmd == "hi":
-            setBool("hiding", args)
-        elif shortCmd == "up":
-            manual("raise_pen")
-        elif shortCmd == "do":
-            manual("lower_pen")
-        elif shortCmd == "on":
-            align(False);
-            print("motors are on")
-        elif shortCmd == "of":
-            manual("disable_xy")
-            print("motors are off")
-        elif shortCmd == "pt":
-            plotCopies(args)
-        elif shortCmd == "pv":
-            plotFile(args, preview=True)
-        elif shortCmd == "op":
-            loadConfig(args)
-        elif shortCmd == "ou":
-            setOutputFilename(args)
-        elif shortCmd == "mo":
-            setModel(args)
-        elif shortCmd == "sd":
-            setRangeInt("speed_pendown", 1, 100, args)
-        elif shortCmd == "su":
-            setRangeInt("speed_penup", 1, 100, args)
-        elif shortCmd == "ac":
-            setRangeInt("accel", 1, 100, args)
-        elif shortCmd == "pd":
-            setRangeInt("pen_pos_down", 0, 100, args)
-        elif shortCmd == "pu":
-            setRangeInt("pen_pos_up", 0, 100, args)
-        elif shortCmd == "pl":
-            setRangeInt("pen_rate_lower", 1, 100, args)
-        elif shortCmd == "pr":
-            setRangeInt("pen_rate_raise", 1, 100, args)
-        elif shortCmd == "dd":
-            setRangeInt("pen_delay_down", 0, 10000, args)
-        elif shortCmd == "du":
-            setRangeInt("pen_delay_up", 0, 10000, args)
-        elif shortCmd == "dg":
-            setRangeInt("digest", 0, 2, args)
-        elif shortCmd == "dp":
-            setRangeInt("page_delay", 0, 10000, args)
-        elif shortCmd == "rn":
-            setRangeInt("rendering", 0, 3, args)
-        elif shortCmd == "ro":
-            setRangeInt("reordering", 0, 4, args)
-        elif shortCmd == "cp":
-            setRangeInt("copies", 0, 9999, args)
-        elif shortCmd == "rd":
-            setBool("random_start", args)
-        #elif shortCmd == "rp":
-        #    setBool("report_time", args)
-        #elif shortCmd == "rl":
-        #    setBool("report_lifts", args)
-        elif shortCmd == "cs":
-            setBool("const_speed", args)
-        elif shortCmd == "au":
-            setBool("auto_rotate", args)
-        elif shortCmd == "rg":
-            registerXY()
-        elif shortCmd == "po":
-            showPos()
-        elif shortCmd == "sh":
-            setHome()
-        elif shortCmd == "sc":
-            saveConfig(args)
-        elif shortCmd == "cd":
-            cd(args)
-        elif shortCmd == "ls":
-            ls()
-        elif shortCmd == "mg":
-            setMinGap(args)
-        #elif shortCmd == "pa":
-        #    setPaper(args)
-        #elif shortCmd == "ma":
-        #    setMargin(args)
-
-        else:
-            print(f"Short command '{shortCmd}' ('{cmd}') is not known.")
+    asyncio.run(repl())
 
     # end of REPL loop
 
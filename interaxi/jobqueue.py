@@ -0,0 +1,81 @@
+# interaxi -- interactive AxiDraw frontend.
+# Queue of plot jobs to be run one after another.
+
+# NOTES:
+# * A job is a file, an optional layer, and a number of copies.
+# * 'auto' jobs run on to the next copy or job after waiting page_delay
+#   seconds; other jobs wait for the user to press Enter.
+# * Running the jobs is done by the caller (see runQueue() in interaxi.py);
+#   this just keeps track of them.
+# * With several plotters (see devices.py), copies are take()n one at a
+#   time, so several can be plotted at once, and put back if they fail.
+
+class Job:
+    def __init__ (self, filename, layer=None, copies=1, auto=False):
+        self.filename = filename
+        self.layer = layer
+        self.copies = copies    # copies still to do
+        self.done = 0           # copies done so far
+        self.auto = auto
+        self.sizeChecked = False    # True once the user has been warned if it doesn't fit
+
+    def __repr__ (self):
+        layer = "all layers" if self.layer is None else f"layer {self.layer}"
+        gap = "auto" if self.auto else "prompt"
+        return f"'{self.filename}' {layer}, {self.done} of {self.done + self.copies} copies done ({gap})"
+
+class JobQueue:
+    def __init__ (self):
+        self.jobs = []
+        self.paused = False     # True to stop after the current copy
+        self.running = False
+
+    def __len__ (self):
+        return len(self.jobs)
+
+    def add (self, job):
+        self.jobs.append(job)
+        return len(self.jobs)
+
+    # Remove job n (counting from 1); returns the job, or None if there's no such job
+    def drop (self, n):
+        if n < 1 or n > len(self.jobs):
+            return None
+        return self.jobs.pop(n - 1)
+
+    def clear (self):
+        self.jobs.clear()
+
+    def next (self):
+        return self.jobs[0] if self.jobs else None
+
+    # Record that a copy of the first job has been done, removing the job if it's finished
+    def copyDone (self):
+        job = self.jobs[0]
+        job.copies -= 1
+        job.done += 1
+        if job.copies <= 0:
+            self.jobs.pop(0)
+
+    # Take a copy of the first job to plot, removing the job once all its copies are taken
+    def take (self):
+        job = self.jobs[0]
+        job.copies -= 1
+        if job.copies <= 0:
+            self.jobs.pop(0)
+        return job
+
+    # Put back a copy that wasn't done, at the front of the queue
+    def putBack (self, job):
+        job.copies += 1
+        if job not in self.jobs:
+            self.jobs.insert(0, job)
+
+    def list (self):
+        if not self.jobs:
+            print("queue is empty")
+            return
+        for n, job in enumerate(self.jobs, 1):
+            print(f"{n:3d}  {job}")
+        if self.paused:
+            print("queue is paused")
@@ -0,0 +1,461 @@
+# interaxi -- interactive AxiDraw frontend.
+# Index of the layers in an SVG file, made in one pass without loading the document.
+
+# NOTES:
+# * Layers are top-level groups with inkscape:groupmode="layer".  As in
+#   pyaxidraw, a layer's number is the whole number at the start of its
+#   name, a name starting with '%' is a documentation layer (never
+#   plotted), and a leading '!' means pause before the layer.  Sublayers
+#   are just groups.  Hidden layers and groups aren't plotted.
+# * Bounding boxes are in inches from the top left of the page, after
+#   transforms.  Curves are bounded exactly; arcs are sampled.  Elements
+#   that are only drawn by reference (defs, symbols, etc.) and text are
+#   not counted.
+# * The scan can't know everything pyaxidraw will do (e.g. clones), so
+#   it's a quick check for obvious mistakes, not a replacement for a preview.
+# * The scan can also keep the drawing's strokes, as polylines in inches, for a
+#   rough time estimate (see estimate.py).  Curves are cut into a few
+#   straight pieces, so the lengths are a little short.
+# * Indexes are kept in memory, keyed by the file's path, mtime and size.
+
+from collections import OrderedDict
+import math
+import os
+import re
+import time
+
+from . import svginfo
+
+# Elements whose contents aren't drawn directly
+skipTags = {"clipPath", "defs", "desc", "marker", "mask", "metadata", "namedview",
+            "pattern", "style", "symbol", "title"}
+tokenRE = re.compile(r"[A-Za-z]|[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?")
+transformRE = re.compile(r"([a-zA-Z]+)\s*\(([^)]*)\)")
+numberRE = re.compile(r"[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?")
+identity = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)   # a b c d e f, as in SVG's matrix()
+arcSamples = 16
+
+class Layer:
+    def __init__ (self, name, number=None, pause=False, documentation=False, hidden=False):
+        self.name = name
+        self.number = number        # None if the name doesn't start with a number
+        self.pause = pause
+        self.documentation = documentation
+        self.hidden = hidden
+        self.paths = 0
+        self.segments = 0
+        self.bbox = None            # (x0, y0, x1, y1) inches, or None if empty
+
+    # Will pyaxidraw plot this layer (in plot mode)?
+    def plotted (self):
+        return not (self.documentation or self.hidden)
+
+class LayerIndex:
+    def __init__ (self, filename):
+        self.filename = filename
+        self.size = None            # document (width, height) in inches, if known
+        self.layers = []
+        self.loose = Layer("(outside layers)")  # drawing that isn't in any layer
+        self.strokes = []           # polylines in plotted order, if kept (see scanFile)
+        self.seconds = 0.0          # time taken to scan
+
+    def numbers (self):
+        return sorted({l.number for l in self.layers if l.number is not None and l.plotted()})
+
+    # Bounding box of what would be plotted for layer (None means all layers)
+    def bbox (self, layer=None):
+        if layer is None:
+            parts = [l for l in self.layers if l.plotted()] + [self.loose]
+        else:
+            parts = [l for l in self.layers if l.number == layer and l.plotted()]
+        return unionBox(*(l.bbox for l in parts))
+
+def unionBox (*boxes):
+    boxes = [b for b in boxes if b is not None]
+    if not boxes:
+        return None
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+# True if the box (inches) is within the plotter's travel.  pyaxidraw turns
+# portrait documents sideways if autoRotate, so the travel is swapped for them.
+def boxFits (box, size, xTravel, yTravel, autoRotate=True):
+    if box is None:
+        return True
+    tolerance = 0.001
+    if autoRotate and size and size[1] > size[0]:
+        xTravel, yTravel = yTravel, xTravel
+    return (box[0] >= -tolerance and box[1] >= -tolerance
+            and box[2] <= xTravel + tolerance and box[3] <= yTravel + tolerance)
+
+# Layer number, pause and documentation flags from a layer's name, as pyaxidraw sees them
+def parseLayerName (name):
+    name = name.strip()
+    if name.startswith("%"):
+        return None, False, True
+    pause = name.startswith("!")
+    if pause:
+        name = name[1:].lstrip()
+    m = re.match(r"[0-9]+", name)
+    return (int(m.group()) if m else None), pause, False
+
+def multiply (m, n):
+    # m then n, i.e. the point is transformed by n first
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = n
+    return (a * A + c * B, b * A + d * B,
+            a * C + c * D, b * C + d * D,
+            a * E + c * F + e, b * E + d * F + f)
+
+def parseTransform (text):
+    m = identity
+    for name, args in transformRE.findall(text or ""):
+        v = [float(x) for x in numberRE.findall(args)]
+        if name == "matrix" and len(v) == 6:
+            t = tuple(v)
+        elif name == "translate" and v:
+            t = (1, 0, 0, 1, v[0], v[1] if len(v) > 1 else 0)
+        elif name == "scale" and v:
+            t = (v[0], 0, 0, v[1] if len(v) > 1 else v[0], 0, 0)
+        elif name == "rotate" and v:
+            r = math.radians(v[0])
+            cos, sin = math.cos(r), math.sin(r)
+            t = (cos, sin, -sin, cos, 0, 0)
+            if len(v) == 3:
+                t = multiply(multiply((1, 0, 0, 1, v[1], v[2]), t), (1, 0, 0, 1, -v[1], -v[2]))
+        elif name == "skewX" and v:
+            t = (1, 0, math.tan(math.radians(v[0])), 1, 0, 0)
+        elif name == "skewY" and v:
+            t = (1, math.tan(math.radians(v[0])), 0, 1, 0, 0)
+        else:
+            continue
+        m = multiply(m, t)
+    return m
+
+# Transform a box by m, giving the box around the transformed corners
+def transformBox (m, box):
+    a, b, c, d, e, f = m
+    x0, y0, x1, y1 = box
+    xs = [a * x + c * y + e for x, y in ((x0, y0), (x1, y0), (x0, y1), (x1, y1))]
+    ys = [b * x + d * y + f for x, y in ((x0, y0), (x1, y0), (x0, y1), (x1, y1))]
+    return min(xs), min(ys), max(xs), max(ys)
+
+def transformPoints (m, points):
+    a, b, c, d, e, f = m
+    return [(a * x + c * y + e, b * x + d * y + f) for x, y in points]
+
+def isHidden (elem):
+    style = (elem.get("style") or "").replace(" ", "")
+    return (elem.get("display") == "none" or elem.get("visibility") == "hidden"
+            or "display:none" in style or "visibility:hidden" in style)
+
+# Values of t in (0, 1) where a Bezier curve (2 or 3 degree, one axis) turns
+def bezierExtrema (p):
+    if len(p) == 3:
+        denom = p[0] - 2 * p[1] + p[2]
+        return [(p[0] - p[1]) / denom] if denom else []
+    a = -p[0] + 3 * p[1] - 3 * p[2] + p[3]
+    b = 2 * (p[0] - 2 * p[1] + p[2])
+    c = p[1] - p[0]
+    if abs(a) < 1e-12:
+        return [-c / b] if b else []
+    disc = b * b - 4 * a * c
+    if disc < 0:
+        return []
+    root = math.sqrt(disc)
+    return [(-b + root) / (2 * a), (-b - root) / (2 * a)]
+
+def bezierPoint (p, t):
+    if len(p) == 3:
+        return (1 - t) ** 2 * p[0] + 2 * (1 - t) * t * p[1] + t * t * p[2]
+    return (1 - t) ** 3 * p[0] + 3 * (1 - t) ** 2 * t * p[1] + 3 * (1 - t) * t * t * p[2] + t ** 3 * p[3]
+
+# Points on the curve that bound it: the end and any turning points
+def bezierBounds (xs, ys):
+    points = [(xs[-1], ys[-1])]
+    for t in bezierExtrema(xs) + bezierExtrema(ys):
+        if 0 < t < 1:
+            points.append((bezierPoint(xs, t), bezierPoint(ys, t)))
+    return points
+
+# Points along an elliptical arc (SVG endpoint parameterisation)
+def arcPoints (x0, y0, rx, ry, angle, large, sweep, x1, y1):
+    rx, ry = abs(rx), abs(ry)
+    if rx == 0 or ry == 0 or (x0, y0) == (x1, y1):
+        return [(x1, y1)]
+    phi = math.radians(angle)
+    cos, sin = math.cos(phi), math.sin(phi)
+    dx, dy = (x0 - x1) / 2, (y0 - y1) / 2
+    x1p, y1p = cos * dx + sin * dy, -sin * dx + cos * dy
+    scale = (x1p / rx) ** 2 + (y1p / ry) ** 2
+    if scale > 1:
+        rx, ry = rx * math.sqrt(scale), ry * math.sqrt(scale)
+    num = rx * rx * ry * ry - rx * rx * y1p * y1p - ry * ry * x1p * x1p
+    den = rx * rx * y1p * y1p + ry * ry * x1p * x1p
+    k = math.sqrt(max(0.0, num / den)) if den else 0.0
+    if large == sweep:
+        k = -k
+    cxp, cyp = k * rx * y1p / ry, -k * ry * x1p / rx
+    cx = cos * cxp - sin * cyp + (x0 + x1) / 2
+    cy = sin * cxp + cos * cyp + (y0 + y1) / 2
+    theta0 = math.atan2((y1p - cyp) / ry, (x1p - cxp) / rx)
+    theta1 = math.atan2((-y1p - cyp) / ry, (-x1p - cxp) / rx)
+    delta = theta1 - theta0
+    if sweep and delta < 0:
+        delta += 2 * math.pi
+    elif not sweep and delta > 0:
+        delta -= 2 * math.pi
+    points = []
+    for i in range(1, arcSamples + 1):
+        t = theta0 + delta * i / arcSamples
+        ex, ey = rx * math.cos(t), ry * math.sin(t)
+        points.append((cos * ex - sin * ey + cx, sin * ex + cos * ey + cy))
+    return points
+
+# Bounding box and number of segments of a path's d attribute, in its own units.
+# If strokes is a list, each subpath is added to it as a list of points.
+def pathBounds (d, strokes=None):
+    tokens = tokenRE.findall(d)
+    points = []
+    segments = 0
+    x = y = startX = startY = 0.0
+    lastCtrl = None         # last control point, for S and T
+    cmd = None
+    i = 0
+    n = len(tokens)
+
+    def nums (count):
+        nonlocal i
+        v = [float(t) for t in tokens[i:i + count]]
+        i += count
+        return v
+
+    while i < n:
+        if tokens[i].isalpha():
+            cmd = tokens[i]
+            i += 1
+            if cmd in "Zz":
+                x, y = startX, startY
+                segments += 1
+                if strokes:
+                    strokes[-1].append((x, y))
+                lastCtrl = None
+                continue
+        elif cmd is None:
+            break
+        rel = cmd.islower()
+        c = cmd.upper()
+        ox, oy = (x, y) if rel else (0.0, 0.0)
+        try:
+            if c == "M":
+                x, y = nums(2)
+                x, y = x + ox, y + oy
+                startX, startY = x, y
+                points.append((x, y))
+                cmd = "l" if rel else "L"     # further pairs are lines
+                lastCtrl = None
+                if strokes is not None:
+                    strokes.append([(x, y)])
+                continue
+            elif c == "L" or c == "T":
+                px, py = nums(2)
+                px, py = px + ox, py + oy
+                if c == "T":
+                    cx, cy = (2 * x - lastCtrl[0], 2 * y - lastCtrl[1]) if lastCtrl and lastCtrl[2] == "Q" else (x, y)
+                    points.extend(bezierBounds((x, cx, px), (y, cy, py)))
+                    lastCtrl = (cx, cy, "Q")
+                    if strokes:
+                        strokes[-1].append((bezierPoint((x, cx, px), 0.5), bezierPoint((y, cy, py), 0.5)))
+                else:
+                    points.append((px, py))
+                    lastCtrl = None
+                x, y = px, py
+                segments += 1
+            elif c == "H" or c == "V":
+                v, = nums(1)
+                if c == "H":
+                    x = v + ox
+                else:
+                    y = v + oy
+                points.append((x, y))
+                segments += 1
+                lastCtrl = None
+            elif c == "C" or c == "S":
+                if c == "C":
+                    x1, y1, x2, y2, px, py = nums(6)
+                    x1, y1 = x1 + ox, y1 + oy
+                else:
+                    x2, y2, px, py = nums(4)
+                    x1, y1 = (2 * x - lastCtrl[0], 2 * y - lastCtrl[1]) if lastCtrl and lastCtrl[2] == "C" else (x, y)
+                x2, y2, px, py = x2 + ox, y2 + oy, px + ox, py + oy
+                points.extend(bezierBounds((x, x1, x2, px), (y, y1, y2, py)))
+                lastCtrl = (x2, y2, "C")
+                if strokes:
+                    strokes[-1].append((bezierPoint((x, x1, x2, px), 0.5), bezierPoint((y, y1, y2, py), 0.5)))
+                x, y = px, py
+                segments += 1
+            elif c == "Q":
+                x1, y1, px, py = nums(4)
+                x1, y1, px, py = x1 + ox, y1 + oy, px + ox, py + oy
+                points.extend(bezierBounds((x, x1, px), (y, y1, py)))
+                lastCtrl = (x1, y1, "Q")
+                if strokes:
+                    strokes[-1].append((bezierPoint((x, x1, px), 0.5), bezierPoint((y, y1, py), 0.5)))
+                x, y = px, py
+                segments += 1
+            elif c == "A":
+                rx, ry, angle, large, sweep, px, py = nums(7)
+                px, py = px + ox, py + oy
+                arc = arcPoints(x, y, rx, ry, angle, bool(large), bool(sweep), px, py)
+                points.extend(arc)
+                if strokes:
+                    strokes[-1].extend(arc[:-1])
+                x, y = px, py
+                segments += 1
+                lastCtrl = None
+            else:
+                break       # unknown command -- stop here, as a renderer would
+        except (ValueError, IndexError):
+            break           # truncated or malformed data
+        if strokes:
+            strokes[-1].append((x, y))
+    if not points:
+        return None, 0
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return (min(xs), min(ys), max(xs), max(ys)), segments
+
+def floats (elem, *names):
+    return [float(numberRE.match(elem.get(name, "0") or "0").group()) for name in names]
+
+# Points around an ellipse, back to where they start
+def ellipsePoints (cx, cy, rx, ry):
+    return [(cx + rx * math.cos(2 * math.pi * i / arcSamples), cy + ry * math.sin(2 * math.pi * i / arcSamples))
+            for i in range(arcSamples + 1)]
+
+# Bounding box and number of segments of a drawing element, or (None, 0).
+# If strokes is a list, the element's strokes are added to it (see pathBounds).
+def elementBounds (tag, elem, strokes=None):
+    try:
+        if tag == "path":
+            return pathBounds(elem.get("d", ""), strokes)
+        if tag == "line":
+            x1, y1, x2, y2 = floats(elem, "x1", "y1", "x2", "y2")
+            if strokes is not None:
+                strokes.append([(x1, y1), (x2, y2)])
+            return (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)), 1
+        if tag in ("polyline", "polygon"):
+            v = [float(t) for t in numberRE.findall(elem.get("points", ""))]
+            xs, ys = v[0:len(v) // 2 * 2:2], v[1:len(v) // 2 * 2:2]
+            if not xs:
+                return None, 0
+            segments = len(xs) - 1 + (tag == "polygon")
+            if strokes is not None:
+                strokes.append(list(zip(xs, ys)) + [(xs[0], ys[0])] * (tag == "polygon"))
+            return (min(xs), min(ys), max(xs), max(ys)), segments
+        if tag == "rect":
+            x, y, w, h = floats(elem, "x", "y", "width", "height")
+            if w <= 0 or h <= 0:
+                return None, 0
+            if strokes is not None:
+                strokes.append([(x, y), (x + w, y), (x + w, y + h), (x, y + h), (x, y)])
+            return (x, y, x + w, y + h), 4
+        if tag == "circle":
+            cx, cy, r = floats(elem, "cx", "cy", "r")
+            if r > 0 and strokes is not None:
+                strokes.append(ellipsePoints(cx, cy, r, r))
+            return ((cx - r, cy - r, cx + r, cy + r), 4) if r > 0 else (None, 0)
+        if tag == "ellipse":
+            cx, cy, rx, ry = floats(elem, "cx", "cy", "rx", "ry")
+            if rx > 0 and ry > 0 and strokes is not None:
+                strokes.append(ellipsePoints(cx, cy, rx, ry))
+            return ((cx - rx, cy - ry, cx + rx, cy + ry), 4) if rx > 0 and ry > 0 else (None, 0)
+    except (AttributeError, ValueError):
+        pass
+    return None, 0
+
+# The transform from the root element's user units to inches
+def rootTransform (root):
+    viewBox = [float(v) for v in numberRE.findall(root.get("viewBox") or "")]
+    width = svginfo.lengthInches(root.get("width"))
+    height = svginfo.lengthInches(root.get("height"))
+    if len(viewBox) == 4 and viewBox[2] > 0 and viewBox[3] > 0:
+        if width is None or height is None:
+            width = viewBox[2] * svginfo.unitInches["px"]
+            height = viewBox[3] * svginfo.unitInches["px"]
+        sx, sy = width / viewBox[2], height / viewBox[3]
+        return (sx, 0, 0, sy, -viewBox[0] * sx, -viewBox[1] * sy), (width, height)
+    px = svginfo.unitInches["px"]
+    size = (width, height) if width is not None and height is not None else None
+    return (px, 0, 0, px, 0, 0), size
+
+# Scan a file and build its index, keeping its strokes too if keepStrokes.
+# Raises OSError or ET.ParseError.
+def scanFile (filename, keepStrokes=False):
+    start = time.perf_counter()
+    index = LayerIndex(filename)
+    stack = []          # (transform, layer, skipping) for each open element
+    root = None
+    inkscapeLabel = f"{{{svginfo.inkscapeNS}}}label"
+    inkscapeMode = f"{{{svginfo.inkscapeNS}}}groupmode"
+    for event, elem in svginfo.ET.iterparse(filename, events=("start", "end")):
+        if event == "end":
+            stack.pop()
+            elem.clear()
+            if len(stack) == 1:
+                root.remove(elem)   # nothing more is needed from it
+            continue
+        tag = svginfo.localName(elem.tag)
+        if root is None:
+            root = elem
+            transform, index.size = rootTransform(elem)
+            stack.append((transform, index.loose, False))
+            continue
+        transform, layer, skipping = stack[-1]
+        if not skipping:
+            if tag in skipTags:
+                skipping = True
+            elif len(stack) == 1 and tag == "g" and elem.get(inkscapeMode) == "layer":
+                name = elem.get(inkscapeLabel) or elem.get("id") or ""
+                number, pause, documentation = parseLayerName(name)
+                layer = Layer(name, number, pause, documentation, isHidden(elem))
+                index.layers.append(layer)
+            elif isHidden(elem):
+                skipping = True
+        if skipping or not layer.plotted():
+            stack.append((transform, layer, True))
+            continue
+        if elem.get("transform"):
+            transform = multiply(transform, parseTransform(elem.get("transform")))
+        stack.append((transform, layer, False))
+        strokes = [] if keepStrokes else None
+        box, segments = elementBounds(tag, elem, strokes)
+        if box is not None:
+            layer.paths += 1
+            layer.segments += segments
+            layer.bbox = unionBox(layer.bbox, transformBox(transform, box))
+            if strokes:
+                index.strokes.extend(transformPoints(transform, s) for s in strokes)
+    index.seconds = time.perf_counter() - start
+    return index
+
+class LayerIndexCache:
+    def __init__ (self, maxEntries=256):
+        self.maxEntries = maxEntries
+        self.indexes = OrderedDict()    # (path, mtime, size) -> LayerIndex
+
+    # The index for a file, scanning it if it's new or has changed.
+    # Raises OSError or ET.ParseError if it can't be read.
+    def get (self, filename):
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        index = self.indexes.get(key)
+        if index is None:
+            index = scanFile(path)
+            self.indexes[key] = index
+            while len(self.indexes) > self.maxEntries:
+                self.indexes.popitem(last=False)
+        else:
+            self.indexes.move_to_end(key)
+        return index
@@ -0,0 +1,256 @@
+# interaxi -- interactive AxiDraw frontend.
+# Path ordering optimiser, to cut down pen-up travel.
+
+# NOTES:
+# * This works on plans (see plancache.py): pyaxidraw has already turned
+#   the drawing into polylines, so each path is just a list of points and
+#   can be reversed by reversing the points.
+# * Paths are only reordered among their siblings (i.e. within a layer),
+#   so layer order and any group transforms are preserved.
+# * Ordering is greedy nearest-neighbour (using a grid of path endpoints
+#   so each step only looks at nearby paths), followed by 2-opt and Or-opt
+#   improvements, each looking at a window of nearby positions in the
+#   order, for as long as the time budget allows.
+# * The pen starts and finishes at the origin, so those legs are counted too.
+# * Needs NumPy, which is imported by available() the first time it's
+#   called, so callers must check available() first.
+
+import time
+import xml.etree.ElementTree as ET
+
+from . import svginfo
+
+np = None           # numpy, once available() has imported it
+
+window = 64         # how far along the order the improvement moves look
+
+def available ():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+# Points of a polyline or a simple (M/L only) path, as an n x 2 array,
+# or None if the element isn't one of those.
+def elementPoints (elem):
+    tag = elem.tag.rsplit("}", 1)[-1]
+    if tag == "polyline":
+        numbers = elem.get("points", "").replace(",", " ").split()
+    elif tag == "path":
+        d = elem.get("d", "").replace(",", " ")
+        if d.count("M") != 1:
+            return None     # several subpaths can't simply be reversed
+        numbers = d.replace("M", " ").replace("L", " ").split()
+        if any(c.isalpha() and c not in "eE" for c in d.replace("M", "").replace("L", "")):
+            return None     # curves, relative moves, etc. -- leave it alone
+    else:
+        return None
+    try:
+        points = np.array(numbers, dtype=float).reshape(-1, 2)
+    except ValueError:
+        return None
+    return points if len(points) >= 1 else None
+
+def setElementPoints (elem, points):
+    text = " ".join(f"{x:.6g},{y:.6g}" for x, y in points)
+    if elem.tag.rsplit("}", 1)[-1] == "polyline":
+        elem.set("points", text)
+    else:
+        elem.set("d", "M " + text.replace(" ", " L ", 1) if len(points) > 1 else "M " + text)
+
+# Total pen-up travel for paths in the given order, starting and ending at origin
+def penUpDistance (ps, pe, origin):
+    if len(ps) == 0:
+        return 0.0
+    legs = np.vstack([origin, pe]) - np.vstack([ps, origin])
+    return float(np.hypot(legs[:, 0], legs[:, 1]).sum())
+
+# Greedy nearest-neighbour order.  Returns (order, flip): order[k] is the path
+# to draw k'th, and flip[k] is True if it should be drawn end to start.
+def greedyOrder (starts, ends, origin):
+    n = len(starts)
+    pts = np.vstack([starts, ends])     # endpoint e belongs to path e % n; e >= n means reversed
+    lo = pts.min(axis=0)
+    span = float((pts.max(axis=0) - lo).max()) or 1.0
+    visited = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=int)
+    flip = np.empty(n, dtype=bool)
+    p = np.asarray(origin, dtype=float)
+
+    def buildGrid (remaining):
+        cell = span / max(1.0, np.sqrt(remaining / 2))
+        ids = np.flatnonzero(~np.tile(visited, 2))
+        cells = np.floor((pts[ids] - lo) / cell).astype(int)
+        grid = {}
+        for e, (cx, cy) in zip(ids.tolist(), cells.tolist()):
+            grid.setdefault((cx, cy), []).append(e)
+        return grid, cell, int(span / cell) + 2
+
+    grid, cell, maxR = buildGrid(n)
+    nextRebuild = n // 2
+    for k in range(n):
+        remaining = n - k
+        if remaining <= nextRebuild and remaining > 16:
+            # Fewer endpoints left -- coarser cells so searches stay short
+            grid, cell, maxR = buildGrid(remaining)
+            nextRebuild = remaining // 2
+        cx, cy = (int(v) for v in np.floor((p - lo) / cell))
+        best = None
+        bestD = np.inf
+        r = 0
+        while r <= maxR + max(abs(cx), abs(cy)):
+            cand = []
+            for dx in range(-r, r + 1):
+                for dy in ((-r, r) if abs(dx) != r else range(-r, r + 1)):
+                    cand.extend(grid.get((cx + dx, cy + dy), ()))
+            if cand:
+                cand = np.array(cand)
+                d = np.hypot(*(pts[cand] - p).T)
+                i = int(np.argmin(d))
+                if d[i] < bestD:
+                    bestD = float(d[i])
+                    best = int(cand[i])
+            if best is not None and bestD <= r * cell:
+                break   # nothing in further rings can be closer
+            r += 1
+        path = best % n
+        order[k] = path
+        flip[k] = best >= n
+        visited[path] = True
+        for e in (path, path + n):
+            ex, ey = (int(v) for v in np.floor((pts[e] - lo) / cell))
+            members = grid.get((ex, ey))
+            if members and e in members:
+                members.remove(e)
+                if not members:
+                    del grid[(ex, ey)]
+        p = starts[path] if flip[k] else ends[path]
+    return order, flip
+
+# Improve the order with windowed 2-opt (reversing a run of paths) and
+# Or-opt (moving one path elsewhere, maybe reversed) until no more
+# improvements are found or the deadline passes.  Works in place.
+def improveOrder (order, flip, starts, ends, origin, deadline):
+    n = len(order)
+    origin = np.asarray(origin, dtype=float)
+    ps = np.where(flip[:, None], ends[order], starts[order])    # start point of each position
+    pe = np.where(flip[:, None], starts[order], ends[order])    # end point of each position
+    eps = 1e-9
+
+    def dist (a, b):
+        return np.hypot(*(np.asarray(a) - np.asarray(b)).T)
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(n):
+            if i % 256 == 0 and time.perf_counter() > deadline:
+                break
+            # 2-opt: reverse positions i..j
+            prevE = pe[i - 1] if i > 0 else origin
+            j = np.arange(i, min(n, i + window))
+            nextS = np.vstack([ps[i + 1:j[-1] + 2], origin[None, :]])[:len(j)] if len(j) else None
+            delta = dist(prevE, pe[j]) + dist(ps[i], nextS) - dist(prevE, ps[i]) - dist(pe[j], nextS)
+            b = int(np.argmin(delta))
+            if delta[b] < -eps:
+                j = int(j[b])
+                order[i:j + 1] = order[i:j + 1][::-1].copy()
+                flip[i:j + 1] = ~flip[i:j + 1][::-1]
+                ps[i:j + 1], pe[i:j + 1] = pe[i:j + 1][::-1].copy(), ps[i:j + 1][::-1].copy()
+                improved = True
+                continue
+            # Or-opt: move the path at position i to after position m
+            nextI = ps[i + 1] if i + 1 < n else origin
+            gain = dist(prevE, ps[i]) + dist(pe[i], nextI) - dist(prevE, nextI)
+            if gain <= eps:
+                continue
+            m = np.arange(max(-1, i - window), min(n, i + window))
+            m = m[(m != i) & (m != i - 1)]
+            if len(m) == 0:
+                continue
+            a = np.where(m[:, None] >= 0, pe[np.maximum(m, 0)], origin)
+            b = np.where((m + 1 < n)[:, None], ps[np.minimum(m + 1, n - 1)], origin)
+            forward = dist(a, ps[i]) + dist(pe[i], b)
+            backward = dist(a, pe[i]) + dist(ps[i], b)
+            cost = np.minimum(forward, backward) - dist(a, b)
+            c = int(np.argmin(cost))
+            if gain - cost[c] <= eps:
+                continue
+            m = int(m[c])
+            rev = backward[c] < forward[c]
+            item = (order[i], not flip[i] if rev else flip[i],
+                    (pe[i] if rev else ps[i]).copy(), (ps[i] if rev else pe[i]).copy())
+            if m > i:
+                # shift i+1..m left by one, and put the path at m
+                for arr in (order, flip, ps, pe):
+                    arr[i:m] = arr[i + 1:m + 1].copy()
+                dest = m
+            else:
+                # shift m+1..i-1 right by one, and put the path at m+1
+                for arr in (order, flip, ps, pe):
+                    arr[m + 2:i + 1] = arr[m + 1:i].copy()
+                dest = m + 1
+            order[dest], flip[dest], ps[dest], pe[dest] = item
+            improved = True
+    return order, flip
+
+# Reorder the paths that are children of one element.  Returns (before, after) pen-up distances.
+def optimiseGroup (parent, budget, origin):
+    slots = []
+    paths = []
+    for index, child in enumerate(list(parent)):
+        points = elementPoints(child)
+        if points is not None:
+            slots.append(index)
+            paths.append((child, points))
+    if len(paths) < 2:
+        return 0.0, 0.0
+    starts = np.array([p[1][0] for p in paths])
+    ends = np.array([p[1][-1] for p in paths])
+    before = penUpDistance(starts, ends, origin)
+    deadline = time.perf_counter() + budget
+    order, flip = greedyOrder(starts, ends, origin)
+    order, flip = improveOrder(order, flip, starts, ends, origin, deadline)
+    ps = np.where(flip[:, None], ends[order], starts[order])
+    pe = np.where(flip[:, None], starts[order], ends[order])
+    after = penUpDistance(ps, pe, origin)
+    if after >= before:
+        return before, before   # leave it as it was
+    for slot, k, reverse in zip(slots, order.tolist(), flip.tolist()):
+        child, points = paths[k]
+        if reverse:
+            setElementPoints(child, points[::-1])
+        parent[slot] = child
+    return before, after
+
+# Inches per user unit in a plan (root is the parsed plan)
+def planScale (root, plan):
+    scale = svginfo.unitInches["px"]
+    size = svginfo.documentSize(plan)
+    viewBox = (root.get("viewBox") or "").replace(",", " ").split()
+    if size and len(viewBox) == 4 and float(viewBox[2]) > 0:
+        scale = size[0] / float(viewBox[2])
+    return scale
+
+# Optimise the path order in a plan (a plob, as a string) with a time budget in
+# seconds.  Returns the new plan and the pen-up distances (inches) before and after.
+def optimisePlan (plan, budget):
+    root = ET.fromstring(plan)
+    scale = planScale(root, plan)
+    # Groups to work on: anything with paths directly in it
+    parents = [elem for elem in root.iter() if any(elementPoints(child) is not None for child in elem)]
+    totalPaths = sum(len(elem) for elem in parents) or 1
+    before = after = 0.0
+    origin = np.zeros(2)
+    for elem in parents:
+        # Share the budget out by the number of paths
+        b, a = optimiseGroup(elem, budget * len(elem) / totalPaths, origin)
+        before += b
+        after += a
+    if after >= before:
+        return plan, before * scale, before * scale
+    return ET.tostring(root, encoding="unicode"), before * scale, after * scale
@@ -0,0 +1,85 @@
+# interaxi -- interactive AxiDraw frontend.
+# In-memory cache of processed plot plans.
+
+# NOTES:
+# * A 'plan' is the plob ("plottable object") digest that pyaxidraw produces
+#   with digest = 2: the SVG after parsing, layer selection, reordering and
+#   hidden-line removal.  pyaxidraw plots a plob without processing it again,
+#   so plotting from a cached plan skips all that work.
+# * Plans are keyed by the file's path, modification time and size, and by
+#   the options that change the geometry.  Options that only change the
+#   motion (speeds etc.) don't affect the plan.
+# * Size is measured as the length of the plob string, which is near enough
+#   the number of bytes it takes up.
+
+from collections import OrderedDict
+import os
+
+# Options that change what gets plotted, so are part of a plan's key.
+planOpts = [
+        "auto_rotate",
+        "hiding",
+        "min_gap",
+        "model",
+        "optimise",
+        "random_start",
+        "reordering",
+        ]
+
+class PlanCache:
+    def __init__ (self, maxBytes):
+        self.maxBytes = maxBytes    # 0 disables the cache
+        self.plans = OrderedDict()  # key -> plob string, least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Build the key for a file, or return None if it can't be read.
+    def key (self, filename, opts, layer):
+        try:
+            path = os.path.abspath(filename)
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (path, st.st_mtime_ns, st.st_size, layer) + tuple(opts.get(o) for o in planOpts)
+
+    def get (self, key):
+        if key is None or key not in self.plans:
+            self.misses += 1
+            return None
+        self.plans.move_to_end(key)
+        self.hits += 1
+        return self.plans[key]
+
+    # The plan for a key if it's cached, without counting it as a use
+    def peek (self, key):
+        return self.plans.get(key)
+
+    def put (self, key, plan):
+        if key is None or len(plan) > self.maxBytes:
+            return
+        if key in self.plans:
+            self.size -= len(self.plans.pop(key))
+        self.plans[key] = plan
+        self.size += len(plan)
+        self.trim()
+
+    # Evict least recently used plans until we're within the limit.
+    def trim (self):
+        while self.size > self.maxBytes and self.plans:
+            _, plan = self.plans.popitem(last=False)
+            self.size -= len(plan)
+            self.evictions += 1
+
+    def setLimit (self, maxBytes):
+        self.maxBytes = maxBytes
+        self.trim()
+
+    def clear (self):
+        self.plans.clear()
+        self.size = 0
+
+    def report (self):
+        print(f"plan cache: {len(self.plans)} plans, {self.size / 1e6:.1f} of {self.maxBytes / 1e6:.0f} MB")
+        print(f"  hits: {self.hits}  misses: {self.misses}  evictions: {self.evictions}")
@@ -0,0 +1,87 @@
+# interaxi -- interactive AxiDraw frontend.
+# Preparing plot plans in the background.
+
+# NOTES:
+# * While one job is plotting, the host is mostly idle, so the plan for
+#   the next job (see plancache.py) is prepared in a worker process:
+#   parsing, layer selection, reordering and hidden-line removal.  (Whether
+#   each job fits the plotter is checked from its layer index, before it
+#   plots -- see interaxi's checkJobFits().)
+# * Preparations are identified by their plan cache key, so a plan that
+#   was prepared with different options is never used.
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import time
+
+from . import optimise
+
+# Make the plan for a file, optimising the path order for up to
+# optimiseBudget seconds if that's not 0.  Runs in a worker process.
+# Returns a dict with the rc, plan, pen-up travel before and after
+# optimising (or None), and time taken.
+def preparePlan (filename, layer, adOptions, adParams, optimiseBudget=0):
+    start = time.perf_counter()
+    from pyaxidraw import axidraw
+    ad = axidraw.AxiDraw()
+    ad.plot_setup(filename)
+    ad.options.__dict__.update(adOptions)
+    ad.params.__dict__.update(adParams)
+    ad.options.mode = "plot" if layer is None else "layers"
+    ad.options.layer = layer
+    ad.options.digest = 2       # plob only -- no plotting
+    ad.options.preview = False
+    ad.options.report_time = False
+    ad.options.report_lifts = False
+    plan = ad.plot_run(True)
+    optimised = None
+    if plan and optimiseBudget > 0 and optimise.available():
+        plan, before, after = optimise.optimisePlan(plan, optimiseBudget)
+        optimised = (before, after)
+    return {"rc": ad.errors.code,
+            "plan": plan,
+            "optimised": optimised,
+            "seconds": time.perf_counter() - start}
+
+# Make the plans for many files (whole files, not layers) in a process pool.
+# Yields (filename, result) as each is done, with results as from preparePlan().
+def preparePlans (files, adOptions, adParams, optimiseBudget=0, jobs=None):
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(preparePlan, f, None, adOptions, adParams, optimiseBudget): f for f in files}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+class Preparer:
+    def __init__ (self):
+        self.pool = None
+        self.pending = {}   # plan key -> future
+
+    def isPending (self, key):
+        return key in self.pending
+
+    def start (self, key, filename, layer, adOptions, adParams, optimiseBudget=0):
+        if key is None or key in self.pending:
+            return
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=1)
+        self.pending[key] = self.pool.submit(preparePlan, filename, layer, adOptions, adParams, optimiseBudget)
+
+    # The result of the preparation for key (waiting for it if necessary),
+    # or None if there isn't one or it failed.
+    def take (self, key):
+        future = self.pending.pop(key, None)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception as err:    # the plan will just be made in the foreground
+            print(f"Background preparation failed: {err}")
+            return None
+
+    # Forget anything still being prepared, and stop the worker
+    def shutdown (self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
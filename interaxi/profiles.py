@@ -0,0 +1,109 @@
+# interaxi -- interactive AxiDraw frontend.
+# Store of parsed configuration files, for switching between profiles quickly.
+
+# NOTES:
+# * Config files are Python, and loading one means running it (via
+#   axicli's load_config()).  The options in each file are kept, once
+#   parsed, in memory and as a small JSON file in the cache directory, so
+#   switching back to a profile -- in this run or a later one -- doesn't
+#   run it again.
+# * Entries are stamped with the config file's mtime and size, so an
+#   edited file is parsed again.
+# * A profile is a config file in the profiles directory, named
+#   <name>.py.  Any config file can be loaded by giving its path instead.
+
+import hashlib
+import json
+import os
+import tempfile
+
+from .stats import counters
+
+class ProfileStore:
+    def __init__ (self, profileDir, cacheDir, optNames):
+        self.profileDir = profileDir
+        self.cacheDir = os.path.join(cacheDir, "profiles")
+        self.optNames = set(optNames)   # options worth keeping from a config file
+        self.parsed = {}                # path -> (mtime, size, options)
+        self.hits = 0
+        self.parses = 0
+
+    # The config file for a profile name, or the name itself if it's a path
+    def path (self, name):
+        name = os.path.expanduser(name)
+        if os.sep in name or name.endswith(".py"):
+            return os.path.abspath(name)
+        return os.path.join(self.profileDir, name + ".py")
+
+    def names (self):
+        try:
+            return sorted(n[:-3] for n in os.listdir(self.profileDir) if n.endswith(".py"))
+        except OSError:
+            return []
+
+    def cachePath (self, path):
+        return os.path.join(self.cacheDir, hashlib.sha1(path.encode()).hexdigest() + ".json")
+
+    # The options in a config file, as a dict, or None if it can't be loaded.
+    def load (self, filename):
+        path = os.path.abspath(filename)
+        try:
+            st = os.stat(path)
+        except OSError as err:
+            print(f"Unable to load '{filename}': {err.strerror}")
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        entry = self.parsed.get(path)
+        if entry and entry[:2] == stamp:
+            self.hits += 1
+            return entry[2]
+        opts = self.loadSaved(path, stamp)
+        if opts is None:
+            opts = self.parse(path)
+            if opts is None:
+                return None
+            self.save(path, stamp, opts)
+        else:
+            self.hits += 1
+        self.parsed[path] = stamp + (opts,)
+        return opts
+
+    # Run the config file, keeping the options we use
+    def parse (self, path):
+        from axicli import utils as acutils
+        try:
+            config = acutils.load_config(path)
+        except SystemExit:
+            return None     # load_config() has already said what's wrong
+        self.parses += 1
+        return {key: val for key, val in config.items() if key in self.optNames}
+
+    def loadSaved (self, path, stamp):
+        try:
+            with open(self.cachePath(path)) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get("path") != path or tuple(saved.get("stamp", ())) != stamp:
+            return None
+        return saved.get("options")
+
+    def save (self, path, stamp, opts):
+        cachePath = self.cachePath(path)
+        try:
+            text = json.dumps({"path": path, "stamp": stamp, "options": opts}, separators=(",", ":"))
+        except (TypeError, ValueError):
+            return      # something JSON can't hold -- just keep it in memory
+        try:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            fd, tmpPath = tempfile.mkstemp(dir=self.cacheDir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            counters.wroteFile(len(text))
+            os.replace(tmpPath, cachePath)
+        except OSError as err:
+            print(f"Unable to save parsed config in cache: {err}")
+
+    def report (self):
+        print(f"profiles in '{self.profileDir}': {', '.join(self.names()) or 'none'}")
+        print(f"  loaded from cache: {self.hits}  parsed: {self.parses}")
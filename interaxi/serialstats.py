@@ -0,0 +1,132 @@
+# interaxi -- interactive AxiDraw frontend.
+# Counting the serial traffic between pyaxidraw and the plotter.
+
+# NOTES:
+# * install() replaces plotink's ebb_serial.command() and query() -- which
+#   pyaxidraw (and plotink's own ebb_motion) use for everything they send
+#   to the EBB -- with wrappers that count the calls, the bytes each way and
+#   the time spent waiting for the reply.  uninstall() puts them back.  It's
+#   opt in, as the wrappers add a little to every command.
+# * A command is sent and then its "OK" read back; a query waits for some
+#   data.  Both are round trips.  command() doesn't give back what it read,
+#   so its reply is counted as the usual 4 bytes ("OK\r\n").
+# * Traffic is just totals, so the traffic for an interaxi command or a
+#   plot is the difference between a snapshot() before it and after it.
+# * Only ebb_serial is wrapped.  Newer plotink versions also have an
+#   ebb3_serial module, with an EBB3 class of its own, for EBB firmware 3.0
+#   and later; traffic that goes through that isn't counted, so with such a
+#   plotter the counts can be low, or zero.
+
+import time
+
+okBytes = 4     # len("OK\r\n")
+
+def fmtBytes (n):
+    return f"{n} bytes" if n < 10000 else f"{n / 1000:.0f} KB"
+
+class Traffic:
+    __slots__ = ("commands", "queries", "bytesOut", "bytesIn", "blocked")
+    def __init__ (self, commands=0, queries=0, bytesOut=0, bytesIn=0, blocked=0.0):
+        self.commands = commands
+        self.queries = queries
+        self.bytesOut = bytesOut
+        self.bytesIn = bytesIn
+        self.blocked = blocked  # seconds waiting in command() and query()
+
+    def copy (self):
+        return Traffic(self.commands, self.queries, self.bytesOut, self.bytesIn, self.blocked)
+
+    def add (self, other):
+        self.commands += other.commands
+        self.queries += other.queries
+        self.bytesOut += other.bytesOut
+        self.bytesIn += other.bytesIn
+        self.blocked += other.blocked
+
+    def minus (self, other):
+        return Traffic(self.commands - other.commands, self.queries - other.queries,
+                       self.bytesOut - other.bytesOut, self.bytesIn - other.bytesIn, self.blocked - other.blocked)
+
+    def trips (self):
+        return self.commands + self.queries
+
+    def __str__ (self):
+        perTrip = 1000 * self.blocked / self.trips() if self.trips() else 0
+        return (f"{self.commands} commands, {self.queries} queries, {fmtBytes(self.bytesOut)} out, "
+                f"{fmtBytes(self.bytesIn)} in, {self.blocked:.2f} s waiting for replies ({perTrip:.1f} ms per round trip)")
+
+class SerialMeter:
+    def __init__ (self):
+        self.total = Traffic()
+        self.byCommand = {}     # interaxi command name -> Traffic
+        self.originals = None  # (ebb_serial, command, query) while installed
+
+    def installed (self):
+        return self.originals is not None
+
+    # Start counting.  Returns "" if OK, else what went wrong.
+    def install (self):
+        if self.installed():
+            return ""
+        try:
+            from plotink import ebb_serial
+        except ImportError:
+            return "plotink (part of pyaxidraw) isn't installed"
+        command, query = ebb_serial.command, ebb_serial.query
+        total = self.total
+
+        def countedCommand (port, cmd, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                reply = command(port, cmd, *args, **kwargs)
+            finally:
+                total.commands += 1
+                total.bytesOut += len(cmd)
+                total.blocked += time.perf_counter() - start
+            total.bytesIn += len(reply) if isinstance(reply, (str, bytes)) else okBytes
+            return reply
+
+        def countedQuery (port, cmd, *args, **kwargs):
+            start = time.perf_counter()
+            reply = None
+            try:
+                reply = query(port, cmd, *args, **kwargs)
+            finally:
+                total.queries += 1
+                total.bytesOut += len(cmd)
+                total.bytesIn += len(reply) if isinstance(reply, (str, bytes)) else 0
+                total.blocked += time.perf_counter() - start
+            return reply
+
+        ebb_serial.command = countedCommand
+        ebb_serial.query = countedQuery
+        self.originals = (ebb_serial, command, query)
+        return ""
+
+    def uninstall (self):
+        if not self.installed():
+            return
+        ebb_serial, command, query = self.originals
+        ebb_serial.command = command
+        ebb_serial.query = query
+        self.originals = None
+
+    def snapshot (self):
+        return self.total.copy()
+
+    def since (self, snapshot):
+        return self.total.minus(snapshot)
+
+    # Add the traffic for a run of an interaxi command
+    def note (self, name, traffic):
+        if traffic.trips():
+            self.byCommand.setdefault(name, Traffic()).add(traffic)
+
+    def reset (self):
+        self.total.__init__()  # the same object, as the wrappers have hold of it
+        self.byCommand.clear()
+
+    def report (self):
+        print(f"  total: {self.total}")
+        for name, traffic in sorted(self.byCommand.items(), key=lambda kv: -kv[1].blocked):
+            print(f"  {name}: {traffic}")
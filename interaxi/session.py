@@ -0,0 +1,241 @@
+# interaxi -- interactive AxiDraw frontend.
+# Persistent plotter session.
+
+# NOTES:
+# * Without a session, every command builds a new AxiDraw object, runs
+#   plot_setup(), applies all the options, and opens and closes the USB
+#   serial port.  A session opens the serial port once and keeps an
+#   interactive-mode AxiDraw object on it, so manual commands only cost
+#   the serial traffic for the move itself.
+# * pyaxidraw leaves the port open at the end of plot_run() if
+#   options.port is a serial port object rather than a name, so plot-mode
+#   runs can share the session's port too (see portOption()).
+# * The interactive API treats the head position at connect() time as its
+#   origin.  Interactive objects are only (re)connected on an open port, so
+#   after a plot-mode run (which moves the head behind our back) the
+#   interactive object is discarded and rebuilt on the next command.
+#   Because that origin isn't necessarily the home position, walk_home
+#   is left to a plot-mode run (which still shares the open port).
+# * pyaxidraw also keeps interactive moves within the travel as measured
+#   from that origin, so walks only go through the session when it's the
+#   home position -- when the connection was made by setting home (see
+#   interaxi's setHome()).  Otherwise they're plot-mode walk_x/walk_y runs.
+# * Options are pushed to the interactive object only when they've changed
+#   since they were last applied.
+
+import os
+import time
+
+# Options that the session must not pass on to the interactive AxiDraw --
+# it handles the port and units itself.
+sessionSkipOpts = ["port", "units"]
+
+# pyaxidraw error codes that mean the USB connection has gone.
+lostConnectionCodes = (101, 104)
+
+class Session:
+    def __init__ (self, applyFn):
+        self.applyFn = applyFn  # function(ad, dict) that applies options to an AxiDraw
+        self.portName = None    # port name/nickname as given by the user, or None for first found
+        self.port = None        # open serial port object
+        self.ad = None          # interactive AxiDraw object using self.port
+        self.applied = {}       # options as last applied to self.ad
+        self.homeOrigin = False # self.ad was connected with the head at home
+        self.portOpens = 0      # number of times the serial port has been opened
+        self.connects = 0       # number of interactive connects
+        self.drops = 0          # number of times the connection was found to be lost
+        self.commands = 0       # number of commands run through the session
+        self.totalTime = 0.0    # seconds spent in those commands
+        self.lastTime = None    # round trip of the most recent command, seconds
+        self.maxTime = 0.0
+
+    def isOpen (self):
+        return self.port is not None
+
+    # Open the serial port, if it isn't open already.
+    # Returns True if the port is open.
+    def openPort (self, portName):
+        if self.port is not None and portName == self.portName:
+            return True
+        self.close()
+        try:
+            from plotink import ebb_serial
+        except ImportError:
+            print("session: plotink (part of pyaxidraw) isn't installed, so there's no session")
+            return False
+        try:
+            if portName is None:
+                port = ebb_serial.openPort()
+            else:
+                port = ebb_serial.open_named_port(portName)
+                if port is None and os.path.exists(portName):
+                    # Not a known USB device or nickname, but maybe a device
+                    # file (e.g. a pseudo-terminal) that talks EBB.
+                    port = ebb_serial.testPort(portName)
+        except OSError as err:
+            print(f"session: unable to open plotter port {portName or '(first found)'}: {err}")
+            return False
+        if port is None:
+            print(f"session: unable to open plotter port {portName or '(first found)'}")
+            return False
+        self.port = port
+        self.portName = portName
+        self.portOpens += 1
+        return True
+
+    # The value to use for ad.options.port in plot-mode runs --
+    # the open port object if there is one, else the name.
+    def portOption (self, portName):
+        if self.port is not None and portName == self.portName:
+            return self.port
+        return portName
+
+    # Get a connected interactive AxiDraw, (re)connecting if necessary.
+    def connect (self, opts):
+        if not self.openPort(opts.get("port")):
+            return None
+        if self.ad is None:
+            from pyaxidraw import axidraw
+            ad = axidraw.AxiDraw()
+            ad.interactive()
+            self.applyFn(ad, self.sessionOpts(opts))
+            ad.options.port = self.port
+            ad.options.units = 0    # interactive moves are in inches, like ours
+            if not ad.connect():
+                print("session: unable to connect to the plotter")
+                return None
+            self.ad = ad
+            self.applied = self.sessionOpts(opts)
+            self.homeOrigin = False
+            self.connects += 1
+        else:
+            self.sync(opts)
+        return self.ad
+
+    # Push any options that have changed since they were last applied.
+    def sync (self, opts):
+        current = self.sessionOpts(opts)
+        delta = {key: val for key, val in current.items()
+                    if key not in self.applied or self.applied[key] != val}
+        if delta:
+            self.applyFn(self.ad, delta)
+            self.ad.update()
+            self.applied.update(delta)
+        return delta
+
+    def sessionOpts (self, opts):
+        return {key: val for key, val in opts.items() if key not in sessionSkipOpts}
+
+    # Forget the interactive object -- e.g. after a plot-mode run has moved the
+    # head, or the motors have been disabled.  The port stays open.
+    def invalidate (self):
+        self.ad = None
+        self.applied = {}
+
+    # Close the port; the next command will reopen it.
+    def close (self):
+        self.ad = None
+        self.applied = {}
+        if self.port is not None:
+            try:
+                self.port.close()
+            except OSError:
+                pass
+        self.port = None
+
+    def lost (self, ad):
+        try:
+            code = ad.errors.code
+        except AttributeError:
+            code = 0
+        return code in lostConnectionCodes or self.port is None or not self.port.is_open
+
+    # Run fn(ad) on the interactive AxiDraw, reconnecting once if the device
+    # has dropped.  Returns True if the command was run.
+    def run (self, opts, fn):
+        start = time.perf_counter()
+        for attempt in range(2):
+            ad = self.connect(opts)
+            if ad is None:
+                return False
+            try:
+                fn(ad)
+                if not self.lost(ad):
+                    break
+            except OSError as err:
+                print(f"session: lost connection ({err})")
+            self.drops += 1
+            self.close()
+            if attempt == 0:
+                print("session: reconnecting")
+        else:
+            return False
+        elapsed = time.perf_counter() - start
+        self.commands += 1
+        self.totalTime += elapsed
+        self.lastTime = elapsed
+        self.maxTime = max(self.maxTime, elapsed)
+        return True
+
+    # Manual commands that can be done through the interactive API.
+    # Returns True if handled, False if the caller should fall back to a plot-mode run.
+    def manual (self, opts, cmd):
+        if cmd == "raise_pen":
+            return self.run(opts, lambda ad: ad.penup())
+        if cmd == "lower_pen":
+            return self.run(opts, lambda ad: ad.pendown())
+        if cmd == "toggle":
+            return self.run(opts, lambda ad: ad.pendown() if ad.current_pen() else ad.penup())
+        if cmd == "cycle":
+            return self.run(opts, lambda ad: (ad.pendown(), ad.penup()))
+        if cmd == "fw_version":
+            return self.run(opts, lambda ad: print(ad.usb_query("V\r").strip()))
+        if cmd == "disable_xy":
+            handled = self.run(opts, lambda ad: ad.usb_command("EM,0,0\r"))
+            # Interactive position is meaningless once the motors are off
+            self.invalidate()
+            return handled
+        if cmd == "enable_xy":
+            # Connecting enables the motors and sets the origin, here at home
+            self.invalidate()
+            self.homeOrigin = self.run(opts, lambda ad: None)
+            return self.homeOrigin
+        return False
+
+    # Wait until the button on the plotter is pressed.
+    # Returns False if the plotter couldn't be reached.
+    def waitForButton (self, opts, poll=0.1):
+        def wait (ad):
+            ad.usb_query("QB\r")    # forget any earlier press
+            while not ad.usb_query("QB\r").strip().startswith("1"):
+                time.sleep(poll)
+        return self.run(opts, wait)
+
+    # Whether the button has been pressed since the last check (one query,
+    # so it can be polled).  Returns None if the plotter couldn't be reached.
+    def buttonPressed (self, opts):
+        replies = []
+        if not self.run(opts, lambda ad: replies.append(ad.usb_query("QB\r"))):
+            return None
+        return replies[0].strip().startswith("1")
+
+    # Relative move along one axis, without changing the pen.  Returns False
+    # if the caller should fall back to a plot-mode run, as it must unless
+    # the interactive origin is home (see the notes).
+    def walk (self, opts, xy, dist):
+        if self.ad is None or not self.homeOrigin:
+            return False
+        if xy == 'x':
+            return self.run(opts, lambda ad: ad.go(dist, 0))
+        return self.run(opts, lambda ad: ad.go(0, dist))
+
+    def report (self):
+        state = "open" if self.port is not None else "closed"
+        print(f"session: port {self.portName or '(first found)'} {state}")
+        print(f"  connections opened: {self.portOpens}  interactive connects: {self.connects}  drops: {self.drops}")
+        if self.commands:
+            avg = 1000 * self.totalTime / self.commands
+            print(f"  commands: {self.commands}  round trip ms: last {1000 * self.lastTime:.1f}  "
+                  f"avg {avg:.1f}  max {1000 * self.maxTime:.1f}")
+        else:
+            print("  commands: 0")
@@ -0,0 +1,218 @@
+# interaxi -- interactive AxiDraw frontend.
+# Counters and timings of what interaxi does, for the stats command and monitoring.
+
+# NOTES:
+# * Timings go into histograms with fixed buckets (in seconds, as
+#   Prometheus has them), so they take the same small amount of memory
+#   however long interaxi runs.  Each is labelled with a kind (command,
+#   operation, phase or plot) and a name.  Percentiles are read from the
+#   buckets, so are only as precise as the bucket boundaries.
+# * There's one Stats object per process ('counters' below), so modules
+#   that write files (the caches) can count them without being passed
+#   anything.  A lock makes it safe for the jog worker thread.
+# * dump() writes everything as a Prometheus textfile (for node_exporter's
+#   textfile collector) or, if the file name ends in .json, as JSON.  It's
+#   written to a temporary file and renamed, so readers never see half of
+#   one.  Dumper does this every so often on a daemon thread.
+
+import bisect
+import contextlib
+from datetime import datetime, timedelta
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+
+buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5, 10, 30, 60, 300, 900, 3600)  # upper bounds, in seconds
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "worst")
+    def __init__ (self):
+        self.counts = [0] * (len(buckets) + 1)  # the last is for anything longer
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+    def observe (self, seconds):
+        self.counts[bisect.bisect_left(buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.worst = max(self.worst, seconds)
+
+    # Upper bound of the bucket holding the q'th quantile
+    def quantile (self, q):
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.worst)
+        return self.worst
+
+class Stats:
+    def __init__ (self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset (self):
+        with self.lock:
+            self.started = time.time()
+            self.timings = {}   # (kind, name) -> Histogram
+            self.totals = {}    # counter name -> number
+            self.gauges = {}    # gauge name -> value
+
+    def observe (self, kind, name, seconds):
+        with self.lock:
+            histogram = self.timings.get((kind, name))
+            if histogram is None:
+                histogram = self.timings[(kind, name)] = Histogram()
+            histogram.observe(seconds)
+
+    def count (self, name, n=1):
+        with self.lock:
+            self.totals[name] = self.totals.get(name, 0) + n
+
+    # Note a file written (via a temporary file, as the caches do)
+    def wroteFile (self, nbytes):
+        with self.lock:
+            self.totals["temp_files"] = self.totals.get("temp_files", 0) + 1
+            self.totals["bytes_written"] = self.totals.get("bytes_written", 0) + nbytes
+
+    def set (self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    @contextlib.contextmanager
+    def timer (self, kind, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(kind, name, time.perf_counter() - start)
+
+    # Decorator to time every call of a function
+    def timed (self, kind, name=None):
+        def decorate (fn):
+            label = name or fn.__name__
+            @functools.wraps(fn)
+            def wrapper (*args, **kwargs):
+                with self.timer(kind, label):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    # Total time spent plotting (not previewing) so far
+    def plotSeconds (self):
+        with self.lock:
+            return sum(h.total for (kind, name), h in self.timings.items() if kind == "plot" and name == "plot")
+
+    def report (self):
+        uptime = time.time() - self.started
+        plotting = self.plotSeconds()
+        print(f"since {datetime.fromtimestamp(self.started):%Y-%m-%d %H:%M:%S} "
+              f"({timedelta(seconds=round(uptime))}), plotting for {timedelta(seconds=round(plotting))} "
+              f"({100 * plotting / uptime if uptime else 0:.0f}%)")
+        with self.lock:
+            totals = dict(self.totals)
+            timings = sorted(self.timings.items())
+        if totals:
+            print("  " + "  ".join(f"{name} {value}" for name, value in sorted(totals.items())))
+        if not timings:
+            return
+        print(f"  {'kind':<10} {'name':<16} {'count':>6} {'total s':>9} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>9}")
+        for (kind, name), h in timings:
+            print(f"  {kind:<10} {name:<16} {h.count:6d} {h.total:9.2f} {1000 * h.total / h.count:9.1f} "
+                  f"{1000 * h.quantile(0.5):8.1f} {1000 * h.quantile(0.95):8.1f} {1000 * h.worst:9.1f}")
+
+    def asDict (self):
+        with self.lock:
+            return {"started": self.started,
+                    "uptime": time.time() - self.started,
+                    "counters": dict(self.totals),
+                    "gauges": dict(self.gauges),
+                    "timings": [{"kind": kind, "name": name, "count": h.count, "total": h.total,
+                                 "max": h.worst, "buckets": dict(zip([str(b) for b in buckets] + ["+Inf"], h.counts))}
+                                for (kind, name), h in sorted(self.timings.items())]}
+
+    def prometheus (self):
+        data = self.asDict()
+        lines = ["# HELP interaxi_seconds Time taken by interaxi commands, operations, plot phases and plots.",
+                 "# TYPE interaxi_seconds histogram"]
+        for t in data["timings"]:
+            labels = f'kind="{t["kind"]}",name="{t["name"]}"'
+            cumulative = 0
+            for bound, n in t["buckets"].items():
+                cumulative += n
+                lines.append(f'interaxi_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"interaxi_seconds_sum{{{labels}}} {t['total']:.6f}")
+            lines.append(f"interaxi_seconds_count{{{labels}}} {t['count']}")
+        for name, value in sorted(data["counters"].items()):
+            lines.append(f"# TYPE interaxi_{name}_total counter")
+            lines.append(f"interaxi_{name}_total {value}")
+        for name, value in sorted(data["gauges"].items()):
+            lines.append(f"# TYPE interaxi_{name} gauge")
+            lines.append(f"interaxi_{name} {value}")
+        lines.append("# TYPE interaxi_start_time_seconds gauge")
+        lines.append(f"interaxi_start_time_seconds {data['started']:.0f}")
+        return "\n".join(lines) + "\n"
+
+    # Write everything to a file: JSON if the name ends in .json, else Prometheus text.
+    # Returns "" if OK, else what went wrong.
+    def dump (self, filename):
+        text = json.dumps(self.asDict(), indent=1) if filename.endswith(".json") else self.prometheus()
+        directory = os.path.dirname(os.path.abspath(filename))
+        try:
+            fd, tmpPath = tempfile.mkstemp(dir=directory, prefix=".interaxi-stats-")
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            os.chmod(tmpPath, 0o644)    # the monitoring may run as someone else
+            os.replace(tmpPath, filename)
+        except OSError as err:
+            return f"unable to write stats to '{filename}': {err}"
+        return ""
+
+# Writes the stats to a file every so often, on a daemon thread
+class Dumper:
+    def __init__ (self, stats):
+        self.stats = stats
+        self.thread = None
+        self.stopping = None
+        self.filename = None
+        self.error = ""
+
+    def start (self, filename, interval):
+        self.stop()
+        self.filename = filename
+        if not filename:
+            return
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.worker, args=(filename, interval, self.stopping), daemon=True)
+        self.thread.start()
+
+    def worker (self, filename, interval, stopping):
+        while True:
+            self.error = self.stats.dump(filename)
+            if stopping.wait(interval):
+                return
+
+    # Stop the thread, writing the file one last time
+    def stop (self):
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        self.error = self.stats.dump(self.filename)
+
+    def report (self, interval):
+        if self.thread is None:
+            print("not written to a file -- 'stats file <filename>' to write them regularly")
+            return
+        print(f"written to '{self.filename}' every {interval} seconds")
+        if self.error:
+            print(f"  {self.error}")
+
+counters = Stats()
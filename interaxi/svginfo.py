@@ -0,0 +1,144 @@
+# interaxi -- interactive AxiDraw frontend.
+# Information about SVG files, without loading the whole document.
+
+import io
+import re
+import xml.etree.ElementTree as ET
+
+svgNS = "http://www.w3.org/2000/svg"
+inkscapeNS = "http://www.inkscape.org/namespaces/inkscape"
+# Keep the usual prefixes when SVG is written out again
+for prefix, uri in [("", svgNS),
+                    ("inkscape", inkscapeNS),
+                    ("sodipodi", "http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"),
+                    ("xlink", "http://www.w3.org/1999/xlink")]:
+    ET.register_namespace(prefix, uri)
+
+# Top-level elements that aren't drawn, but may be needed by the parts
+# of a document split up by splitDocument()
+sharedTags = ["defs", "metadata", "namedview", "style"]
+
+# Inches per unit, for SVG lengths
+unitInches = {
+    "": 1 / 96,     # user units are px
+    "px": 1 / 96,
+    "pt": 1 / 72,
+    "pc": 1 / 6,
+    "mm": 1 / 25.4,
+    "cm": 1 / 2.54,
+    "in": 1.0,
+    }
+lengthRE = re.compile(r"\s*([-+]?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)\s*([a-z]*)\s*$")
+
+# Convert an SVG length such as '210mm' to inches.  Returns None for
+# percentages and anything else that can't be converted.
+def lengthInches (text):
+    if not text:
+        return None
+    m = lengthRE.match(text)
+    if not m or m.group(2) not in unitInches:
+        return None
+    return float(m.group(1)) * unitInches[m.group(2)]
+
+# Open an SVG given as a file name or as the document itself
+def openSVG (source):
+    if source.lstrip().startswith("<"):
+        return io.StringIO(source)
+    return open(source, "rb")
+
+# The document size in inches, (width, height), from the root element's
+# width and height (or viewBox, if they're missing).  Only the start of
+# the document is read.  Returns None if the size can't be found.
+def documentSize (source):
+    try:
+        with openSVG(source) as f:
+            for event, elem in ET.iterparse(f, events=("start",)):
+                width = lengthInches(elem.get("width"))
+                height = lengthInches(elem.get("height"))
+                if width is None or height is None:
+                    viewBox = (elem.get("viewBox") or "").replace(",", " ").split()
+                    if len(viewBox) == 4:
+                        width = float(viewBox[2]) * unitInches["px"]
+                        height = float(viewBox[3]) * unitInches["px"]
+                if width is None or height is None:
+                    return None
+                return width, height
+    except (OSError, ET.ParseError, ValueError):
+        return None
+    return None
+
+def localName (tag):
+    return tag.rsplit("}", 1)[-1]
+
+# The shared top-level elements (defs etc.) of a document, wherever they
+# are in it.  The rest is dropped as it's read.
+def sharedElements (filename):
+    root = None
+    shared = []
+    depth = 0
+    for event, elem in ET.iterparse(filename, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        if localName(elem.tag) in sharedTags:
+            shared.append(elem)
+        else:
+            elem.clear()
+        root.remove(elem)
+    return shared
+
+# Split a document into a sequence of smaller documents, one for each
+# top-level group (usually a layer), plus one for each run of other
+# top-level elements.  Each part has the original root element and all
+# the shared elements (defs etc.) so it can be plotted on its own.
+# Yields (label, part) pairs, where part is the SVG as a string.
+# The document is read twice: first for the shared elements, as a group
+# may use defs that come after it, and then incrementally for the parts,
+# each dropped from memory once it has been yielded, so only one part is
+# in memory at a time.
+def splitDocument (filename):
+    root = None
+    shared = sharedElements(filename)
+    loose = []
+    depth = 0
+    groups = 0
+
+    def makePart (elems):
+        part = ET.Element(root.tag, root.attrib)
+        part.extend(shared)
+        part.extend(elems)
+        return ET.tostring(part, encoding="unicode")
+
+    for event, elem in ET.iterparse(filename, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        # elem is a complete top-level element
+        tag = localName(elem.tag)
+        if tag in sharedTags:
+            pass    # already in shared
+        elif tag == "g":
+            if loose:
+                yield "elements outside groups", makePart(loose)
+                loose = []
+            groups += 1
+            label = elem.get(f"{{{inkscapeNS}}}label") or elem.get("id") or f"group {groups}"
+            yield label, makePart([elem])
+        else:
+            loose.append(elem)
+        # Anything still needed is in shared or loose, so free the rest
+        root.remove(elem)
+        if tag == "g":
+            elem.clear()
+    if loose:
+        yield "elements outside groups", makePart(loose)
@@ -0,0 +1,339 @@
+# interaxi -- interactive AxiDraw frontend.
+# Virtual plotter: a pseudo-terminal that behaves like an EiBotBoard.
+
+# NOTES:
+# * Run with 'python -m interaxi.virtualebb'.  It prints the name of its
+#   pseudo-terminal (e.g. /dev/pts/3), which can be given to interaxi's
+#   'port' command.  pyaxidraw can only find real USB ports by itself, so
+#   interaxi opens device paths for it (see Session.openPort()).
+# * It answers the EBB commands pyaxidraw sends (firmware 2.8 style replies)
+#   and keeps track of the motor positions, pen and button.
+# * Timing model: every command costs one USB round trip (usbLatency).
+#   Motion and pen commands go into a FIFO like the real board's, whose
+#   length is fifoDepth: the reply is immediate while there's room, and
+#   otherwise waits until the oldest queued command has finished, as the
+#   real board does.  Move times come from the command's duration, or
+#   from its rates and accelerations (LM, L3, T3) at the board's 25kHz
+#   step rate.  QM and QG report the motors as busy until the queue is done.
+#   timeScale speeds it all up (e.g. 0.1) or makes it instant (0).
+# * Every command is recorded with its time, size, reply size, and how
+#   long the reply was held up; --log writes them out as JSON lines, and a
+#   summary is printed when it's stopped (Ctrl-C).
+# * --check runs a short conversation with a board over its own
+#   pseudo-terminal, and checks the replies and where the motors and pen
+#   end up, so changes to it can be checked without a plotter.
+
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import tty
+
+version = "EBBv13_and_above EB Firmware Version 2.8.1"
+tickRate = 25000        # step generator interrupts per second
+rateScale = 2 ** 31     # LM/L3/T3 rates are steps per tick, scaled by this
+
+# Replies to commands that only need an OK, or fixed data
+fixedReplies = {
+    "A": "A,00:0000,01:0000\r\n",
+    "I": "I,000,000,000,000,000\r\n",
+    "QC": "0394,0300\r\nOK\r\n",
+    "QE": "1,1\r\nOK\r\n",
+    "QL": "0\r\nOK\r\n",
+    "QN": "0\r\nOK\r\n",
+    "QR": "1\r\nOK\r\n",
+    "QT": "\r\nOK\r\n",
+    }
+okCommands = {"C", "CN", "CS", "CU", "EM", "MR", "ND", "NI", "O", "PC", "PD", "PG", "PI", "PO",
+              "R", "RB", "SC", "SE", "SL", "SN", "SR", "ST", "QU", "BL"}
+
+class VirtualEBB:
+    def __init__ (self, usbLatency=0.001, fifoDepth=1, timeScale=1.0):
+        self.usbLatency = usbLatency
+        self.fifoDepth = fifoDepth
+        self.timeScale = timeScale
+        self.start = time.monotonic()
+        self.pending = []       # end times of motion commands executing or queued
+        self.position = [0, 0]  # motor step positions
+        self.penUp = True
+        self.motorsOn = False
+        self.buttonPressed = False
+        self.records = []
+        self.log = None
+
+    def now (self):
+        return time.monotonic()
+
+    def sleep (self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    # Queue a motion (or pen) command taking the given time, waiting for room in the FIFO.
+    # Returns the time spent waiting.
+    def queueMotion (self, seconds):
+        seconds *= self.timeScale
+        now = self.now()
+        self.pending = [end for end in self.pending if end > now]
+        waited = 0.0
+        while len(self.pending) > self.fifoDepth:   # one executing plus the FIFO
+            waited += self.pending[0] - now
+            self.sleep(self.pending[0] - now)
+            now = self.now()
+            self.pending = [end for end in self.pending if end > now]
+        startAt = self.pending[-1] if self.pending else now
+        self.pending.append(startAt + seconds)
+        return waited
+
+    def busy (self):
+        now = self.now()
+        self.pending = [end for end in self.pending if end > now]
+        return bool(self.pending)
+
+    # Ticks to do the given steps from a starting rate and acceleration (both scaled)
+    @staticmethod
+    def ticks (steps, rate, accel):
+        steps = abs(steps) * rateScale
+        if steps == 0:
+            return 0.0
+        if accel == 0:
+            return steps / rate if rate > 0 else 0.0
+        # steps = rate n + accel n^2 / 2
+        disc = rate * rate + 2 * accel * steps
+        if disc < 0:
+            return steps / rate if rate > 0 else 0.0
+        return max(0.0, (-rate + disc ** 0.5) / accel)
+
+    def move (self, steps1, steps2, seconds):
+        self.position[0] += steps1
+        self.position[1] += steps2
+        self.motorsOn = True
+        return self.queueMotion(seconds)
+
+    # Handle one command.  Returns (reply, seconds the reply was held up).
+    def handle (self, line):
+        parts = line.strip().split(",")
+        name = parts[0].upper()
+        try:
+            args = [int(p) for p in parts[1:] if p.strip() != ""]
+        except ValueError:
+            args = []
+        waited = 0.0
+        reply = "OK\r\n"
+        try:
+            if name == "V":
+                reply = version + "\r\n"
+            elif name in fixedReplies:
+                reply = fixedReplies[name]
+            elif name == "QB":
+                reply = f"{int(self.buttonPressed)}\r\nOK\r\n"
+                self.buttonPressed = False
+            elif name == "QP":
+                reply = f"{int(self.penUp)}\r\nOK\r\n"
+            elif name == "QS":
+                reply = f"{self.position[0]},{self.position[1]}\n\rOK\r\n"
+            elif name == "QM":
+                busy = int(self.busy())
+                reply = f"QM,{busy},{busy},{busy},{int(len(self.pending) > 1)}\n\r"
+            elif name == "QG":
+                busy = self.busy()
+                bits = (int(self.buttonPressed) << 5) | (int(self.penUp) << 4) | (busy << 3) \
+                       | (busy << 2) | (busy << 1) | int(len(self.pending) > 1)
+                self.buttonPressed = False
+                reply = f"{bits:02X}\r\n"
+            elif name == "ES":
+                self.pending = []
+                reply = "0,0,0,0,0\r\nOK\r\n"
+            elif name == "SM":
+                waited = self.move(args[1], args[2] if len(args) > 2 else 0, args[0] / 1000)
+            elif name == "XM":
+                a, b = args[1], args[2] if len(args) > 2 else 0
+                waited = self.move(a + b, a - b, args[0] / 1000)
+            elif name in ("LM", "L3"):
+                per = 3 if name == "LM" else 4     # L3 also has a jerk for each axis
+                rate1, steps1, accel1 = args[0:3]
+                rate2, steps2, accel2 = args[per:per + 3]
+                ticks = max(self.ticks(steps1, rate1, accel1), self.ticks(steps2, rate2, accel2))
+                waited = self.move(steps1, steps2, ticks / tickRate)
+            elif name == "T3":
+                intervals = args[0]
+                rate1, accel1 = args[1:3]
+                rate2, accel2 = args[4:6]
+                steps1 = int((rate1 * intervals + accel1 * intervals * intervals / 2) / rateScale)
+                steps2 = int((rate2 * intervals + accel2 * intervals * intervals / 2) / rateScale)
+                waited = self.move(steps1, steps2, intervals / tickRate)
+            elif name == "HM":
+                target = args[1:3] if len(args) >= 3 else [0, 0]
+                distance = max(abs(target[0] - self.position[0]), abs(target[1] - self.position[1]))
+                seconds = distance / args[0] if args[0] > 0 else 0.0
+                waited = self.move(target[0] - self.position[0], target[1] - self.position[1], seconds)
+            elif name == "SP":
+                self.penUp = bool(args[0])
+                waited = self.queueMotion(args[1] / 1000 if len(args) > 1 else 0.0)
+            elif name == "TP":
+                self.penUp = not self.penUp
+                waited = self.queueMotion(args[0] / 1000 if args else 0.0)
+            elif name == "S2":
+                waited = self.queueMotion(args[3] / 1000 if len(args) > 3 else 0.0)
+            elif name == "EM":
+                self.motorsOn = bool(args and (args[0] or (len(args) > 1 and args[1])))
+            elif name == "CS":
+                self.position = [0, 0]
+            elif name not in okCommands:
+                reply = f"!8 Err: Unknown command '{name}'\n\r"
+        except (IndexError, ZeroDivisionError):
+            reply = f"!8 Err: Wrong parameters for '{name}'\n\r"
+        return reply, waited
+
+    def record (self, line, received, reply, waited):
+        entry = {"t": round(received - self.start, 6), "cmd": line, "in": len(line) + 1,
+                 "out": len(reply), "wait_ms": round(1000 * waited, 3),
+                 "reply_ms": round(1000 * (self.now() - received), 3)}
+        self.records.append(entry)
+        if self.log:
+            self.log.write(json.dumps(entry) + "\n")
+
+    # Serve commands on the pseudo-terminal master until stopped
+    def serve (self, master):
+        buffer = b""
+        while True:
+            data = os.read(master, 4096)
+            if not data:
+                break
+            buffer += data
+            while True:
+                ends = [i for i in (buffer.find(b"\r"), buffer.find(b"\n")) if i >= 0]
+                if not ends:
+                    break
+                end = min(ends)
+                line = buffer[:end].decode("ascii", "replace")
+                buffer = buffer[end + 1:]
+                if not line.strip():
+                    continue
+                received = self.now()
+                reply, waited = self.handle(line)
+                self.sleep(self.usbLatency * self.timeScale)
+                os.write(master, reply.encode("ascii"))
+                self.record(line, received, reply, waited)
+
+    def summary (self):
+        if not self.records:
+            print("No commands received")
+            return
+        counts = {}
+        for r in self.records:
+            name = r["cmd"].split(",")[0].upper()
+            count, waited = counts.get(name, (0, 0.0))
+            counts[name] = (count + 1, waited + r["wait_ms"])
+        span = self.records[-1]["t"] - self.records[0]["t"]
+        print(f"{len(self.records)} commands in {span:.2f} s, "
+              f"{sum(r['in'] for r in self.records)} bytes in, {sum(r['out'] for r in self.records)} bytes out")
+        replies = sorted(r["reply_ms"] for r in self.records)
+        print(f"reply time ms: median {replies[len(replies) // 2]:.2f}  max {replies[-1]:.2f}")
+        for name, (count, waited) in sorted(counts.items(), key=lambda kv: -kv[1][0]):
+            print(f"  {name:<4} {count:7d}  waiting for the FIFO {waited / 1000:8.2f} s")
+
+# Commands for --check, with what the reply must start with.  The moves
+# add up to (300, -300) steps, and the pen ends up down.
+checkSteps = [
+        ("V", "EBBv13"),
+        ("EM,1,1", "OK"),
+        ("SP,1,0", "OK"),
+        ("SM,100,200,0", "OK"),
+        ("XM,100,50,50", "OK"),
+        ("LM,85899345,0,0,85899345,-300,0", "OK"),
+        ("SP,0,0", "OK"),
+        ("QP", "0"),
+        ("QS", "300,-300"),
+        ("QB", "0"),
+        ("FOO", "!8 Err"),
+        ]
+
+# Talk to a board over a pseudo-terminal, as pyaxidraw would.
+# Returns 0 if all the replies and the board's state are as expected, else 1.
+def selfCheck ():
+    ebb = VirtualEBB(usbLatency=0, timeScale=0)
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    def serve ():
+        try:
+            ebb.serve(master)
+        except OSError:
+            pass    # the other end was closed
+    threading.Thread(target=serve, daemon=True).start()
+    failures = 0
+    with open(os.ttyname(slave), "r+b", buffering=0) as port:
+        for command, expected in checkSteps:
+            os.write(port.fileno(), (command + "\r").encode("ascii"))
+            reply = b""
+            while not reply.endswith((b"\r\n", b"\n\r")):
+                reply += os.read(port.fileno(), 256)
+            text = reply.decode("ascii").strip()
+            if not text.startswith(expected):
+                print(f"{command}: expected '{expected}', got '{text}'")
+                failures += 1
+    os.close(slave)
+    print(f"check: {len(checkSteps) - failures} of {len(checkSteps)} replies as expected")
+    if ebb.position != [300, -300] or ebb.penUp or not ebb.motorsOn:
+        print(f"check: the board ended with the motors at {ebb.position}, the pen {'up' if ebb.penUp else 'down'} "
+              f"and the motors {'on' if ebb.motorsOn else 'off'} -- expected [300, -300], down and on")
+        failures += 1
+    return 1 if failures else 0
+
+def main ():
+    parser = argparse.ArgumentParser(description="Virtual AxiDraw: a pseudo-terminal that behaves like an EiBotBoard")
+    parser.add_argument("--link", metavar="PATH",
+            help="also make a symbolic link to the pseudo-terminal at PATH, e.g. /tmp/axidraw")
+    parser.add_argument("--log", metavar="FILE",
+            help="write each command, with its timing, to FILE as JSON lines")
+    parser.add_argument("--latency", type=float, default=1.0, metavar="MS",
+            help="USB round trip time for each command (default 1 ms)")
+    parser.add_argument("--fifo", type=int, default=1,
+            help="number of motion commands the board can queue (default 1)")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+            help="multiply all times by this: less than 1 for faster than real, 0 for instant (default 1)")
+    parser.add_argument("--button", type=float, metavar="SECONDS",
+            help="press the button every SECONDS seconds (for testing pause and resume)")
+    parser.add_argument("--check", action="store_true",
+            help="check the board's replies over a pseudo-terminal, and exit")
+    args = parser.parse_args()
+    if args.check:
+        return selfCheck()
+
+    ebb = VirtualEBB(args.latency / 1000, args.fifo, args.time_scale)
+    master, slave = os.openpty()
+    tty.setraw(slave)       # no echo or line editing -- it's a serial line
+    name = os.ttyname(slave)
+    if args.link:
+        try:
+            os.unlink(args.link)
+        except FileNotFoundError:
+            pass
+        os.symlink(name, args.link)
+        name = args.link
+    if args.log:
+        ebb.log = open(args.log, "w", buffering=1)
+    if args.button:
+        def press (*_):
+            ebb.buttonPressed = True
+        signal.signal(signal.SIGALRM, press)
+        signal.setitimer(signal.ITIMER_REAL, args.button, args.button)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))     # still print the summary
+    print(f"Virtual plotter on {name} -- use 'port {name}' in interaxi.  Ctrl-C to stop.", flush=True)
+    try:
+        ebb.serve(master)
+    except KeyboardInterrupt:
+        print()
+    finally:
+        if args.link:
+            try:
+                os.unlink(args.link)
+            except OSError:
+                pass
+        ebb.summary()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())